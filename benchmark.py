@@ -0,0 +1,303 @@
+"""可重复的性能基准
+
+在临时目录下按固定的随机种子生成一棵合成的目录树（深度、每层子目录数、每个目录的文件数、
+中文文件名比例都可以配置），然后依次测量：
+
+- 扫描：ParallelScanner 只扫描不写库的 files/sec（先预热目录缓存，取多轮中最快的一次）
+- 写入：把扫描结果交给 IndexWriter 写入新数据库的 rows/sec，以及建立索引、全文索引和
+  .names 文件名索引各自的耗时
+- 大小：数据库和 .names 文件的字节数
+- 查询：几类典型关键词第一页结果和统计总数的延迟分位数（毫秒）
+
+相同的参数和种子生成完全相同的目录树，结果以 JSON 写入文件（包含当前提交、Python 和
+SQLite 版本），可以用 --compare 和之前保存的结果逐项对比。
+
+    python benchmark.py [--depth 3] [--fanout 8] [--files 30] [--cjk 0.2] [--seed 1]
+                        [--rounds 20] [--out 结果.json] [--compare 旧结果.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+from engine import build_sidecar
+from index_db import create_indexes, file_row, open_readonly
+from index_writer import IndexWriter
+from name_index import NameIndex, sidecar_path
+from scanner import ParallelScanner, DEFAULT_SCANNER
+from search import build_fts_index, search_files, count_matches, fuzzy_search
+
+WORDS = ['report', 'photo', 'music', 'video', 'data', 'backup', 'project', 'readme', 'invoice',
+         'draft', 'final', 'notes', 'summary', 'config', 'setup', 'library', 'screenshot', 'meeting']
+CJK_WORDS = ['报告', '照片', '音乐', '视频', '数据', '备份', '项目', '合同', '会议', '总结', '草稿', '发票']
+EXTENSIONS = ['txt', 'jpg', 'png', 'docx', 'xlsx', 'pdf', 'mp3', 'mp4', 'py', 'log', 'zip', 'exe']
+SEPARATORS = ['_', '-', ' ', '']
+# 生成的文件修改时间落在这个时间之前的两年内，保证可重复
+BASE_MTIME = 1700000000
+
+# 典型查询：(名称, 关键词)
+QUERIES = [
+    ('common', 'report'),
+    ('short', 'da'),
+    ('rare', 'invoice_final'),
+    ('cjk', '报告'),
+    ('missing', 'zzzqqq'),
+    ('ext', 'ext:pdf'),
+    ('wildcard', 'photo*.jpg'),
+    ('filters', 'music ext:mp3 size:>100kb'),
+]
+FUZZY_QUERIES = [('fuzzy', 'reprot')]
+
+
+def _random_name(rng, cjk_ratio):
+    words = CJK_WORDS if rng.random() < cjk_ratio else WORDS
+    parts = rng.sample(words, rng.randint(1, 3))
+    if rng.random() < 0.5:
+        parts.append(str(rng.randint(1, 99999)))
+    return rng.choice(SEPARATORS).join(parts)
+
+
+def generate_tree(root, depth=3, fanout=8, files_per_dir=30, cjk_ratio=0.2, seed=1):
+    """在 root 下生成合成目录树，返回 (目录数, 文件数)
+
+    文件内容为空，大小用稀疏文件表示（truncate 不占用磁盘空间），修改时间由种子决定。
+    """
+    rng = random.Random(seed)
+    dir_count = 0
+    file_count = 0
+    pending = [(root, 0)]
+    while pending:
+        path, level = pending.pop()
+        os.makedirs(path, exist_ok=True)
+        dir_count += 1
+        used = set()
+        for _ in range(files_per_dir):
+            name = f"{_random_name(rng, cjk_ratio)}.{rng.choice(EXTENSIONS)}"
+            if name in used:
+                continue
+            used.add(name)
+            file_path = os.path.join(path, name)
+            with open(file_path, 'wb') as f:
+                # 大小按对数分布，大多数文件很小，少数几百 MB
+                f.truncate(int(10 ** rng.uniform(1, 8.5)))
+            mtime = BASE_MTIME - rng.randint(0, 2 * 365 * 86400)
+            os.utime(file_path, (mtime, mtime))
+            file_count += 1
+        if level < depth:
+            for i in range(fanout):
+                pending.append((os.path.join(path, f"{_random_name(rng, cjk_ratio)}_{i}"), level + 1))
+    return dir_count, file_count
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """按最近秩法计算分位数"""
+    ordered = sorted(samples)
+    result = {}
+    for p in points:
+        rank = max(1, -(-p * len(ordered) // 100))
+        result[f"p{p}"] = ordered[rank - 1]
+    return result
+
+
+def bench_scan(root, rounds=3):
+    """只扫描不写库，先扫描一遍预热目录缓存，返回 (文件数, 最快一轮的秒数)"""
+    best = None
+    count = 0
+    for round_index in range(rounds + 1):
+        counted = []
+        scanner = ParallelScanner(DEFAULT_SCANNER)
+        begin = time.perf_counter()
+        scanner.run([root], lambda root, rows, dirs, done: counted.append(len(rows)))
+        elapsed = time.perf_counter() - begin
+        count = sum(counted)
+        if round_index > 0 and (best is None or elapsed < best):
+            best = elapsed
+    return count, best
+
+
+def bench_build(root, db_path):
+    """扫描结果先收集在内存中，再单独测量写入和建立各种索引的耗时"""
+    batches = []
+    scanner = ParallelScanner(DEFAULT_SCANNER, row_factory=file_row)
+    scanner.run([root], lambda root, rows, dirs, done: batches.append((root, rows, dirs)))
+    rows = sum(len(batch[1]) for batch in batches)
+
+    timings = {}
+    begin = time.perf_counter()
+    writer = IndexWriter(db_path)
+    writer.start()
+    for batch in batches:
+        writer.put(*batch)
+    writer.close()
+    timings['insert'] = time.perf_counter() - begin
+
+    conn = sqlite3.connect(db_path)
+    try:
+        begin = time.perf_counter()
+        create_indexes(conn)
+        conn.commit()
+        timings['indexes'] = time.perf_counter() - begin
+        begin = time.perf_counter()
+        build_fts_index(conn)
+        timings['fts'] = time.perf_counter() - begin
+        # 和发布数据库时一样合并 WAL，数据库大小才是最终大小
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        conn.close()
+
+    begin = time.perf_counter()
+    build_sidecar(db_path)
+    timings['names'] = time.perf_counter() - begin
+    return rows, timings
+
+
+def bench_queries(db_path, rounds=20):
+    """每个查询先执行一次预热，再执行 rounds 次，返回 {名称: 延迟分位数（毫秒）}"""
+    results = {}
+    conn = open_readonly(db_path)
+    name_index = NameIndex.open(db_path)
+    try:
+        tasks = [(name, 'first_page', lambda k: search_files(conn, k, 100, name_index), keyword)
+                 for name, keyword in QUERIES]
+        tasks += [(name, 'count', lambda k: count_matches(conn, k, name_index), keyword)
+                  for name, keyword in QUERIES]
+        tasks += [(name, 'fuzzy', lambda k: fuzzy_search(conn, name_index, k), keyword)
+                  for name, keyword in FUZZY_QUERIES]
+        for name, kind, run, keyword in tasks:
+            hits = run(keyword)
+            samples = []
+            for _ in range(rounds):
+                begin = time.perf_counter()
+                run(keyword)
+                samples.append((time.perf_counter() - begin) * 1000)
+            entry = {key: round(value, 3) for key, value in percentiles(samples).items()}
+            entry['keyword'] = keyword
+            entry['hits'] = hits if kind == 'count' else len(hits)
+            results.setdefault(kind, {})[name] = entry
+    finally:
+        if name_index is not None:
+            name_index.close()
+        conn.close()
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(depth=3, fanout=8, files_per_dir=30, cjk_ratio=0.2, seed=1, rounds=20, workdir=None):
+    """生成目录树并完成全部测量，返回可以直接写成 JSON 的结果"""
+    params = {'depth': depth, 'fanout': fanout, 'files_per_dir': files_per_dir,
+              'cjk_ratio': cjk_ratio, 'seed': seed, 'rounds': rounds}
+    base = tempfile.mkdtemp(prefix='everything_bench_', dir=workdir)
+    try:
+        root = os.path.join(base, 'tree')
+        begin = time.perf_counter()
+        dir_count, file_count = generate_tree(root, depth, fanout, files_per_dir, cjk_ratio, seed)
+        generate_time = time.perf_counter() - begin
+
+        scanned, scan_time = bench_scan(root)
+        db_path = os.path.join(base, 'bench.db')
+        rows, timings = bench_build(root, db_path)
+        queries = bench_queries(db_path, rounds)
+
+        return {
+            'meta': {
+                'commit': _git_commit(),
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'params': params,
+            'tree': {'dirs': dir_count, 'files': file_count, 'generate_sec': round(generate_time, 3)},
+            'scan': {'files': scanned, 'sec': round(scan_time, 4),
+                     'files_per_sec': round(scanned / scan_time) if scan_time > 0 else None},
+            'build': {
+                'rows': rows,
+                'insert_rows_per_sec': round(rows / timings['insert']) if timings['insert'] > 0 else None,
+                **{f"{name}_sec": round(value, 4) for name, value in timings.items()},
+            },
+            'size': {
+                'db_bytes': os.path.getsize(db_path),
+                'names_bytes': os.path.getsize(sidecar_path(db_path)),
+                'db_bytes_per_file': round(os.path.getsize(db_path) / max(rows, 1), 1),
+            },
+            'queries': queries,
+        }
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+def _flatten(data, prefix=''):
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, name + '.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def compare_results(old, new):
+    """逐项对比两次结果中的数值，返回 [(名称, 旧值, 新值, 变化百分比)]"""
+    old_values = dict(_flatten({key: old.get(key, {}) for key in ('scan', 'build', 'size', 'queries')}))
+    rows = []
+    for name, value in _flatten({key: new.get(key, {}) for key in ('scan', 'build', 'size', 'queries')}):
+        before = old_values.get(name)
+        change = (value - before) / before * 100 if before else None
+        rows.append((name, before, value, change))
+    return rows
+
+
+def print_summary(result):
+    tree, scan, build, size = result['tree'], result['scan'], result['build'], result['size']
+    print(f"目录树: {tree['dirs']} 个目录, {tree['files']} 个文件 (种子 {result['params']['seed']})")
+    print(f"扫描: {scan['files_per_sec']:,} files/sec")
+    print(f"写入: {build['insert_rows_per_sec']:,} rows/sec, 建索引 {build['indexes_sec']:.2f} 秒, "
+          f"全文索引 {build['fts_sec']:.2f} 秒, 文件名索引 {build['names_sec']:.2f} 秒")
+    print(f"大小: 数据库 {size['db_bytes']:,} 字节 ({size['db_bytes_per_file']} 字节/文件), "
+          f".names {size['names_bytes']:,} 字节")
+    for kind, entries in result['queries'].items():
+        for name, entry in entries.items():
+            print(f"查询 {kind:>10} {name:>8}: p50 {entry['p50']:.2f} ms, p90 {entry['p90']:.2f} ms, "
+                  f"p99 {entry['p99']:.2f} ms ({entry['hits']} 条, {entry['keyword']})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Python Everything 性能基准')
+    parser.add_argument('--depth', type=int, default=3, help='目录树深度')
+    parser.add_argument('--fanout', type=int, default=8, help='每个目录的子目录数')
+    parser.add_argument('--files', type=int, default=30, help='每个目录的文件数')
+    parser.add_argument('--cjk', type=float, default=0.2, help='中文文件名的比例')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--rounds', type=int, default=20, help='每个查询执行的次数')
+    parser.add_argument('--workdir', help='生成目录树的位置（默认系统临时目录）')
+    parser.add_argument('--out', help='把结果写入 JSON 文件')
+    parser.add_argument('--compare', help='与之前保存的 JSON 结果对比')
+    args = parser.parse_args()
+
+    result = run_benchmark(args.depth, args.fanout, args.files, args.cjk, args.seed, args.rounds, args.workdir)
+    print_summary(result)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.out}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        print(f"与 {args.compare}（提交 {previous.get('meta', {}).get('commit')}）对比:")
+        for name, before, after, change in compare_results(previous, result):
+            change_text = '' if change is None else f" ({change:+.1f}%)"
+            print(f"  {name}: {before} -> {after}{change_text}")
@@ -0,0 +1,131 @@
+"""完整索引的断点，停止或崩溃后可以继续扫描
+
+断点直接保存在正在写入的临时数据库中：
+- scan_done        已经列完的目录编号。一个目录的文件、子目录记录和它的完成标记由写入线程
+                   在同一个事务中写入，所以 dirs 中有记录、scan_done 中没有的目录就是还没有
+                   扫描的前沿，已经提交的部分不会重复，也不会遗漏
+- scan_checkpoint  只有一行：扫描的根目录、快照名称、已经提交的文件数和目录数、更新时间，
+                   写入线程每次提交时在同一个事务中更新
+
+继续扫描时目录编号从 dirs 的最大编号之后继续分配，只扫描前沿目录，已经完成的子树
+不会重新扫描。扫描全部完成后删除 scan_done 并把 scanned 标记为 1，之后中断只需要
+重新建立索引；发布最终数据库之前删除 scan_checkpoint，最终数据库中不含断点。
+"""
+import json
+import os
+import sqlite3
+import time
+
+from index_db import table_exists, dir_prefix, DirPaths
+
+CHECKPOINT_TABLES_SQL = [
+    "CREATE TABLE IF NOT EXISTS scan_done (dir_id INTEGER PRIMARY KEY)",
+    """
+    CREATE TABLE IF NOT EXISTS scan_checkpoint (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        roots TEXT NOT NULL,
+        label TEXT NOT NULL,
+        scanner TEXT,
+        rows INTEGER NOT NULL DEFAULT 0,
+        dirs INTEGER NOT NULL DEFAULT 0,
+        scanned INTEGER NOT NULL DEFAULT 0,
+        started_at REAL,
+        updated_at REAL
+    )
+    """,
+]
+
+INSERT_DONE_SQL = "INSERT OR IGNORE INTO scan_done (dir_id) VALUES (?)"
+UPDATE_CHECKPOINT_SQL = "UPDATE scan_checkpoint SET rows = ?, dirs = ?, updated_at = ? WHERE id = 1"
+
+
+def start_checkpoint(conn, roots, label, scanner_name):
+    """开始新的扫描时写入断点的表头，调用方负责提交"""
+    for sql in CHECKPOINT_TABLES_SQL:
+        conn.execute(sql)
+    now = time.time()
+    conn.execute(
+        "INSERT OR REPLACE INTO scan_checkpoint (id, roots, label, scanner, started_at, updated_at) "
+        "VALUES (1, ?, ?, ?, ?, ?)",
+        (json.dumps(list(roots), ensure_ascii=False), label, scanner_name, now, now)
+    )
+
+
+def update_checkpoint(conn, rows, dirs):
+    """在写入线程提交前更新已提交的文件数和目录数"""
+    conn.execute(UPDATE_CHECKPOINT_SQL, (rows, dirs, time.time()))
+
+
+def read_checkpoint(db_path):
+    """读取临时数据库中的断点，没有断点（或数据库不存在、已损坏）时返回 None"""
+    if not os.path.exists(db_path):
+        return None
+    try:
+        conn = sqlite3.connect(db_path)
+        try:
+            if not table_exists(conn, 'scan_checkpoint'):
+                return None
+            row = conn.execute(
+                "SELECT roots, label, scanner, rows, dirs, scanned, started_at, updated_at "
+                "FROM scan_checkpoint WHERE id = 1"
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"无法读取索引断点 {db_path}: {e}")
+        return None
+    if row is None:
+        return None
+    roots, label, scanner, rows, dirs, scanned, started_at, updated_at = row
+    return {
+        'roots': json.loads(roots),
+        'label': label,
+        'scanner': scanner,
+        'rows': rows,
+        'dirs': dirs,
+        'scanned': bool(scanned),
+        'started_at': started_at,
+        'updated_at': updated_at,
+    }
+
+
+def _owning_root(roots, path):
+    for root in roots:
+        if path == root or path.startswith(dir_prefix(root)):
+            return root
+    return None
+
+
+def load_frontier(conn, roots):
+    """找出还没有扫描的目录，返回 ({根目录: [(路径, 目录编号), ...]}, 下一个目录编号)
+
+    根目录本身还没有写入时不在结果中，调用方按新的根目录从头扫描。
+    """
+    paths = DirPaths(conn)
+    frontier = {}
+    for (name,) in conn.execute("SELECT name FROM dirs WHERE parent_id IS NULL"):
+        if name in roots:
+            frontier[name] = []
+    pending = conn.execute(
+        "SELECT id FROM dirs WHERE id NOT IN (SELECT dir_id FROM scan_done) ORDER BY id"
+    ).fetchall()
+    for (dir_id,) in pending:
+        path = paths.path(dir_id)
+        root = _owning_root(roots, path) if path is not None else None
+        if root is not None and root in frontier:
+            frontier[root].append((path, dir_id))
+    last_id = conn.execute("SELECT max(id) FROM dirs").fetchone()[0] or 0
+    return frontier, last_id + 1
+
+
+def finish_scan(conn):
+    """扫描完成：删除已完成目录的记录，只保留表头，调用方负责提交"""
+    conn.execute("DROP TABLE IF EXISTS scan_done")
+    conn.execute("UPDATE scan_checkpoint SET scanned = 1, updated_at = ? WHERE id = 1", (time.time(),))
+
+
+def clear_checkpoint(conn):
+    """发布最终数据库之前删除断点"""
+    conn.execute("DROP TABLE IF EXISTS scan_done")
+    conn.execute("DROP TABLE IF EXISTS scan_checkpoint")
+    conn.commit()
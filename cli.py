@@ -0,0 +1,312 @@
+"""命令行入口，不需要图形界面
+
+    python cli.py index 路径... [--db-folder 目录] [--update 数据库] [--speed balanced]
+    python cli.py index --resume
+    python cli.py index 路径... --store
+    python cli.py search 关键词 [--db 数据库 | --snapshot 快照] [--limit N] [--fuzzy] [--count]
+    python cli.py stats [--db 数据库] [--json]
+    python cli.py serve [--db 数据库] [--port 端口] [--pool N]
+    python cli.py dupes [--db 数据库] [--min-size 1mb] [--query 条件] [--workers N] [--json]
+    python cli.py sizes [目录] [--db 数据库] [--top N] [--json]
+    python cli.py snapshots list|import|add|checkout|compact [数据库或快照] [--keep] [--out 路径]
+
+没有指定 --db 时使用图形界面最后打开的数据库（数据库目录下的 config.ini）。
+为了让 --help 和参数错误的提示足够快，引擎模块只在执行具体命令时才导入，
+顶层只导入标准库。
+"""
+import argparse
+import os
+import sys
+
+
+def _default_database(db_folder):
+    from engine import load_last_database
+
+    last_db = load_last_database(db_folder)
+    if not last_db:
+        return None
+    db_path = os.path.join(db_folder, last_db)
+    return db_path if os.path.exists(db_path) else None
+
+
+def _resolve_database(args):
+    if getattr(args, 'snapshot', None):
+        from snapshot_store import SnapshotStore
+
+        # 快照库中的快照按需还原到数据库目录下
+        try:
+            return SnapshotStore(args.db_folder).checkout(args.snapshot, on_progress=_print_progress)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(2)
+    db_path = args.db or _default_database(args.db_folder)
+    if not db_path or not os.path.exists(db_path):
+        print("没有找到数据库，请用 --db 指定数据库文件", file=sys.stderr)
+        sys.exit(2)
+    return db_path
+
+
+def _print_progress(message):
+    # 进度信息写到标准错误，标准输出只留给结果
+    print(message, file=sys.stderr)
+
+
+def command_index(args):
+    from engine import full_index, update_database, snapshot_label, pending_index, save_last_database
+    from throttle import Throttle
+
+    throttle = Throttle.from_profile(args.speed, max_files_per_sec=args.max_files_per_sec)
+    if args.update:
+        stats = update_database(args.update, args.paths or None, on_progress=_print_progress, throttle=throttle)
+        print(f"增量更新完成！{stats}")
+        return
+
+    if args.resume:
+        checkpoint = pending_index(args.db_folder)
+        if checkpoint is None:
+            print("没有需要继续的索引", file=sys.stderr)
+            sys.exit(2)
+        db_path, total = full_index(checkpoint['roots'], args.db_folder, checkpoint['label'],
+                                    scanner_name=checkpoint['scanner'], workers=args.workers,
+                                    on_progress=_print_progress, resume=True, throttle=throttle)
+        # 与图形界面一样记下新数据库，之后的命令不指定 --db 时使用它
+        save_last_database(args.db_folder, db_path)
+        print(f"索引完成！共索引 {total} 个文件: {db_path}")
+        return
+
+    roots = [os.path.abspath(path) for path in args.paths]
+    if not roots:
+        print("请指定要索引的目录", file=sys.stderr)
+        sys.exit(2)
+    drives = [root for root in roots if root.endswith(':\\')]
+    if len(drives) == len(roots):
+        label = snapshot_label(drives)
+    elif len(roots) == 1:
+        label = snapshot_label(specific_dir=roots[0])
+    else:
+        print("一次只能索引一个目录，或者若干个驱动器", file=sys.stderr)
+        sys.exit(2)
+
+    os.makedirs(args.db_folder, exist_ok=True)
+    db_path, total = full_index(roots, args.db_folder, label, workers=args.workers,
+                                on_progress=_print_progress, throttle=throttle)
+    print(f"索引完成！共索引 {total} 个文件: {db_path}")
+    if args.store:
+        from snapshot_store import SnapshotStore
+
+        snapshot = SnapshotStore(args.db_folder).add(db_path)
+        print(f"已加入快照库: {snapshot.id} {snapshot.name}")
+    else:
+        save_last_database(args.db_folder, db_path)
+
+
+def command_search(args):
+    db_path = _resolve_database(args)
+    if args.count:
+        from index_db import open_readonly
+        from name_index import NameIndex
+        from search import count_matches
+
+        conn = open_readonly(db_path)
+        name_index = NameIndex.open(db_path)
+        try:
+            print(count_matches(conn, args.keyword, name_index))
+        finally:
+            if name_index is not None:
+                name_index.close()
+            conn.close()
+        return
+
+    from engine import search_database
+
+    for path, filename, size, mtime in search_database(db_path, args.keyword, args.limit, args.fuzzy):
+        print(path)
+
+
+def command_stats(args):
+    from engine import database_stats
+
+    stats = database_stats(_resolve_database(args))
+    if args.json:
+        import json
+        print(json.dumps(stats, ensure_ascii=False))
+        return
+    for key, value in stats.items():
+        print(f"{key}: {value}")
+
+
+def command_serve(args):
+    from query_server import QueryServer
+
+    server = QueryServer(_resolve_database(args), args.db_folder, args.port, args.pool)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def command_dupes(args):
+    from duplicates import find_duplicates, wasted_bytes, DuplicateStats
+    from query import parse_size, QueryError
+
+    try:
+        min_size = parse_size('>=' + args.min_size)[0] if args.min_size else 1
+        stats = DuplicateStats()
+        groups = find_duplicates(_resolve_database(args), min_size, args.query, args.workers,
+                                 stats=stats, on_progress=_print_progress)
+    except (QueryError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    if args.json:
+        import json
+        for group in groups:
+            print(json.dumps({'size': group.size, 'hash': group.digest, 'wasted': wasted_bytes(group),
+                              'paths': group.paths}, ensure_ascii=False))
+    else:
+        for group in groups:
+            print(f"# {len(group.paths)} 个文件，每个 {group.size:,} 字节，可释放 {wasted_bytes(group):,} 字节")
+            for path in group.paths:
+                print(path)
+            print()
+    _print_progress(str(stats))
+
+
+def command_sizes(args):
+    from dir_sizes import has_rollups, top_children, dir_size, lookup_dir, format_size
+    from index_db import open_readonly
+
+    conn = open_readonly(_resolve_database(args))
+    try:
+        if not has_rollups(conn):
+            print("数据库中没有目录大小汇总，请先增量更新一次（python cli.py index --update 数据库）", file=sys.stderr)
+            sys.exit(2)
+        dir_id = None
+        if args.path:
+            dir_id = lookup_dir(conn, os.path.abspath(args.path))
+            if dir_id is None:
+                print(f"数据库中没有这个目录: {args.path}", file=sys.stderr)
+                sys.exit(2)
+        children = top_children(conn, dir_id, args.top)
+        own = dir_size(conn, dir_id) if dir_id is not None else None
+    finally:
+        conn.close()
+
+    base = os.path.abspath(args.path) if args.path else None
+    if args.json:
+        import json
+        for child in children:
+            print(json.dumps({'path': os.path.join(base, child.name) if base else child.name,
+                              'size': child.total_size, 'files': child.total_files}, ensure_ascii=False))
+        return
+    if own is not None:
+        print(f"{base}: {format_size(own[3])}, {own[2]:,} 个文件（其中直接包含 {own[0]:,} 个文件，{format_size(own[1])}）")
+    for child in children:
+        print(f"{format_size(child.total_size):>12}  {child.total_files:>10,}  {child.name}")
+
+
+def command_snapshots(args):
+    from snapshot_store import SnapshotStore
+    from dir_sizes import format_size
+
+    store = SnapshotStore(args.db_folder)
+    try:
+        if args.action == 'list':
+            for snapshot in store.snapshots():
+                print(f"{snapshot.id}\t{snapshot.name}\t{snapshot.files} 个文件\t{format_size(snapshot.total_size)}\t"
+                      f"差异 {snapshot.delta_rows} 行")
+            print(f"快照库占用 {format_size(store.store_bytes())}")
+        elif args.action == 'import':
+            # 图形界面最后打开的数据库可能正在使用，加入后保留原文件
+            current = _default_database(args.db_folder)
+            added = store.import_folder([current] if current else [], on_progress=_print_progress)
+            print(f"导入了 {added} 个快照")
+        elif not args.target and args.action in ('add', 'checkout'):
+            print("请指定数据库文件或快照", file=sys.stderr)
+            sys.exit(2)
+        elif args.action == 'add':
+            snapshot = store.add(args.target, keep_source=args.keep)
+            print(f"已加入快照库: {snapshot.id} {snapshot.name}")
+        elif args.action == 'checkout':
+            print(store.checkout(args.target, args.out, on_progress=_print_progress))
+        else:
+            dropped = store.compact(args.keep_last, args.keep_daily)
+            print(f"删除了 {dropped} 个快照，快照库占用 {format_size(store.store_bytes())}")
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description='Python Everything 命令行')
+    # 与 engine.DEFAULT_DB_FOLDER 相同，这里不导入 engine，--help 不需要加载任何引擎模块
+    default_folder = os.path.join(os.path.expanduser('~'), 'Everything_like_By_WZ')
+    parser.add_argument('--db-folder', default=default_folder, help='数据库目录（默认与图形界面相同）')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    index = commands.add_parser('index', help='完整索引目录或驱动器，生成新的快照数据库')
+    index.add_argument('paths', nargs='*', help='要索引的目录或驱动器')
+    index.add_argument('--update', metavar='DB', help='在这个数据库上增量更新，而不是生成新的数据库')
+    index.add_argument('--workers', type=int, help='扫描线程数')
+    index.add_argument('--resume', action='store_true', help='从断点继续上次停止或中断的完整索引')
+    # 与 throttle.PROFILES 的名称相同
+    index.add_argument('--speed', choices=('full', 'balanced', 'gentle'), default='full',
+                       help='索引速度：全速，或者限速并在磁盘繁忙时自动降速的后台模式')
+    index.add_argument('--max-files-per-sec', type=int, help='文件/秒上限，覆盖 --speed 的预设；单独指定时也按后台模式限速')
+    index.add_argument('--store', action='store_true', help='索引完成后把新数据库加入快照库，不在数据库目录中保留完整副本')
+    index.set_defaults(handler=command_index)
+
+    search = commands.add_parser('search', help='搜索文件名，支持与搜索框相同的语法')
+    search.add_argument('keyword')
+    search.add_argument('--db', help='数据库文件（默认使用最后打开的数据库）')
+    search.add_argument('--snapshot', help='搜索快照库中的快照（编号或名称），需要时先还原')
+    search.add_argument('--limit', type=int, default=100, help='最多显示多少条结果')
+    search.add_argument('--fuzzy', action='store_true', help='按相似度显示近似匹配的结果')
+    search.add_argument('--count', action='store_true', help='只显示匹配总数')
+    search.set_defaults(handler=command_search)
+
+    stats = commands.add_parser('stats', help='显示数据库的文件数、大小和索引情况')
+    stats.add_argument('--db', help='数据库文件（默认使用最后打开的数据库）')
+    stats.add_argument('--json', action='store_true', help='以 JSON 输出')
+    stats.set_defaults(handler=command_stats)
+
+    serve = commands.add_parser('serve', help='启动本地查询服务（见 query_server.py），Ctrl+C 停止')
+    serve.add_argument('--db', help='数据库文件（默认使用最后打开的数据库）')
+    serve.add_argument('--port', type=int, default=8765, help='监听 127.0.0.1 的端口，0 表示自动分配')
+    serve.add_argument('--pool', type=int, default=8, help='数据库连接池大小')
+    serve.set_defaults(handler=command_serve)
+
+    dupes = commands.add_parser('dupes', help='在索引到的文件中查找内容相同的重复文件')
+    dupes.add_argument('--db', help='数据库文件（默认使用最后打开的数据库）')
+    dupes.add_argument('--min-size', help='只比较不小于这个大小的文件，例如 1mb（默认跳过空文件）')
+    dupes.add_argument('--query', help='只在匹配这个条件的文件中查找，语法与搜索框相同')
+    dupes.add_argument('--workers', type=int, help='计算哈希的线程数')
+    dupes.add_argument('--json', action='store_true', help='每组输出一行 JSON')
+    dupes.set_defaults(handler=command_dupes)
+
+    sizes = commands.add_parser('sizes', help='按大小列出目录下最大的子目录，不指定目录时列出扫描的根目录')
+    sizes.add_argument('path', nargs='?', help='数据库中的目录')
+    sizes.add_argument('--db', help='数据库文件（默认使用最后打开的数据库）')
+    sizes.add_argument('--top', type=int, default=20, help='最多列出多少个子目录')
+    sizes.add_argument('--json', action='store_true', help='每个子目录输出一行 JSON')
+    sizes.set_defaults(handler=command_sizes)
+
+    # 与 snapshot_store.KEEP_LAST、KEEP_DAILY 相同
+    snapshots = commands.add_parser('snapshots', help='快照库：只保存一个完整数据库和每次索引的差异')
+    snapshots.add_argument('action', choices=('list', 'import', 'add', 'checkout', 'compact'),
+                           help='列出快照、导入数据库目录中的快照、加入一个数据库、还原快照、按保留策略压缩')
+    snapshots.add_argument('target', nargs='?', help='add 时为数据库文件，checkout 时为快照编号或名称')
+    snapshots.add_argument('--keep', action='store_true', help='add 时保留原来的数据库文件')
+    snapshots.add_argument('--out', help='checkout 时还原到的路径（默认为数据库目录下原来的文件名）')
+    snapshots.add_argument('--keep-last', type=int, default=7, help='compact 时保留最新的几个快照')
+    snapshots.add_argument('--keep-daily', type=int, default=30, help='compact 时保留最近多少天中每天的最后一个快照')
+    snapshots.set_defaults(handler=command_snapshots)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
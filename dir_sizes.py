@@ -0,0 +1,233 @@
+"""目录大小汇总
+
+dir_sizes 表为每个目录保存两组数字：
+- files / size              目录中直接包含的文件数和大小之和
+- total_files / total_size  包括所有子目录在内的文件数和大小之和
+
+"哪些目录最占空间"和逐级展开子目录因此只需要按父目录编号取出子目录排序，
+不用每次在几百万行的 files 上求和。
+
+完整索引时写入线程在写入文件的同一个事务中累加每个目录的直接汇总（断点之后继续扫描
+也不会重复或遗漏），扫描完成后 build_rollups() 自下而上算出递归汇总，同时建立触发器：
+- files 的增删改由触发器立即更新所在目录的直接汇总，并把目录记入 dir_sizes_dirty
+- 删除目录时删除它的汇总，并把父目录记入 dir_sizes_dirty
+
+增量更新和实时监控在提交前调用 refresh_rollups()，只重新计算记录下来的目录及其所有上级
+目录的递归汇总。中途停止时 dir_sizes_dirty 保留在数据库中，下一次更新时一起补上。
+"""
+import os
+from collections import namedtuple, defaultdict
+
+from index_db import table_exists, DirPaths
+
+# 目录视图默认显示的子目录数
+TOP_N = 100
+
+ROLLUP_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS dir_sizes (
+        dir_id INTEGER PRIMARY KEY,
+        files INTEGER NOT NULL DEFAULT 0,
+        size INTEGER NOT NULL DEFAULT 0,
+        total_files INTEGER NOT NULL DEFAULT 0,
+        total_size INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+DIRTY_TABLE_SQL = "CREATE TABLE IF NOT EXISTS dir_sizes_dirty (dir_id INTEGER PRIMARY KEY)"
+
+ADD_DIRECT_SQL = """
+    INSERT INTO dir_sizes (dir_id, files, size) VALUES (?, ?, ?)
+    ON CONFLICT(dir_id) DO UPDATE SET files = files + excluded.files, size = size + excluded.size
+"""
+
+# 触发器里的冲突处理会被触发它的外层语句覆盖（例如 UPSERT_FILE_SQL），
+# 所以不用 OR IGNORE 和 ON CONFLICT，先判断记录是否存在再插入
+_ENSURE_ROW = "INSERT INTO dir_sizes (dir_id) SELECT {id} WHERE NOT EXISTS (SELECT 1 FROM dir_sizes WHERE dir_id = {id});"
+_MARK_DIRTY = ("INSERT INTO dir_sizes_dirty (dir_id) SELECT {id} "
+               "WHERE {id} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM dir_sizes_dirty WHERE dir_id = {id});")
+_ADD_FILE = "UPDATE dir_sizes SET files = files + 1, size = size + coalesce(new.size, 0) WHERE dir_id = new.dir_id;"
+_REMOVE_FILE = "UPDATE dir_sizes SET files = files - 1, size = size - coalesce(old.size, 0) WHERE dir_id = old.dir_id;"
+
+ROLLUP_TRIGGERS_SQL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS dir_sizes_file_insert AFTER INSERT ON files BEGIN
+        {_ENSURE_ROW.format(id='new.dir_id')}
+        {_ADD_FILE}
+        {_MARK_DIRTY.format(id='new.dir_id')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS dir_sizes_file_delete AFTER DELETE ON files BEGIN
+        {_REMOVE_FILE}
+        {_MARK_DIRTY.format(id='old.dir_id')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS dir_sizes_file_update AFTER UPDATE OF dir_id, size ON files BEGIN
+        {_REMOVE_FILE}
+        {_ENSURE_ROW.format(id='new.dir_id')}
+        {_ADD_FILE}
+        {_MARK_DIRTY.format(id='old.dir_id')}
+        {_MARK_DIRTY.format(id='new.dir_id')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS dir_sizes_dir_insert AFTER INSERT ON dirs BEGIN
+        {_MARK_DIRTY.format(id='new.id')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS dir_sizes_dir_delete AFTER DELETE ON dirs BEGIN
+        DELETE FROM dir_sizes WHERE dir_id = old.id;
+        {_MARK_DIRTY.format(id='old.parent_id')}
+    END
+    """,
+]
+
+# 子目录的递归汇总之和加上目录自身的直接汇总
+UPDATE_TOTALS_SQL = """
+    UPDATE dir_sizes SET
+        total_files = files + (SELECT coalesce(sum(s.total_files), 0) FROM dirs d
+                               JOIN dir_sizes s ON s.dir_id = d.id WHERE d.parent_id = :id),
+        total_size = size + (SELECT coalesce(sum(s.total_size), 0) FROM dirs d
+                             JOIN dir_sizes s ON s.dir_id = d.id WHERE d.parent_id = :id)
+    WHERE dir_id = :id
+"""
+
+DirSize = namedtuple('DirSize', ['dir_id', 'name', 'total_size', 'total_files'])
+
+SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB')
+
+
+def format_size(size):
+    """把字节数格式化为 1.5 GB 这样的显示文本"""
+    value = float(size)
+    for unit in SIZE_UNITS:
+        if value < 1024 or unit == SIZE_UNITS[-1]:
+            return f"{value:,.0f} {unit}" if unit == 'B' else f"{value:,.1f} {unit}"
+        value /= 1024
+
+
+def has_rollups(conn):
+    """数据库中是否已经建立了目录大小汇总"""
+    return table_exists(conn, 'dir_sizes') and table_exists(conn, 'dir_sizes_dirty')
+
+
+def create_rollup_table(conn):
+    """建立 dir_sizes 表，完整索引的写入线程在扫描开始前调用"""
+    conn.execute(ROLLUP_TABLE_SQL)
+
+
+def add_direct_sizes(conn, rows):
+    """把一批 files 行 (dir_id, filename, size, mtime) 累加到所在目录的直接汇总"""
+    sums = defaultdict(lambda: [0, 0])
+    for row in rows:
+        entry = sums[row[0]]
+        entry[0] += 1
+        entry[1] += row[2] or 0
+    conn.executemany(ADD_DIRECT_SQL, ((dir_id, count, size) for dir_id, (count, size) in sums.items()))
+
+
+def build_rollups(conn, recount=False):
+    """算出所有目录的递归汇总并建立触发器，调用方负责提交
+
+    recount 为 True 或者还没有 dir_sizes 表时先在 files 上重新统计直接汇总，
+    否则使用写入线程扫描时累加的结果。
+    """
+    if recount or not table_exists(conn, 'dir_sizes'):
+        conn.execute("DROP TABLE IF EXISTS dir_sizes")
+        conn.execute(ROLLUP_TABLE_SQL)
+        conn.execute("INSERT INTO dir_sizes (dir_id, files, size) "
+                     "SELECT dir_id, count(*), coalesce(sum(size), 0) FROM files GROUP BY dir_id")
+
+    children = defaultdict(list)
+    roots = []
+    for dir_id, parent_id in conn.execute("SELECT id, parent_id FROM dirs"):
+        if parent_id is None:
+            roots.append(dir_id)
+        else:
+            children[parent_id].append(dir_id)
+    direct = {dir_id: (files, size) for dir_id, files, size in
+              conn.execute("SELECT dir_id, files, size FROM dir_sizes")}
+
+    # 广度优先排出从上到下的顺序，倒过来累加，子目录总是先于父目录算完
+    order = list(roots)
+    for dir_id in order:
+        order.extend(children.get(dir_id, ()))
+    totals = {}
+    for dir_id in reversed(order):
+        files, size = direct.get(dir_id, (0, 0))
+        for child in children.get(dir_id, ()):
+            child_files, child_size = totals[child]
+            files += child_files
+            size += child_size
+        totals[dir_id] = (files, size)
+
+    conn.execute("DELETE FROM dir_sizes")
+    conn.executemany(
+        "INSERT INTO dir_sizes (dir_id, files, size, total_files, total_size) VALUES (?, ?, ?, ?, ?)",
+        ((dir_id, *direct.get(dir_id, (0, 0)), *totals[dir_id]) for dir_id in order)
+    )
+    conn.execute(DIRTY_TABLE_SQL)
+    conn.execute("DELETE FROM dir_sizes_dirty")
+    for sql in ROLLUP_TRIGGERS_SQL:
+        conn.execute(sql)
+
+
+def refresh_rollups(conn):
+    """重新计算有变化的目录及其上级目录的递归汇总，返回重新计算的目录数，调用方负责提交"""
+    if not has_rollups(conn):
+        return 0
+    dirty = [row[0] for row in conn.execute("SELECT dir_id FROM dir_sizes_dirty")]
+    if not dirty:
+        return 0
+
+    # 每个受影响的目录到根目录的距离，从最深的开始计算
+    depth = {}
+    for dir_id in dirty:
+        chain = []
+        current = dir_id
+        while current is not None and current not in depth:
+            row = conn.execute("SELECT parent_id FROM dirs WHERE id = ?", (current,)).fetchone()
+            if row is None:
+                # 目录已经被删除，它的父目录已经由触发器记下
+                chain = None
+                break
+            chain.append(current)
+            current = row[0]
+        if not chain:
+            continue
+        base = depth[current] if current is not None else -1
+        for offset, chain_id in enumerate(reversed(chain), 1):
+            depth[chain_id] = base + offset
+
+    ordered = sorted(depth, key=depth.get, reverse=True)
+    conn.executemany("INSERT OR IGNORE INTO dir_sizes (dir_id) VALUES (?)", ((dir_id,) for dir_id in ordered))
+    for dir_id in ordered:
+        conn.execute(UPDATE_TOTALS_SQL, {'id': dir_id})
+    conn.execute("DELETE FROM dir_sizes_dirty")
+    return len(ordered)
+
+
+def dir_size(conn, dir_id):
+    """一个目录的 (直接文件数, 直接大小, 递归文件数, 递归大小)，没有汇总时返回 None"""
+    return conn.execute(
+        "SELECT files, size, total_files, total_size FROM dir_sizes WHERE dir_id = ?", (dir_id,)
+    ).fetchone()
+
+
+def top_children(conn, dir_id=None, limit=TOP_N):
+    """dir_id 的子目录按递归大小从大到小排列，最多 limit 个；dir_id 为 None 时列出扫描的根目录"""
+    condition = "d.parent_id IS NULL" if dir_id is None else "d.parent_id = ?"
+    params = () if dir_id is None else (dir_id,)
+    rows = conn.execute(
+        f"SELECT d.id, d.name, s.total_size, s.total_files FROM dirs d JOIN dir_sizes s ON s.dir_id = d.id "
+        f"WHERE {condition} ORDER BY s.total_size DESC, d.name LIMIT ?",
+        params + (limit,)
+    ).fetchall()
+    return [DirSize(*row) for row in rows]
+
+
+def lookup_dir(conn, path):
+    """路径对应的目录编号，不在数据库中时返回 None"""
+    return DirPaths(conn).lookup(os.path.normpath(path))
@@ -0,0 +1,382 @@
+"""基于索引查找重复文件
+
+不重新遍历磁盘，直接从 files 表出发，逐步缩小需要读取的范围：
+
+1. 按大小分组：在 size 索引上找出不止一个文件的大小，只有这些文件可能重复
+2. 部分哈希：读取每个候选文件开头和结尾各 PARTIAL_BYTES 字节计算哈希，按 (大小, 部分哈希)
+   分组，大多数大小相同但内容不同的文件在这一步就被排除。不超过 2 * PARTIAL_BYTES 的
+   文件整个读完，部分哈希就是完整哈希
+3. 完整哈希：只对部分哈希仍然相同的文件读取全部内容，按 (大小, 完整哈希) 分组得到重复文件
+
+哈希在线程池中计算（读文件和 hashlib 都会释放 GIL），每个线程复用一块 READ_BUFFER 大小的
+缓冲区用 readinto 读取。读取前先 stat，大小或修改时间与索引不一致的文件已经变化，跳过。
+
+算出的哈希保存在数据库目录下的 hash_cache.sqlite 中，按 (路径, 大小, 修改时间) 查找。
+缓存不放在快照数据库里：每次完整索引都会生成新的快照，目录和文件编号都会变化，
+独立的缓存可以跨快照复用，没有变化的文件之后不再读取。同一路径的旧记录在写入新记录时删除。
+
+运行 `python cli.py dupes [--min-size 1mb] [--query 条件]` 可以在命令行查找。
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from index_db import open_readonly, schema_version, SCHEMA_VERSION
+from query import plan_query
+from search import has_fts_index
+
+CACHE_NAME = 'hash_cache.sqlite'
+# 部分哈希读取开头和结尾各多少字节
+PARTIAL_BYTES = 64 * 1024
+# 计算完整哈希时每次读取的字节数
+READ_BUFFER = 1024 * 1024
+DIGEST_SIZE = 16
+DEFAULT_WORKERS = 4
+# 每次处理多少个候选文件，一批内的所有文件一起排队计算哈希，然后写入缓存
+CHUNK_FILES = 5000
+
+CACHE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS file_hashes (
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime INTEGER NOT NULL,
+        partial BLOB,
+        full BLOB,
+        PRIMARY KEY (path, size, mtime)
+    ) WITHOUT ROWID
+"""
+
+# 大小相同的文件不止一个，GROUP BY 直接在 idx_files_size 上完成
+CANDIDATES_SQL = """
+    SELECT file_path(f.dir_id, f.filename), f.size, f.mtime
+    FROM files f
+    WHERE f.size IN (SELECT size FROM files WHERE size >= ? GROUP BY size HAVING count(*) > 1)
+    ORDER BY f.size
+"""
+
+# 先按搜索条件筛选，再在筛选结果中按大小分组
+FILTERED_CANDIDATES_SQL = """
+    WITH matched AS MATERIALIZED (
+        SELECT f.dir_id, f.filename, f.size, f.mtime FROM {source} WHERE ({where}) AND f.size >= ?
+    )
+    SELECT file_path(dir_id, filename), size, mtime
+    FROM matched
+    WHERE size IN (SELECT size FROM matched GROUP BY size HAVING count(*) > 1)
+    ORDER BY size
+"""
+
+Candidate = namedtuple('Candidate', ['path', 'size', 'mtime'])
+DuplicateGroup = namedtuple('DuplicateGroup', ['size', 'digest', 'paths'])
+
+
+def wasted_bytes(group):
+    """删除多余的副本可以释放的空间"""
+    return group.size * (len(group.paths) - 1)
+
+
+class DuplicateStats:
+    """一次查找的统计"""
+
+    def __init__(self):
+        self.candidates = 0
+        self.partial_hashed = 0
+        self.full_hashed = 0
+        self.cache_hits = 0
+        self.bytes_read = 0
+        # 索引之后已经变化或被删除的文件
+        self.stale = 0
+        self.errors = 0
+        # 指向同一个文件的硬链接不算重复
+        self.hardlinks = 0
+        self.groups = 0
+        self.wasted = 0
+        self.elapsed = 0.0
+
+    def __str__(self):
+        text = (f"{self.groups} 组重复文件, 可释放 {self.wasted / (1024 * 1024):,.1f} MB; "
+                f"候选 {self.candidates} 个, 部分哈希 {self.partial_hashed} 个, 完整哈希 {self.full_hashed} 个, "
+                f"缓存命中 {self.cache_hits} 个, 读取 {self.bytes_read / (1024 * 1024):,.1f} MB, "
+                f"耗时 {self.elapsed:.2f} 秒")
+        if self.stale:
+            text += f", 跳过 {self.stale} 个已变化的文件"
+        if self.hardlinks:
+            text += f", {self.hardlinks} 个硬链接不算重复"
+        if self.errors:
+            text += f", {self.errors} 个文件无法读取"
+        return text
+
+
+class HashCache:
+    """hash_cache.sqlite 中的哈希缓存，只在调用 find_duplicates 的线程中使用"""
+
+    def __init__(self, cache_path):
+        self.conn = sqlite3.connect(cache_path, timeout=10)
+        self.conn.execute(CACHE_TABLE_SQL)
+        self.conn.commit()
+
+    def lookup(self, candidate):
+        """返回 (部分哈希, 完整哈希)，没有缓存时返回 None"""
+        return self.conn.execute(
+            "SELECT partial, full FROM file_hashes WHERE path = ? AND size = ? AND mtime = ?", candidate
+        ).fetchone()
+
+    def store(self, entries):
+        """entries 是 (path, size, mtime, partial, full)，同一路径其他大小或修改时间的记录一起删除"""
+        if not entries:
+            return
+        self.conn.executemany(
+            "DELETE FROM file_hashes WHERE path = ? AND (size, mtime) != (?, ?)",
+            [entry[:3] for entry in entries]
+        )
+        self.conn.executemany(
+            "INSERT INTO file_hashes (path, size, mtime, partial, full) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (path, size, mtime) DO UPDATE SET "
+            "partial = excluded.partial, full = coalesce(excluded.full, full)",
+            entries
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class _Hasher:
+    """在线程池中读取文件计算哈希，每个线程复用自己的读缓冲区"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _buffer(self):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._local.buffer = memoryview(bytearray(READ_BUFFER))
+        return buffer
+
+    @staticmethod
+    def _check(candidate, f):
+        # 打开之后再 stat，读到的一定是这个版本的文件
+        st = os.fstat(f.fileno())
+        return st.st_size == candidate.size and int(st.st_mtime) == candidate.mtime
+
+    def partial(self, candidate):
+        """返回 (哈希, 读取字节数)，文件已经变化时哈希为 None"""
+        with open(candidate.path, 'rb', buffering=0) as f:
+            if not self._check(candidate, f):
+                return None, 0
+            digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+            if candidate.size <= 2 * PARTIAL_BYTES:
+                data = f.read()
+                digest.update(data)
+                return digest.digest(), len(data)
+            head = f.read(PARTIAL_BYTES)
+            f.seek(-PARTIAL_BYTES, os.SEEK_END)
+            tail = f.read(PARTIAL_BYTES)
+            digest.update(head)
+            digest.update(tail)
+            return digest.digest(), len(head) + len(tail)
+
+    def full(self, candidate):
+        """返回 (哈希, 读取字节数)，文件已经变化时哈希为 None"""
+        buffer = self._buffer()
+        total = 0
+        with open(candidate.path, 'rb', buffering=0) as f:
+            if not self._check(candidate, f):
+                return None, 0
+            digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+            while True:
+                count = f.readinto(buffer)
+                if not count:
+                    break
+                digest.update(buffer[:count])
+                total += count
+        return digest.digest(), total
+
+
+def _iter_size_chunks(rows, chunk_files):
+    """按大小顺序读出候选文件，凑够 chunk_files 个后在大小变化处分批，同一大小不会被拆开"""
+    chunk = []
+    for path, size, mtime in rows:
+        if len(chunk) >= chunk_files and size != chunk[-1].size:
+            yield chunk
+            chunk = []
+        chunk.append(Candidate(path, size, mtime))
+    if chunk:
+        yield chunk
+
+
+def _colliding(keyed):
+    """keyed 是 {候选: 键}，返回键相同的文件不止一个的分组 {键: [候选, ...]}"""
+    groups = defaultdict(list)
+    for candidate, key in keyed.items():
+        groups[key].append(candidate)
+    return {key: members for key, members in groups.items() if len(members) > 1}
+
+
+def _file_identity(candidate):
+    """文件的 (设备, 文件编号)，文件已经被删除或修改时返回 None"""
+    try:
+        st = os.stat(candidate.path)
+    except OSError:
+        return None
+    if st.st_size != candidate.size or int(st.st_mtime) != candidate.mtime:
+        return None
+    # Windows 上没有文件编号的文件系统 st_ino 为 0，无法判断是否为硬链接
+    return (st.st_dev, st.st_ino) if st.st_ino else (candidate.path,)
+
+
+def _collapse_links(candidates, stats):
+    """去掉已经不存在或变化了的文件（哈希可能来自缓存），以及指向同一个文件的其他硬链接"""
+    seen = set()
+    kept = []
+    for candidate in sorted(candidates):
+        identity = _file_identity(candidate)
+        if identity is None:
+            stats.stale += 1
+        elif identity in seen:
+            stats.hardlinks += 1
+        else:
+            seen.add(identity)
+            kept.append(candidate.path)
+    return kept
+
+
+class _Pipeline:
+    def __init__(self, executor, cache, stats, should_stop, metrics):
+        self.executor = executor
+        self.cache = cache
+        self.stats = stats
+        self.should_stop = should_stop
+        self.metrics = metrics
+        self.hasher = _Hasher()
+
+    def _run(self, method, candidates, stage):
+        """在线程池中对 candidates 计算哈希，返回 {候选: 哈希}，读取失败或已经变化的文件不在结果中"""
+        begin = time.perf_counter()
+        digests = {}
+        futures = {self.executor.submit(method, candidate): candidate for candidate in candidates}
+        try:
+            for future in as_completed(futures):
+                if self.should_stop and self.should_stop():
+                    raise InterruptedError("查找重复文件已被用户终止")
+                try:
+                    digest, read = future.result()
+                except OSError:
+                    self.stats.errors += 1
+                    continue
+                self.stats.bytes_read += read
+                if digest is None:
+                    self.stats.stale += 1
+                else:
+                    digests[futures[future]] = digest
+        finally:
+            for future in futures:
+                future.cancel()
+        if self.metrics is not None:
+            self.metrics.add_time(f"dupes.{stage}", time.perf_counter() - begin)
+            self.metrics.count(f"dupes.{stage}_files", len(candidates))
+        return digests
+
+    def process(self, chunk):
+        """处理一批候选文件，返回这一批中的重复文件分组"""
+        stats = self.stats
+        stats.candidates += len(chunk)
+        cached = {}
+        if self.cache is not None:
+            for candidate in chunk:
+                row = self.cache.lookup(candidate)
+                if row is not None and row[0] is not None:
+                    cached[candidate] = row
+        stats.cache_hits += len(cached)
+
+        # 第 2 步：部分哈希
+        partials = {candidate: row[0] for candidate, row in cached.items()}
+        missing = [candidate for candidate in chunk if candidate not in cached]
+        computed = self._run(self.hasher.partial, missing, 'partial')
+        stats.partial_hashed += len(computed)
+        partials.update(computed)
+        fulls = {candidate: row[1] for candidate, row in cached.items() if row[1] is not None}
+
+        # 第 3 步：部分哈希仍然相同的文件计算完整哈希，小文件的部分哈希就是完整哈希
+        survivors = [candidate for members in _colliding(
+            {candidate: (candidate.size, digest) for candidate, digest in partials.items()}
+        ).values() for candidate in members]
+        for candidate in survivors:
+            if candidate.size <= 2 * PARTIAL_BYTES:
+                fulls[candidate] = partials[candidate]
+        missing = [candidate for candidate in survivors if candidate not in fulls]
+        new_fulls = self._run(self.hasher.full, missing, 'full')
+        stats.full_hashed += len(new_fulls)
+        fulls.update(new_fulls)
+
+        if self.cache is not None:
+            updates = [(*candidate, partials[candidate], fulls.get(candidate))
+                       for candidate in partials if candidate in computed or candidate in new_fulls]
+            self.cache.store(updates)
+
+        survivors = set(survivors)
+        groups = []
+        for (size, digest), members in _colliding(
+            {candidate: (candidate.size, digest) for candidate, digest in fulls.items() if candidate in survivors}
+        ).items():
+            paths = _collapse_links(members, stats)
+            if len(paths) > 1:
+                groups.append(DuplicateGroup(size, digest.hex(), paths))
+        return groups
+
+
+def _candidate_rows(conn, min_size, query):
+    if not query:
+        return conn.execute(CANDIDATES_SQL, (min_size,))
+    plan = plan_query(conn, query, has_fts_index(conn))
+    sql = FILTERED_CANDIDATES_SQL.format(source=plan.source, where=plan.where)
+    return conn.execute(sql, plan.params + (min_size,))
+
+
+def find_duplicates(db_path, min_size=1, query=None, workers=DEFAULT_WORKERS, cache_path=None,
+                    stats=None, should_stop=None, on_progress=None, metrics=None, chunk_files=CHUNK_FILES):
+    """查找 db_path 索引到的重复文件，返回按可释放空间从大到小排列的 DuplicateGroup 列表
+
+    min_size 以下的文件不参与比较（默认跳过空文件）；query 是搜索框语法的条件，只在匹配的
+    文件中查找，不符合语法时抛出 QueryError。cache_path 默认为数据库目录下的 hash_cache.sqlite。
+    """
+    stats = stats if stats is not None else DuplicateStats()
+    begin = time.perf_counter()
+    conn = open_readonly(db_path)
+    try:
+        if schema_version(conn) != SCHEMA_VERSION:
+            raise ValueError(f"数据库是旧格式，请先升级数据库格式: {db_path}")
+        cache_path = cache_path or os.path.join(os.path.dirname(os.path.abspath(db_path)), CACHE_NAME)
+        try:
+            cache = HashCache(cache_path)
+        except sqlite3.Error as e:
+            # 缓存不可用时仍然可以查找，只是每次都要重新读取文件
+            print(f"无法打开哈希缓存 {cache_path}: {e}")
+            cache = None
+
+        groups = []
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers or DEFAULT_WORKERS),
+                                    thread_name_prefix='dupes') as executor:
+                pipeline = _Pipeline(executor, cache, stats, should_stop, metrics)
+                for chunk in _iter_size_chunks(_candidate_rows(conn, max(min_size, 0), query), chunk_files):
+                    groups.extend(pipeline.process(chunk))
+                    if on_progress:
+                        on_progress(f"已比较 {stats.candidates} 个候选文件，找到 {len(groups)} 组重复文件...")
+        finally:
+            if cache is not None:
+                cache.close()
+    finally:
+        conn.close()
+
+    groups.sort(key=lambda group: (-wasted_bytes(group), group.paths[0]))
+    stats.groups = len(groups)
+    stats.wasted = sum(wasted_bytes(group) for group in groups)
+    stats.elapsed = time.perf_counter() - begin
+    if metrics is not None:
+        metrics.count('dupes.bytes_read', stats.bytes_read)
+        metrics.count('dupes.cache_hits', stats.cache_hits)
+    return groups
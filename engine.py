@@ -0,0 +1,331 @@
+"""不依赖界面的索引和搜索引擎
+
+这里只导入标准库和项目里不依赖界面的模块，可以在没有 PyQt6、pywin32 的服务器上
+直接使用：图形界面（main.py）的后台线程和命令行（cli.py）都调用这里的函数。
+pywin32 只在真正用到时才导入（扫描器读取文件属性、实时监控），不会在导入时加载。
+
+- full_index()      完整扫描若干根目录，生成一个新的快照数据库，可以从断点继续
+- pending_index()   上次没有完成的完整索引的断点
+- update_database() 在现有数据库上增量更新
+- search_database() 打开一个数据库搜索文件名
+- database_stats()  数据库的文件数、目录数、大小和索引情况
+
+索引和增量更新结束时（包括出错和被终止）都会把分阶段统计（见 metrics.py）作为一行
+追加到数据库目录下的 metrics.jsonl。
+"""
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from checkpoint import read_checkpoint, start_checkpoint, load_frontier, finish_scan, clear_checkpoint
+from dir_sizes import build_rollups, has_rollups
+from incremental import IncrementalIndexer
+from index_db import (create_indexes, create_tables, file_row, open_readonly, publish_database, remove_database,
+                      schema_version, SCHEMA_VERSION)
+from index_writer import IndexWriter
+from metrics import Metrics, METRICS_LOG
+from name_keys import finish_name_keys, has_name_keys, has_name_keys_fts, pinyin_available
+from name_index import build_name_index, sidecar_path, NameIndex
+from scanner import ParallelScanner, DEFAULT_SCANNER
+from search import build_fts_index, has_fts_index, search_files, fuzzy_search
+
+DEFAULT_DB_FOLDER = os.path.join(os.path.expanduser('~'), 'Everything_like_By_WZ')
+# 完整索引写入的临时数据库，索引期间搜索也使用它
+TEMP_DB_NAME = 'temp_indexing.db'
+CONFIG_NAME = 'config.ini'
+
+
+def load_last_database(db_folder):
+    """读取最后使用的数据库文件名，没有记录时返回 None"""
+    try:
+        config_path = os.path.join(db_folder, CONFIG_NAME)
+        if os.path.exists(config_path):
+            with open(config_path, 'r', encoding='utf-8') as f:
+                return f.read().strip() or None
+    except Exception as e:
+        print(f"读取配置文件出错: {e}", file=sys.stderr)
+    return None
+
+
+def save_last_database(db_folder, db_path):
+    """保存当前数据库到配置文件，只保存文件名，不保存完整路径"""
+    try:
+        config_path = os.path.join(db_folder, CONFIG_NAME)
+        with open(config_path, 'w', encoding='utf-8') as f:
+            f.write(os.path.basename(db_path))
+    except Exception as e:
+        print(f"保存配置文件出错: {e}", file=sys.stderr)
+
+
+def snapshot_label(drives=(), specific_dir=None):
+    """快照数据库名称中的扫描范围，例如 Drive_C+D 或 Dir_Documents"""
+    if specific_dir:
+        dir_name = os.path.basename(specific_dir.rstrip('\\/')) or 'root'
+        return f"Dir_{dir_name}"
+    drives_str = '+'.join(d.replace(':\\', '') for d in drives)
+    return f"Drive_{drives_str}"
+
+
+def build_sidecar(db_path):
+    """生成 .names 文件名索引，失败时搜索会退回数据库查询"""
+    conn = sqlite3.connect(db_path)
+    try:
+        build_name_index(conn, db_path)
+    except OSError as e:
+        print(f"生成文件名索引失败: {e}", file=sys.stderr)
+    finally:
+        conn.close()
+
+
+def pending_index(db_folder):
+    """上次停止或崩溃、还没有完成的完整索引的断点（见 checkpoint.read_checkpoint），没有时返回 None"""
+    return read_checkpoint(os.path.join(db_folder, TEMP_DB_NAME))
+
+
+def _prepare_staging(temp_db, roots, label, scanner_name, resume):
+    """准备临时数据库，返回 (断点, 前沿目录, 下一个目录编号)；不能继续时从头开始，断点为 None"""
+    checkpoint = read_checkpoint(temp_db) if resume else None
+    if checkpoint is not None and (checkpoint['roots'] != list(roots) or checkpoint['label'] != label):
+        checkpoint = None
+    if checkpoint is None:
+        # 上次中断留下的临时数据库，新的扫描直接插入，不能和旧数据混在一起
+        remove_database(temp_db)
+    conn = sqlite3.connect(temp_db)
+    try:
+        create_tables(conn, with_indexes=False)
+        if checkpoint is None:
+            start_checkpoint(conn, roots, label, scanner_name)
+            conn.commit()
+            return None, None, 1
+        if checkpoint['scanned']:
+            return checkpoint, None, 1
+        frontier, next_dir_id = load_frontier(conn, roots)
+        return checkpoint, frontier, next_dir_id
+    finally:
+        conn.close()
+
+
+def full_index(roots, db_folder, label, scanner_name=DEFAULT_SCANNER, workers=None,
+               should_stop=None, on_progress=None, on_staging=None, metrics=None, resume=False, throttle=None):
+    """完整扫描 roots，在 db_folder 下生成 {时间}_{label}.db，返回 (数据库路径, 文件数)
+
+    扫描结果先写入临时数据库，第一次提交后调用 on_staging(临时数据库)，调用方可以开始
+    搜索已经扫描到的部分。临时数据库可能正被搜索读取，完成后复制出最终数据库而不是改名；
+    给了 on_staging 时由调用方在不再使用后删除，否则直接删除。调用方传入 metrics 可以在
+    进度回调中读取实时统计。
+
+    should_stop() 返回 True 时扫描线程在处理完当前目录后停止，已经排队的结果写完并提交后
+    抛出 InterruptedError。临时数据库中保存着断点，停止、出错或进程崩溃之后用 resume=True
+    和相同的 roots、label 调用就从断点继续，已经扫描完的子树不会重新扫描。
+
+    throttle 是 throttle.Throttle 时按后台模式限速，没有指定 workers 时使用它的扫描线程数。
+    """
+    progress = on_progress or (lambda message: None)
+    metrics = metrics if metrics is not None else Metrics('index')
+    metrics.labels.setdefault('roots', list(roots))
+    if throttle is not None:
+        metrics.labels['throttle'] = throttle.max_rate
+        if throttle.metrics is None:
+            throttle.metrics = metrics
+    temp_db = os.path.join(db_folder, TEMP_DB_NAME)
+    final_db_path = None
+    status = 'failed'
+    try:
+        checkpoint, frontier, next_dir_id = _prepare_staging(temp_db, roots, label, scanner_name, resume)
+        if checkpoint is not None:
+            metrics.labels['resumed'] = True
+            progress(f"从断点继续索引：已提交 {checkpoint['rows']} 个文件，"
+                     f"还有 {sum(len(dirs) for dirs in (frontier or {}).values())} 个目录没有扫描")
+            if on_staging:
+                on_staging(temp_db)
+        if checkpoint is None or not checkpoint['scanned']:
+            total_file_count = _scan_into_staging(temp_db, roots, scanner_name, workers, should_stop, progress,
+                                                  on_staging, metrics, checkpoint, frontier, next_dir_id, throttle)
+        else:
+            total_file_count = checkpoint['rows']
+
+        # 扫描和写入完成后一次性建立唯一索引和全文索引，比逐行维护快得多；
+        # 临时数据库是 WAL 模式，建索引期间搜索照常进行
+        progress(f"正在建立文件名索引（共 {total_file_count} 个文件）...")
+        conn = sqlite3.connect(temp_db)
+        try:
+            with metrics.timed('phase.indexes'):
+                create_indexes(conn)
+                conn.commit()
+            with metrics.timed('phase.fts'):
+                build_fts_index(conn)
+            # 扫描时已经累加了每个目录的直接汇总，这里只需要自下而上求和
+            with metrics.timed('phase.rollups'):
+                build_rollups(conn)
+                conn.commit()
+            # 搜索键也已经在扫描时生成
+            with metrics.timed('phase.name_keys'):
+                finish_name_keys(conn)
+                conn.commit()
+            # 最终数据库中不保留断点
+            clear_checkpoint(conn)
+        finally:
+            conn.close()
+
+        # 在数据库目录下创建最终数据库文件
+        final_db_name = f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{label}.db"
+        final_db_path = os.path.join(db_folder, final_db_name)
+        progress(f"正在保存数据库 {final_db_path}...")
+        with metrics.timed('phase.publish'):
+            publish_database(temp_db, final_db_path)
+
+        # 在数据库旁边生成内存映射的文件名索引
+        progress("正在生成文件名索引文件...")
+        with metrics.timed('phase.names'):
+            build_sidecar(final_db_path)
+        if on_staging is None:
+            remove_database(temp_db)
+        status = 'ok'
+        return final_db_path, total_file_count
+    except InterruptedError:
+        # 临时数据库和断点保留下来，下次可以继续
+        status = 'stopped'
+        raise
+    finally:
+        metrics.dump(os.path.join(db_folder, METRICS_LOG), status=status, database=final_db_path)
+
+
+def _scan_into_staging(temp_db, roots, scanner_name, workers, should_stop, progress, on_staging, metrics,
+                       checkpoint, frontier, next_dir_id, throttle):
+    """把扫描结果写入临时数据库，返回已提交的文件总数
+
+    checkpoint 不为 None 时只扫描 frontier 中的目录，文件数包括断点之前提交的部分。
+    """
+    # 继续扫描时调用方已经在使用临时数据库
+    staging_announced = [] if checkpoint is None else [True]
+
+    def on_commit(root, rows_written):
+        if not staging_announced:
+            staging_announced.append(True)
+            if on_staging:
+                on_staging(temp_db)
+        progress(f"正在扫描 {root} - 已找到 {rows_written} 个文件...")
+
+    # 唯一的写入线程持有临时数据库连接，扫描线程通过有界队列提交数据
+    writer = IndexWriter(
+        temp_db,
+        on_commit=on_commit,
+        metrics=metrics,
+        checkpoint=True,
+        rows_written=checkpoint['rows'] if checkpoint else 0,
+        dirs_done=checkpoint['dirs'] if checkpoint else 0,
+        min_commit_interval=throttle.min_commit_interval if throttle else 0.0,
+        rollups=True,
+        name_keys=True
+    )
+    writer.start()
+
+    progress(f"正在扫描 {', '.join(roots)}...")
+    scanner = ParallelScanner(
+        scanner_name,
+        workers=workers or (throttle.workers if throttle else None),
+        should_stop=should_stop,
+        row_factory=file_row,
+        metrics=metrics,
+        first_dir_id=next_dir_id,
+        throttle=throttle
+    )
+    with metrics.timed('phase.scan'):
+        try:
+            root_stats = scanner.run(roots, writer.put, frontier)
+        finally:
+            # 停止时也要把已经排队的结果写完，断点才包含它们
+            writer.close()
+
+    for stats in root_stats.values():
+        progress(f"扫描统计 {stats}")
+        if stats.error is not None:
+            progress(f"处理驱动器 {stats.root} 时出错: {str(stats.error)}")
+
+    conn = sqlite3.connect(temp_db)
+    try:
+        finish_scan(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    return writer.rows_written
+
+
+def update_database(db_path, roots=None, should_stop=None, on_progress=None, metrics=None, throttle=None):
+    """在现有数据库上增量更新并重新生成文件名索引，返回 IncrementalStats
+
+    throttle 是 throttle.Throttle 时列目录按后台模式限速。
+    """
+    metrics = metrics if metrics is not None else Metrics('update')
+    metrics.labels.setdefault('database', os.path.abspath(db_path))
+    if throttle is not None:
+        metrics.labels['throttle'] = throttle.max_rate
+        if throttle.metrics is None:
+            throttle.metrics = metrics
+    status = 'failed'
+    try:
+        indexer = IncrementalIndexer(db_path, should_stop=should_stop, on_progress=on_progress, throttle=throttle)
+        with metrics.timed('phase.update'):
+            stats = indexer.run(roots)
+        metrics.count('dirs', stats.dirs_listed)
+        metrics.count('dirs_skipped', stats.dirs_skipped)
+        metrics.count('upserted', stats.upserted)
+        metrics.count('deleted', stats.deleted)
+        with metrics.timed('phase.names'):
+            build_sidecar(db_path)
+        status = 'ok'
+        return stats
+    except InterruptedError:
+        status = 'stopped'
+        raise
+    finally:
+        metrics.dump(os.path.join(os.path.dirname(os.path.abspath(db_path)), METRICS_LOG), status=status)
+
+
+def search_database(db_path, keyword, limit=100, fuzzy=False):
+    """打开数据库搜索一次，返回 (path, filename, size, mtime) 列表
+
+    fuzzy 为 True 时返回按相似度排列的近似匹配结果（需要 .names 文件名索引）。
+    """
+    conn = open_readonly(db_path)
+    name_index = NameIndex.open(db_path)
+    try:
+        if fuzzy:
+            return fuzzy_search(conn, name_index, keyword, limit)
+        return search_files(conn, keyword, limit, name_index)
+    finally:
+        if name_index is not None:
+            name_index.close()
+        conn.close()
+
+
+def database_stats(db_path):
+    """数据库概况，返回可以直接转换为 JSON 的字典"""
+    stats = {
+        'database': os.path.abspath(db_path),
+        'db_bytes': os.path.getsize(db_path),
+    }
+    names_path = sidecar_path(db_path)
+    stats['names_bytes'] = os.path.getsize(names_path) if os.path.exists(names_path) else None
+    begin = time.perf_counter()
+    conn = open_readonly(db_path)
+    try:
+        stats['schema_version'] = schema_version(conn)
+        if stats['schema_version'] != SCHEMA_VERSION:
+            return stats
+        stats['files'], stats['total_size'], stats['max_mtime'] = conn.execute(
+            "SELECT count(*), coalesce(sum(size), 0), max(mtime) FROM files"
+        ).fetchone()
+        stats['dirs'] = conn.execute("SELECT count(*) FROM dirs").fetchone()[0]
+        stats['roots'] = [row[0] for row in conn.execute("SELECT name FROM dirs WHERE parent_id IS NULL ORDER BY name")]
+        stats['fts'] = has_fts_index(conn)
+        stats['dir_rollups'] = has_rollups(conn)
+        stats['name_keys'] = has_name_keys(conn)
+        stats['name_keys_fts'] = has_name_keys_fts(conn)
+        stats['pinyin'] = pinyin_available()
+    finally:
+        conn.close()
+    stats['elapsed'] = round(time.perf_counter() - begin, 3)
+    return stats
@@ -0,0 +1,118 @@
+"""联合搜索多个快照数据库
+
+每次索引都会在数据库目录下留下一个 {时间}_Drive_X.db 或 {时间}_Dir_*.db，
+FederatedSearch 为选中的每个快照保持一个只读连接（以及可用的 .names 文件名索引），
+同一个关键词在线程池中并行查询所有快照，再按路径合并去重：
+同一路径出现在多个快照中时，保留最新快照中的记录。
+"""
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+from index_db import open_readonly, schema_version, SCHEMA_VERSION
+from name_index import NameIndex
+from search import search_files
+
+SNAPSHOT_TIME_FORMAT = '%Y-%m-%d_%H-%M-%S'
+
+
+def snapshot_time(db_path):
+    """快照的生成时间：优先取文件名开头的时间，否则用文件修改时间"""
+    name = os.path.basename(db_path)
+    try:
+        return datetime.strptime(name[:19], SNAPSHOT_TIME_FORMAT).timestamp()
+    except ValueError:
+        return os.path.getmtime(db_path)
+
+
+def list_snapshots(db_folder):
+    """数据库目录下的所有快照，最新的在前"""
+    paths = []
+    for entry in os.scandir(db_folder):
+        if entry.is_file() and entry.name.endswith('.db') and entry.name != 'temp_indexing.db':
+            paths.append(entry.path)
+    return sorted(paths, key=snapshot_time, reverse=True)
+
+
+class Snapshot:
+    """一个快照的只读连接和文件名索引"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.taken_at = snapshot_time(db_path)
+        # 连接只在线程池中使用，同一时间只有一个任务使用它
+        self.conn = open_readonly(db_path, check_same_thread=False)
+        try:
+            if schema_version(self.conn) != SCHEMA_VERSION:
+                raise ValueError("数据库是旧格式，请先升级数据库格式")
+        except BaseException:
+            self.conn.close()
+            raise
+        self.name_index = NameIndex.open(db_path)
+
+    def close(self):
+        if self.name_index is not None:
+            self.name_index.close()
+            self.name_index = None
+        self.conn.close()
+
+
+class FederatedSearch:
+    def __init__(self, db_paths, limit=10000, workers=None):
+        # 每个快照最多取 limit 条结果，避免很短的关键词把所有快照的结果全部读出来
+        self.limit = limit
+        self.snapshots = []
+        for db_path in db_paths:
+            try:
+                self.snapshots.append(Snapshot(db_path))
+            except (sqlite3.Error, OSError, ValueError) as e:
+                print(f"联合搜索跳过数据库 {db_path}: {e}")
+        self.snapshots.sort(key=lambda s: s.taken_at, reverse=True)
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers or max(1, min(8, len(self.snapshots))),
+            thread_name_prefix='federated'
+        )
+        self.last_elapsed = 0.0
+
+    def _search_one(self, snapshot, keyword):
+        return search_files(snapshot.conn, keyword, self.limit, snapshot.name_index)
+
+    def search(self, keyword):
+        """并行搜索所有快照，返回按路径去重后的 (path, filename, size, mtime) 列表
+
+        结果先按快照从新到旧、再按各快照内部的顺序排列。任何一个快照的查询被
+        interrupt() 中断时抛出 sqlite3.OperationalError。
+        """
+        begin = time.perf_counter()
+        futures = [self._pool.submit(self._search_one, snapshot, keyword) for snapshot in self.snapshots]
+        # 等所有任务结束后再处理结果，保证返回时没有任务还在使用连接
+        wait(futures)
+
+        merged = []
+        seen = set()
+        for snapshot, future in zip(self.snapshots, futures):
+            try:
+                rows = future.result()
+            except sqlite3.OperationalError as e:
+                if 'interrupted' in str(e):
+                    raise
+                print(f"联合搜索 {snapshot.db_path} 出错: {e}")
+                continue
+            for row in rows:
+                if row[0] not in seen:
+                    seen.add(row[0])
+                    merged.append(row)
+        self.last_elapsed = time.perf_counter() - begin
+        return merged
+
+    def interrupt(self):
+        for snapshot in self.snapshots:
+            snapshot.conn.interrupt()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        for snapshot in self.snapshots:
+            snapshot.close()
+        self.snapshots = []
@@ -0,0 +1,215 @@
+"""近似（模糊）文件名匹配
+
+在 .names 文件名索引（见 name_index.py）的 names 列上分批扫描：
+
+1. 子序列匹配：关键词的字符按顺序出现在文件名中即可，例如 "rprt" 可以找到 "report.docx"
+2. 容错匹配：紧凑的子序列命中太少且关键词足够长时，再把关键词去掉任意一个字符重新匹配，
+   这样错一个字、漏一个字、多一个字或相邻两个字颠倒都能找到，但只接受基本连续的命中。
+   所有去掉一个字符的写法合成两个正则各扫描一遍（见 typo_patterns），只有命中的行才逐个写法计算得分
+
+每个子序列都编译成只含否定字符类的线性正则（例如 rpt -> r[^\\np]*p[^\\nt]*t），
+不会回溯，由正则引擎在映射的内存上直接扫描，只有命中的行才回到 Python 计算得分。
+names 按行对齐切成若干批，每批之间检查 should_stop，新的按键可以随时打断扫描。
+
+文件名本身包含关键词的行已经在精确结果中，这里直接跳过。得分综合考虑匹配的紧凑程度、
+是否从文件名开头或单词开头匹配、关键词占文件名的比例以及容错的次数，只保留得分最高的
+limit 个结果。
+"""
+import heapq
+import re
+from bisect import bisect_right
+
+FUZZY_LIMIT = 50
+# 关键词少于这么多个字符时几乎所有文件名都能按子序列命中，不做近似匹配
+FUZZY_MIN_LENGTH = 3
+# 容错匹配要去掉一个字符，关键词太短时去掉后没有意义
+TYPO_MIN_LENGTH = 4
+# 关键词太长时逐个去掉字符的遍数太多
+TYPO_MAX_LENGTH = 16
+# 容错匹配只接受基本连续的命中，跨度最多比去掉字符后的关键词长这么多个字节
+TYPO_MAX_GAP = 2
+BATCH_BYTES = 4 << 20
+
+# 单词分隔符，紧跟其后的匹配算作从单词开头匹配
+WORD_BREAKS = b' _-.()[]'
+
+
+def _units(keyword):
+    """关键词按字符拆成 UTF-8 字节序列，多字节的汉字作为一个整体"""
+    return [ch.encode('utf-8', 'surrogatepass') for ch in keyword.lower() if ch != '\n']
+
+
+def subsequence_pattern(units, max_gap=None):
+    """按顺序包含所有字符的正则，max_gap 限制相邻两个字符之间最多隔开的字节数
+
+    单字节字符之间用不含下一个字符的否定字符类连接，总是匹配下一个字符最早出现的位置，
+    正则引擎不需要回溯；多字节字符无法放进字符类，改用非贪婪匹配。
+    """
+    repeat = b'*' if max_gap is None else b'{0,%d}' % max_gap
+    parts = [re.escape(units[0])]
+    for unit in units[1:]:
+        if len(unit) == 1:
+            parts.append(b'[^\\n' + re.escape(unit) + b']' + repeat + re.escape(unit))
+        else:
+            parts.append(b'[^\\n]' + repeat + b'?' + re.escape(unit))
+    return re.compile(b''.join(parts))
+
+
+def typo_patterns(units, max_gap):
+    """去掉任意一个字符、其余字符按顺序出现且之间总共最多隔开 max_gap 个字节的正则
+
+    各个写法中足够紧凑的命中都能被它找到，只用来挑出需要逐个写法核对的行。拆成去掉第一个
+    字符和保留第一个字符两个正则，都以固定的字符开头，正则引擎可以快速跳到可能命中的位置；
+    后面的部分按（位置, 是否已去掉字符, 剩余字节数）展开成嵌套的分支。
+    """
+    count = len(units)
+    memo = {}
+
+    def rest(i, dropped, budget):
+        # 已经匹配了前面的字符，继续匹配 units[i:]；无法满足时返回 None
+        key = (i, dropped, budget)
+        if key not in memo:
+            if i == count:
+                memo[key] = b'' if dropped else None
+            else:
+                branches = []
+                if not dropped:
+                    branches.append(rest(i + 1, True, budget))
+                for gap in range(budget + 1):
+                    tail = rest(i + 1, dropped, budget - gap)
+                    if tail is not None:
+                        branches.append(b'[^\\n]' * gap + re.escape(units[i]) + tail)
+                memo[key] = branches[0] if len(branches) == 1 else b'(?:' + b'|'.join(branches) + b')'
+        return memo[key]
+
+    return [re.compile(re.escape(units[1]) + rest(2, True, max_gap)),
+            re.compile(re.escape(units[0]) + rest(1, False, max_gap))]
+
+
+def _score(buf, start, end, line_start, line_end, length, typos):
+    # 中间每隔开一个字节扣一分
+    score = max(0.0, 10.0 - (end - start - length))
+    if start == line_start:
+        score += 5.0
+    elif buf[start - 1] in WORD_BREAKS:
+        score += 3.0
+    score += 2.0 * length / (line_end - line_start)
+    return score - 2.0 * typos
+
+
+class _TopHits:
+    """按得分保留最好的 limit 行，同一行只保留一次"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.heap = []
+        self.seen = set()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def add(self, score, line_start):
+        if line_start in self.seen:
+            return
+        if len(self.heap) < self.limit:
+            heapq.heappush(self.heap, (score, line_start))
+        elif score > self.heap[0][0]:
+            _, dropped = heapq.heapreplace(self.heap, (score, line_start))
+            self.seen.discard(dropped)
+        else:
+            return
+        self.seen.add(line_start)
+
+
+def _batches(buf, start, end):
+    """把 [start, end) 按行切成大约 BATCH_BYTES 的几段"""
+    while start < end:
+        stop = buf.find(b'\n', min(start + BATCH_BYTES, end - 1), end) + 1
+        if stop <= 0:
+            stop = end
+        yield start, stop
+        start = stop
+
+
+def _scan(buf, base, end, pattern, needle, length, hits, should_stop):
+    """子序列匹配扫描一遍，返回跨度不超过 length + TYPO_MAX_GAP 的紧凑命中数"""
+    compact = 0
+    for batch_start, batch_end in _batches(buf, base, end):
+        if should_stop and should_stop():
+            raise InterruptedError("近似匹配已被中断")
+        pos = batch_start
+        while True:
+            match = pattern.search(buf, pos, batch_end)
+            if match is None:
+                break
+            start, stop = match.span()
+            line_end = buf.find(b'\n', stop, batch_end)
+            pos = line_end + 1
+            line_start = buf.rfind(b'\n', base, start) + 1 or base
+            # 包含关键词本身的是精确结果
+            if buf.find(needle, line_start, line_end) >= 0:
+                continue
+            if stop - start <= length + TYPO_MAX_GAP:
+                compact += 1
+            hits.add(_score(buf, start, stop, line_start, line_end, length, 0), line_start)
+    return compact
+
+
+def _scan_typos(buf, base, end, prefilter, variants, needle, exclude, hits, should_stop):
+    """用合并的正则扫描一遍，命中的行再按顺序逐个写法匹配，第一个足够紧凑的写法计分"""
+    for batch_start, batch_end in _batches(buf, base, end):
+        if should_stop and should_stop():
+            raise InterruptedError("近似匹配已被中断")
+        pos = batch_start
+        while True:
+            match = prefilter.search(buf, pos, batch_end)
+            if match is None:
+                break
+            line_end = buf.find(b'\n', match.end(), batch_end)
+            pos = line_end + 1
+            line_start = buf.rfind(b'\n', base, match.start()) + 1 or base
+            # 按完整子序列能匹配的行已在第一遍中
+            if buf.find(needle, line_start, line_end) >= 0 or exclude.search(buf, line_start, line_end):
+                continue
+            for pattern, length in variants:
+                found = pattern.search(buf, line_start, line_end)
+                if found is None:
+                    continue
+                start, stop = found.span()
+                if stop - start <= length + TYPO_MAX_GAP:
+                    hits.add(_score(buf, start, stop, line_start, line_end, length, 1), line_start)
+                    break
+
+
+def fuzzy_matches(name_index, keyword, limit=FUZZY_LIMIT, should_stop=None, typos=True):
+    """返回文件名近似匹配 keyword 的 [(得分, 行号)]，得分从高到低
+
+    行号对应 name_index 中的行。should_stop() 返回 True 时抛出 InterruptedError。
+    """
+    units = _units(keyword)
+    if len(units) < FUZZY_MIN_LENGTH:
+        return []
+    needle = b''.join(units)
+    buf = name_index._mm
+    base = name_index._names_start
+    end = base + name_index.names_len
+    hits = _TopHits(limit)
+
+    pattern = subsequence_pattern(units)
+    compact = _scan(buf, base, end, pattern, needle, len(needle), hits, should_stop)
+
+    # 松散的子序列命中不如只错一个字的连续命中，紧凑命中不够时才做容错匹配
+    if typos and compact < limit and TYPO_MIN_LENGTH <= len(units) <= TYPO_MAX_LENGTH:
+        variants = []
+        for i in range(len(units)):
+            variant = units[:i] + units[i + 1:]
+            if variant not in variants:
+                variants.append(variant)
+        variants = [(subsequence_pattern(variant, TYPO_MAX_GAP), len(b''.join(variant))) for variant in variants]
+        for prefilter in typo_patterns(units, TYPO_MAX_GAP):
+            _scan_typos(buf, base, end, prefilter, variants, needle, pattern, hits, should_stop)
+
+    results = []
+    for score, line_start in sorted(hits.heap, reverse=True):
+        results.append((score, bisect_right(name_index.offsets, line_start - base) - 1))
+    return results
@@ -0,0 +1,217 @@
+"""增量索引
+
+在现有数据库上原地更新，而不是重新生成一个新的数据库：
+- dirs 表保存每个目录的修改时间
+- 目录修改时间未变化时不再列出该目录，只从数据库取出子目录逐个检查
+- 目录有变化时重新列出，只插入/更新/删除与数据库不一致的记录
+
+目录的修改时间只在其直接子项被创建、删除或重命名时改变，文件内容被原地修改
+不会反映到目录上，这类变化需要实时监控或者完整索引来发现。
+
+目录大小汇总（见 dir_sizes.py）的直接部分由 files 上的触发器随改动更新，
+提交前重新计算有变化的目录及其上级目录的递归汇总。
+"""
+import os
+import sqlite3
+import sys
+import time
+
+from index_db import (create_tables, create_indexes, file_row, iter_dir_files, delete_subtree, DirPaths,
+                      UPSERT_FILE_SQL)
+from scanner import ScandirScanner, dir_rows
+from dir_sizes import build_rollups, has_rollups, refresh_rollups
+from name_keys import build_name_keys, name_keys_outdated, update_name_keys
+
+
+class IncrementalStats:
+    """一次增量索引的统计"""
+
+    def __init__(self):
+        self.dirs_listed = 0
+        self.dirs_skipped = 0
+        self.dirs_failed = 0
+        self.upserted = 0
+        self.deleted = 0
+        self.elapsed = 0.0
+
+    def __str__(self):
+        failed = f", {self.dirs_failed} 个目录无法列出" if self.dirs_failed else ""
+        return (f"列出 {self.dirs_listed} 个目录, 跳过 {self.dirs_skipped} 个未变化目录{failed}, "
+                f"更新 {self.upserted} 个文件, 删除 {self.deleted} 个文件, 耗时 {self.elapsed:.2f} 秒")
+
+
+class IncrementalIndexer:
+    def __init__(self, db_path, should_stop=None, on_progress=None, commit_rows=10000, throttle=None):
+        self.db_path = db_path
+        self.should_stop = should_stop
+        # 后台模式的限速（见 throttle.py），只作用于重新列出的目录
+        self.throttle = throttle
+        self.on_progress = on_progress
+        self.commit_rows = commit_rows
+        self._pending = 0
+        self._paths = None
+
+    def stored_roots(self, conn):
+        """数据库中记录的扫描根目录"""
+        return [row[0] for row in conn.execute("SELECT name FROM dirs WHERE parent_id IS NULL")]
+
+    def dir_paths(self, conn):
+        """当前连接上的目录编号和路径转换，同一次同步中共用缓存"""
+        if self._paths is None or self._paths.conn is not conn:
+            self._paths = DirPaths(conn)
+        return self._paths
+
+    def run(self, roots=None):
+        """增量更新数据库，roots 为空时使用数据库中记录的根目录"""
+        stats = IncrementalStats()
+        begin = time.perf_counter()
+        conn = sqlite3.connect(self.db_path)
+        try:
+            create_tables(conn)
+            # 较早生成的数据库没有搜索过滤用的索引，在后台更新时补上
+            create_indexes(conn)
+            # 同样补上较早生成的数据库没有的目录大小汇总
+            if not has_rollups(conn):
+                build_rollups(conn, recount=True)
+                conn.commit()
+            # 以及搜索键；生成时没有 pypinyin 而现在有了，也重新生成一遍
+            if name_keys_outdated(conn):
+                build_name_keys(conn)
+                conn.commit()
+            if not roots:
+                roots = self.stored_roots(conn)
+            if not roots:
+                raise ValueError("数据库中没有目录信息，请先完整索引一次")
+
+            for root in roots:
+                self.sync_subtree(conn, root, stats)
+            refresh_rollups(conn)
+            update_name_keys(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        stats.elapsed = time.perf_counter() - begin
+        return stats
+
+    def _tick(self, conn, count, stats):
+        """累计改动行数，达到阈值时提交"""
+        self._pending += count
+        if self._pending >= self.commit_rows:
+            conn.commit()
+            self._pending = 0
+            if self.on_progress:
+                self.on_progress(stats)
+
+    def _delete_dir(self, conn, dir_id, path, stats):
+        removed = delete_subtree(conn, dir_id)
+        self.dir_paths(conn).forget(path)
+        stats.deleted += removed
+        self._tick(conn, removed, stats)
+
+    def sync_subtree(self, conn, root, stats, default_parent=None):
+        """同步 root 及其下的所有目录
+
+        root 不在 dirs 表中时作为 default_parent 的子目录记录（None 表示扫描根目录），
+        default_parent 也不在表中时改为从它开始同步。调用方负责最后一次提交。
+        """
+        paths = self.dir_paths(conn)
+        root_id = paths.lookup(root)
+        parent_id = None
+        if root_id is None and default_parent is not None:
+            parent_id = paths.lookup(default_parent)
+            if parent_id is None:
+                grandparent = os.path.dirname(default_parent)
+                if grandparent != default_parent:
+                    self.sync_subtree(conn, default_parent, stats, grandparent)
+                return
+
+        try:
+            root_mtime_ns = os.stat(root).st_mtime_ns
+        except OSError:
+            if root_id is not None:
+                self._delete_dir(conn, root_id, root, stats)
+            return
+
+        stack = [(root_id, root, parent_id, root_mtime_ns)]
+        while stack:
+            if self.should_stop and self.should_stop():
+                raise InterruptedError("索引过程被用户终止")
+
+            dir_id, path, parent_id, mtime_ns = stack.pop()
+            row = None
+            if dir_id is not None:
+                row = conn.execute("SELECT mtime_ns FROM dirs WHERE id = ?", (dir_id,)).fetchone()
+
+            if row is not None and row[0] == mtime_ns:
+                # 目录没有变化：不列目录，只检查数据库中记录的子目录
+                stats.dirs_skipped += 1
+                children = conn.execute("SELECT id, name FROM dirs WHERE parent_id = ?", (dir_id,)).fetchall()
+                for child_id, name in children:
+                    child = os.path.join(path, name)
+                    try:
+                        child_mtime_ns = os.stat(child, follow_symlinks=False).st_mtime_ns
+                    except OSError:
+                        self._delete_dir(conn, child_id, child, stats)
+                        continue
+                    stack.append((child_id, child, dir_id, child_mtime_ns))
+                continue
+
+            stats.dirs_listed += 1
+            changed = self._update_dir(conn, dir_id, path, parent_id, mtime_ns, stats, stack)
+            self._tick(conn, changed, stats)
+
+    def _update_dir(self, conn, dir_id, path, parent_id, mtime_ns, stats, stack):
+        """重新列出一个目录并同步差异，返回改动的行数"""
+        listed = None
+        errors = []
+        for _, dirs, files in ScandirScanner(throttle=self.throttle).walk(path, onerror=errors.append):
+            listed = files, dirs
+            break
+        if listed is None:
+            # 目录无法列出（没有权限、网络共享断开、打开的文件过多等），不能当作空目录删除
+            # 已有的记录；修改时间也不更新，下一次增量更新重新列出
+            stats.dirs_failed += 1
+            print(f"无法列出目录 {path}: {errors[0] if errors else ''}", file=sys.stderr)
+            return 0
+
+        paths = self.dir_paths(conn)
+        if dir_id is None:
+            name = path if parent_id is None else os.path.basename(path)
+            dir_id = conn.execute(
+                "INSERT INTO dirs (parent_id, name, mtime_ns) VALUES (?, ?, ?)", (parent_id, name, mtime_ns)
+            ).lastrowid
+            paths.remember(path, dir_id)
+        else:
+            conn.execute("UPDATE dirs SET mtime_ns = ? WHERE id = ?", (mtime_ns, dir_id))
+
+        listed_files, dirs = listed
+        listed_dirs = dir_rows(dir_id, path, dirs)
+
+        stored = {row[1]: row for row in iter_dir_files(conn, dir_id)}
+        upserts = []
+        for entry in listed_files:
+            new_row = file_row(dir_id, entry)
+            old_row = stored.pop(entry.filename, None)
+            if old_row is None or old_row[2:] != new_row[2:]:
+                upserts.append(new_row)
+        if upserts:
+            conn.executemany(UPSERT_FILE_SQL, upserts)
+        if stored:
+            conn.executemany("DELETE FROM files WHERE id = ?", [(row[0],) for row in stored.values()])
+
+        removed = 0
+        listed_names = {row[2] for row in listed_dirs}
+        children = {}
+        for child_id, name in conn.execute("SELECT id, name FROM dirs WHERE parent_id = ?", (dir_id,)).fetchall():
+            if name in listed_names:
+                children[name] = child_id
+            else:
+                removed += delete_subtree(conn, child_id)
+                paths.forget(os.path.join(path, name))
+
+        for _, _, name, child_mtime_ns in listed_dirs:
+            stack.append((children.get(name), os.path.join(path, name), dir_id, child_mtime_ns))
+
+        stats.upserted += len(upserts)
+        stats.deleted += len(stored) + removed
+        return len(upserts) + len(stored) + removed
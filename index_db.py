@@ -0,0 +1,297 @@
+"""索引数据库的表结构和通用 SQL
+
+第 2 版表结构：
+- dirs 表保存目录树，每个目录一行 (编号, 父目录编号, 名称, 修改时间)，
+  父目录编号为 NULL 的行是扫描的根目录，名称就是根目录的完整路径
+- files 表只保存所在目录的编号和文件名，修改时间保存为整数时间戳
+
+同一个目录前缀不再在每一行里重复保存，完整路径只在显示结果时通过
+file_path(dir_id, filename) SQL 函数拼出来。旧格式的数据库用 migrate.py 升级。
+"""
+import os
+import re
+import sqlite3
+import time
+from functools import lru_cache
+from pathlib import Path
+
+SCHEMA_VERSION = 2
+
+# 目录编号使用 AUTOINCREMENT，删除的编号不会被复用，编号到路径的缓存因此不会过期
+DIRS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS dirs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        parent_id INTEGER,
+        name TEXT NOT NULL,
+        mtime_ns INTEGER
+    )
+"""
+
+FILES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY,
+        dir_id INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        size INTEGER,
+        mtime INTEGER
+    )
+"""
+
+# 文件扩展名：小写、不含点，没有扩展名时为空字符串。rtrim 去掉末尾所有不是点的字符，
+# 剩下部分的长度就是最后一个点的位置。只用内置函数，任何连接都能写入带这个表达式索引的表，
+# 查询时必须写成完全相同的表达式才能用上索引
+EXT_SQL = ("CASE WHEN instr(filename, '.') > 0 "
+           "THEN lower(substr(filename, length(rtrim(filename, replace(filename, '.', ''))) + 1)) "
+           "ELSE '' END")
+
+# 完整扫描时先写数据再建索引，比逐行维护索引快
+INDEXES_SQL = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_dirs_parent_name ON dirs(parent_id, name)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_files_dir_name ON files(dir_id, filename)",
+]
+
+# 搜索语法中 ext: size: dm: 使用的索引（见 query.py）
+FILTER_INDEXES_SQL = [
+    f"CREATE INDEX IF NOT EXISTS idx_files_ext ON files({EXT_SQL})",
+    "CREATE INDEX IF NOT EXISTS idx_files_size ON files(size)",
+    "CREATE INDEX IF NOT EXISTS idx_files_mtime ON files(mtime)",
+]
+
+INSERT_FILE_SQL = "INSERT INTO files (dir_id, filename, size, mtime) VALUES (?, ?, ?, ?)"
+
+# 使用 UPSERT 而不是 INSERT OR REPLACE：REPLACE 删除旧行时不会触发 DELETE 触发器，
+# 会让全文索引里残留旧记录
+UPSERT_FILE_SQL = """
+    INSERT INTO files (dir_id, filename, size, mtime) VALUES (?, ?, ?, ?)
+    ON CONFLICT(dir_id, filename) DO UPDATE SET
+        size = excluded.size,
+        mtime = excluded.mtime
+"""
+
+INSERT_DIR_SQL = "INSERT INTO dirs (id, parent_id, name, mtime_ns) VALUES (?, ?, ?, ?)"
+
+# 一个目录及其下所有子目录的编号。写在子查询里而不是语句开头，
+# 以 WITH 开头的 DELETE 语句在 sqlite3 模块中拿不到 rowcount
+SUBTREE_SQL = """
+    WITH RECURSIVE subtree(id) AS (
+        SELECT ?
+        UNION ALL
+        SELECT d.id FROM dirs d JOIN subtree s ON d.parent_id = s.id
+    )
+    SELECT id FROM subtree
+"""
+
+
+def table_exists(conn, name):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+    return row is not None
+
+
+def schema_version(conn):
+    """数据库的表结构版本：0 表示空数据库，1 表示以完整路径为主键的旧格式"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version:
+        return version
+    return 1 if table_exists(conn, 'files') else 0
+
+
+def create_indexes(conn, filters=True):
+    """建立唯一索引，filters 为 True 时同时建立搜索过滤用的索引并更新统计信息"""
+    for sql in INDEXES_SQL:
+        conn.execute(sql)
+    if filters:
+        for sql in FILTER_INDEXES_SQL:
+            conn.execute(sql)
+        # 让查询规划器知道各个索引的选择性；只抽样，几百万行也很快
+        conn.execute("PRAGMA analysis_limit = 1000")
+        conn.execute("ANALYZE")
+
+
+def create_tables(conn, with_indexes=True):
+    """创建索引所需的表，旧格式的数据库需要先升级
+
+    已有的大数据库补建过滤索引很慢，这里只保证唯一索引存在，过滤索引在完整索引、
+    升级和增量更新时建立，没有时搜索照常进行，只是更慢。
+    """
+    if schema_version(conn) == 1:
+        raise ValueError("数据库是旧格式，请先升级数据库格式")
+    conn.execute(DIRS_TABLE_SQL)
+    conn.execute(FILES_TABLE_SQL)
+    if with_indexes:
+        create_indexes(conn, filters=False)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+
+
+def format_mtime(mtime):
+    """把时间戳格式化为显示用的字符串"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mtime))
+
+
+def file_row(dir_id, entry):
+    """把扫描得到的 FileEntry 转换为 files 表的一行"""
+    return (dir_id, entry.filename, entry.size, int(entry.mtime))
+
+
+def dir_prefix(dir_path):
+    """目录下所有路径的公共前缀（以分隔符结尾）"""
+    return dir_path if dir_path.endswith(os.sep) else dir_path + os.sep
+
+
+def iter_dir_files(conn, dir_id):
+    """返回直接位于目录下的文件 (id, filename, size, mtime)"""
+    return conn.execute("SELECT id, filename, size, mtime FROM files WHERE dir_id = ?", (dir_id,))
+
+
+def delete_subtree(conn, dir_id):
+    """删除目录本身的记录以及其下的所有文件和子目录记录，返回删除的文件数"""
+    cur = conn.execute(f"DELETE FROM files WHERE dir_id IN ({SUBTREE_SQL})", (dir_id,))
+    removed = cur.rowcount
+    conn.execute(f"DELETE FROM dirs WHERE id IN ({SUBTREE_SQL})", (dir_id,))
+    return removed
+
+
+def iter_dir_paths(conn):
+    """逐个返回所有目录的 (编号, 完整路径)
+
+    目录总是在父目录之后插入，按编号顺序遍历时父目录的路径一定已经算出。
+    """
+    paths = {}
+    for dir_id, parent_id, name in conn.execute("SELECT id, parent_id, name FROM dirs ORDER BY id"):
+        if parent_id is None:
+            path = name
+        else:
+            parent = paths.get(parent_id)
+            if parent is None:
+                continue
+            path = os.path.join(parent, name)
+        paths[dir_id] = path
+        yield dir_id, path
+
+
+class DirPaths:
+    """目录编号和完整路径之间的转换，查过的目录缓存在内存中
+
+    目录改名或移动在数据库里表现为删除旧目录、插入新目录，同一个编号对应的路径
+    不会改变，删除目录时调用 forget() 清掉缓存即可。
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._paths = {}
+        self._ids = {}
+
+    def remember(self, path, dir_id):
+        self._paths[dir_id] = path
+        self._ids[path] = dir_id
+
+    def forget(self, path):
+        """删除目录后清除它和所有子目录的缓存"""
+        prefix = dir_prefix(path)
+        for cached in [p for p in self._ids if p == path or p.startswith(prefix)]:
+            self._paths.pop(self._ids.pop(cached), None)
+
+    def path(self, dir_id):
+        """目录编号对应的完整路径，目录不存在时返回 None"""
+        path = self._paths.get(dir_id)
+        if path is not None:
+            return path
+
+        chain = []
+        current = dir_id
+        while current is not None and current not in self._paths:
+            row = self.conn.execute("SELECT parent_id, name FROM dirs WHERE id = ?", (current,)).fetchone()
+            if row is None:
+                return None
+            chain.append((current, row[1]))
+            current = row[0]
+
+        path = self._paths[current] if current is not None else None
+        for chain_id, name in reversed(chain):
+            path = name if path is None else os.path.join(path, name)
+            self.remember(path, chain_id)
+        return path
+
+    def lookup(self, path):
+        """完整路径对应的目录编号，数据库中没有该目录时返回 None"""
+        dir_id = self._ids.get(path)
+        if dir_id is not None:
+            return dir_id
+
+        row = self.conn.execute("SELECT id FROM dirs WHERE parent_id IS NULL AND name = ?", (path,)).fetchone()
+        if row is None:
+            parent, name = os.path.split(path)
+            if not name or parent == path:
+                return None
+            parent_id = self.lookup(parent)
+            if parent_id is None:
+                return None
+            row = self.conn.execute(
+                "SELECT id FROM dirs WHERE parent_id = ? AND name = ?", (parent_id, name)
+            ).fetchone()
+            if row is None:
+                return None
+        self.remember(path, row[0])
+        return row[0]
+
+    def file_path(self, dir_id, filename):
+        """文件的完整路径"""
+        parent = self.path(dir_id)
+        return filename if parent is None else os.path.join(parent, filename)
+
+
+@lru_cache(maxsize=64)
+def _compile_regex(pattern):
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def regexp(pattern, value):
+    """SQL 中 value REGEXP pattern 的实现，不区分大小写"""
+    return value is not None and _compile_regex(pattern).search(value) is not None
+
+
+def register_functions(conn):
+    """在连接上注册 file_path(dir_id, filename) 和 regexp SQL 函数，返回 file_path 使用的 DirPaths"""
+    paths = DirPaths(conn)
+    conn.create_function('file_path', 2, paths.file_path, deterministic=True)
+    conn.create_function('regexp', 2, regexp, deterministic=True)
+    return paths
+
+
+def remove_database(db_path):
+    """删除数据库文件以及 WAL 模式留下的 -wal、-shm 文件"""
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        try:
+            os.remove(db_path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def publish_database(source_path, target_path):
+    """把 source_path 压缩复制为 target_path
+
+    VACUUM INTO 只需要读源数据库，复制期间其他连接仍然可以继续搜索它；
+    先写临时文件再 os.replace，target_path 要么不存在要么是完整的数据库。
+    """
+    temp_path = target_path + '.tmp'
+    remove_database(temp_path)
+    conn = sqlite3.connect(source_path)
+    try:
+        conn.execute("VACUUM INTO ?", (temp_path,))
+    finally:
+        conn.close()
+    # 最终数据库只有一个文件，方便作为快照复制和保存
+    conn = sqlite3.connect(temp_path)
+    try:
+        conn.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        conn.close()
+    os.replace(temp_path, target_path)
+
+
+def open_readonly(db_path, check_same_thread=True):
+    """以只读方式打开数据库，供后台查询线程使用"""
+    uri = Path(os.path.abspath(db_path)).as_uri() + '?mode=ro'
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+    register_functions(conn)
+    return conn
@@ -0,0 +1,147 @@
+"""专用的 SQLite 写入线程
+
+扫描线程把数据行放入有界队列，由唯一的写入线程持有数据库连接并执行
+executemany/commit。队列满时 put() 会阻塞，形成背压，避免扫描速度远超
+写入速度时内存无限增长。
+
+写入的是一个全新的数据库，每个文件只出现一次，直接 INSERT 不需要 UPSERT；
+唯一索引在写完之后由调用方用 create_indexes() 一次建立。
+
+数据库使用 WAL 模式，每次提交后搜索线程的只读连接马上就能看到新写入的行，
+读写互不阻塞，索引进行中就可以搜索已经扫描到的部分。
+
+指定 checkpoint 时同时写入扫描器给出的目录完成标记，并在每次提交前更新断点中的
+已提交文件数和目录数（见 checkpoint.py），中断后可以从断点继续。
+
+指定 rollups 时在写入文件的同一个事务中累加每个目录的直接文件数和大小（见 dir_sizes.py），
+扫描结束后只需要自下而上求和，不用再在 files 上统计一遍。
+
+指定 name_keys 时同样在写入文件的事务中为这一批新行生成拼音和大小写折叠的搜索键
+（见 name_keys.py），扫描结束后只需要建立它们的全文索引。
+
+指定 metrics 时记录每批 executemany 和每次 commit 的延迟，以及写入线程空等
+扫描结果的时间（见 metrics.py）。
+"""
+import queue
+import sqlite3
+import threading
+import time
+
+from checkpoint import update_checkpoint, INSERT_DONE_SQL
+from dir_sizes import create_rollup_table, add_direct_sizes
+from index_db import create_tables, INSERT_FILE_SQL, INSERT_DIR_SQL
+from name_keys import create_name_keys, add_name_keys
+
+_STOP = object()
+
+
+class IndexWriter(threading.Thread):
+    def __init__(self, db_path, queue_size=16, commit_rows=10000, commit_interval=1.0, on_commit=None,
+                 metrics=None, checkpoint=False, rows_written=0, dirs_done=0, min_commit_interval=0.0,
+                 rollups=False, name_keys=False):
+        super().__init__(name='IndexWriter', daemon=True)
+        self.db_path = db_path
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.commit_rows = commit_rows
+        # 两次提交之间最多间隔的秒数，保证索引过程中的搜索能及时看到新数据
+        self.commit_interval = commit_interval
+        # 两次提交之间至少间隔的秒数，后台索引时用来降低提交和落盘的频率
+        self.min_commit_interval = min_commit_interval
+        self.on_commit = on_commit
+        self.metrics = metrics
+        self.checkpoint = checkpoint
+        self.rollups = rollups
+        self.name_keys = name_keys
+        # 继续中断的扫描时从断点中的计数开始
+        self.rows_written = rows_written
+        self.dirs_done = dirs_done
+        self.error = None
+
+    def put(self, root, rows, dirs=(), done=()):
+        """提交一批文件行、目录记录和已经列完的目录编号，队列满时阻塞"""
+        if self.error is not None:
+            raise self.error
+        if rows or dirs or done:
+            self.queue.put((root, rows, dirs, done))
+
+    def run(self):
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # 临时数据库出错时会整个重建，不需要每次提交都等待落盘
+            conn.execute("PRAGMA synchronous=NORMAL")
+            create_tables(conn, with_indexes=False)
+            if self.rollups:
+                create_rollup_table(conn)
+            if self.name_keys:
+                create_name_keys(conn)
+                # 继续中断的扫描时，断点之前提交的行已经在同一个事务中生成过键
+                keyed_id = conn.execute("SELECT coalesce(max(id), 0) FROM files").fetchone()[0]
+
+            metrics = self.metrics
+            clock = time.perf_counter
+            pending = 0
+            last_commit = time.monotonic()
+            while True:
+                begin = clock()
+                item = self.queue.get()
+                if item is _STOP:
+                    break
+                root, rows, dirs, done = item
+                inserted = clock()
+                if dirs:
+                    conn.executemany(INSERT_DIR_SQL, dirs)
+                conn.executemany(INSERT_FILE_SQL, rows)
+                if self.rollups and rows:
+                    add_direct_sizes(conn, rows)
+                if self.name_keys and rows:
+                    keyed_id = add_name_keys(conn, keyed_id)
+                if self.checkpoint and done:
+                    conn.executemany(INSERT_DONE_SQL, ((dir_id,) for dir_id in done))
+                self.dirs_done += len(done)
+                pending += len(rows)
+                self.rows_written += len(rows)
+                if metrics is not None:
+                    metrics.add_time('write.idle', inserted - begin)
+                    metrics.observe('write.insert', clock() - inserted)
+                    metrics.count('rows', len(rows))
+
+                # 攒够一定行数、距上次提交太久或者队列暂时为空时提交
+                now = time.monotonic()
+                since_commit = now - last_commit
+                if since_commit >= self.min_commit_interval and (
+                        pending >= self.commit_rows or since_commit >= self.commit_interval or self.queue.empty()):
+                    begin = clock()
+                    self._commit(conn)
+                    if metrics is not None:
+                        metrics.observe('write.commit', clock() - begin)
+                    pending = 0
+                    last_commit = now
+                    if self.on_commit:
+                        self.on_commit(root, self.rows_written)
+
+            begin = clock()
+            self._commit(conn)
+            if metrics is not None:
+                metrics.observe('write.commit', clock() - begin)
+        except Exception as e:
+            self.error = e
+            # 继续消费队列，避免扫描线程在 put() 上永远阻塞
+            while self.queue.get() is not _STOP:
+                pass
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _commit(self, conn):
+        if self.checkpoint:
+            update_checkpoint(conn, self.rows_written, self.dirs_done)
+        conn.commit()
+
+    def close(self):
+        """等待队列写完并关闭连接，写入出错时抛出异常"""
+        self.queue.put(_STOP)
+        self.join()
+        if self.error is not None:
+            raise self.error
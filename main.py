@@ -2,160 +2,255 @@ import sys
 import os
 from datetime import datetime
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
-                            QHBoxLayout, QLineEdit, QPushButton, QTableWidget, 
-                            QTableWidgetItem, QHeaderView, QFileDialog, QMenuBar,
-                            QMenu, QMessageBox, QLabel, QProgressBar, QSystemTrayIcon)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
+                            QHBoxLayout, QLineEdit, QPushButton, QTableView, 
+                            QHeaderView, QFileDialog, QMenuBar,
+                            QMenu, QMessageBox, QLabel, QProgressBar, QSystemTrayIcon, QDialog)
+from PyQt6.QtCore import Qt, QThread, pyqtSignal, QAbstractTableModel, QModelIndex
 import sqlite3
-import win32file
-import win32con
-import winerror
-from PyQt6.QtGui import QKeySequence, QShortcut, QIcon
+from PyQt6.QtGui import QKeySequence, QShortcut, QIcon, QActionGroup
+from scanner import DEFAULT_SCANNER
+from index_db import create_tables, format_mtime, schema_version
+from engine import (full_index, update_database, build_sidecar, snapshot_label, load_last_database,
+                    save_last_database, pending_index, DEFAULT_DB_FOLDER, TEMP_DB_NAME)
+from watcher import ChangeTracker
+from migrate import migrate_database
+from search_executor import SearchExecutor
+from federated import list_snapshots, snapshot_time
+from snapshot_diff import diff_snapshots, diff_row, export_diff, DiffStats, CSV_HEADERS
+from metrics import Metrics, METRICS_LOG
+from query_server import QueryServer
+from throttle import Throttle, PROFILE_NAMES, DEFAULT_PROFILE
+from duplicates import find_duplicates, wasted_bytes, DuplicateStats
+from dir_sizes import has_rollups, top_children, dir_size, format_size, TOP_N
+from index_db import open_readonly
+from query import parse_size, QueryError
+from snapshot_store import SnapshotStore, KEEP_LAST, KEEP_DAILY
 
 class FastIndexWorker(QThread):
     progress = pyqtSignal(str)
     finished = pyqtSignal(str, float)
+    # 临时数据库第一次提交后发出，界面可以开始搜索已经扫描到的部分
+    staging_ready = pyqtSignal(str)
 
-    def __init__(self, drives, db_folder, specific_dir=None):
+    def __init__(self, drives, db_folder, specific_dir=None, scanner_name=DEFAULT_SCANNER, workers=None,
+                 incremental_db=None, migrate_db=None, expected_files=None, resume=False,
+                 throttle_profile=DEFAULT_PROFILE):
         super().__init__()
         self.drives = drives
         self.specific_dir = specific_dir
         self.db_folder = db_folder
-        print(f"FastIndexWorker 初始化: drives={drives}, specific_dir={specific_dir}, db_folder={db_folder}")
+        # 完整索引写入的临时数据库，索引期间搜索也使用它
+        self.temp_db = os.path.join(db_folder, TEMP_DB_NAME)
+        self.scanner_name = scanner_name
+        # 扫描线程池大小，None 表示使用默认值
+        self.workers = workers
+        # 指定后在该数据库上做增量更新，而不是生成新的数据库
+        self.incremental_db = incremental_db
+        # 指定后把该旧格式数据库升级为新格式
+        self.migrate_db = migrate_db
+        # 升级完成后的报告，显示在完成提示中
+        self.report = None
+        # 分阶段统计，界面在收到进度时读取；expected_files 是预计的文件数（例如上次索引的结果）
+        self.metrics = Metrics('update' if incremental_db else 'migrate' if migrate_db else 'index')
+        self.expected_files = expected_files
+        # 从临时数据库中的断点继续上次没有完成的完整索引（扫描范围也取自断点）
+        self.resume = resume
+        # 被用户停止（而不是出错）时为 True
+        self.stopped = False
+        # 后台模式的限速，全速时为 None（见 throttle.py）
+        self.throttle = Throttle.from_profile(throttle_profile, metrics=self.metrics)
+        print(f"FastIndexWorker 初始化: drives={drives}, specific_dir={specific_dir}, db_folder={db_folder}, scanner={scanner_name}, workers={workers}, incremental_db={incremental_db}, migrate_db={migrate_db}")
+
+    def run_incremental(self):
+        """在现有数据库上增量更新"""
+        start_time = datetime.now()
+        try:
+            def on_progress(stats):
+                self.progress.emit(f"正在增量更新 - {stats}")
+
+            roots = [self.specific_dir] if self.specific_dir else None
+            stats = update_database(
+                self.incremental_db,
+                roots,
+                should_stop=self.isInterruptionRequested,
+                on_progress=on_progress,
+                metrics=self.metrics,
+                throttle=self.throttle
+            )
+
+            total_time = (datetime.now() - start_time).total_seconds()
+            self.progress.emit(f"增量更新完成！{stats}")
+            self.finished.emit(self.incremental_db, total_time)
+        except InterruptedError:
+            self.stopped = True
+            self.progress.emit("增量更新已停止")
+            self.finished.emit("", 0)
+        except Exception as e:
+            self.progress.emit(f"增量更新出错: {str(e)}")
+            self.finished.emit("", 0)
+
+    def run_migration(self):
+        """把旧格式数据库升级为新格式"""
+        start_time = datetime.now()
+        try:
+            def on_progress(report):
+                self.progress.emit(f"正在升级数据库格式 - 已转换 {report.files} 个文件...")
+
+            self.progress.emit("正在升级数据库格式...")
+            report = migrate_database(self.migrate_db, on_progress=on_progress)
+            print(f"数据库升级: {report}")
+            self.report = report
+            self.progress.emit("正在生成文件名索引文件...")
+            build_sidecar(self.migrate_db)
+
+            total_time = (datetime.now() - start_time).total_seconds()
+            self.progress.emit(f"数据库格式升级完成！{report}")
+            self.finished.emit(self.migrate_db, total_time)
+        except Exception as e:
+            self.progress.emit(f"升级数据库格式出错: {str(e)}")
+            self.finished.emit("", 0)
 
     def run(self):
         print("FastIndexWorker 开始运行")
+        if self.incremental_db:
+            self.run_incremental()
+            return
+        if self.migrate_db:
+            self.run_migration()
+            return
         start_time = datetime.now()
-        temp_db = os.path.join(self.db_folder, 'temp_indexing.db')
-        print(f"使用临时数据库: {temp_db}")
-        
+        print(f"使用临时数据库: {self.temp_db}")
+
         try:
-            # 创建临时数据库连接
-            conn = sqlite3.connect(temp_db)
-            
-            # 创建表
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS files (
-                    path TEXT PRIMARY KEY,
-                    filename TEXT,
-                    size INTEGER,
-                    modified_time TEXT
-                )
-            """)
-            conn.commit()
-            
-            total_file_count = 0
-            batch = []
-            
-            # 定义要跳过的目录
-            skip_dirs = {
-                '$Recycle.Bin',
-                '$Windows.~BT',
-                '$Windows.~WS',
-                '$360Section',
-                'System Volume Information',
-                'Config.Msi',
-                'MSOCache',
-                'Windows.old'
-            }
-
-            for drive in self.drives:
-                if not drive.endswith(':\\'):
-                    continue
-                
-                try:
-                    # 如果指定了特定目录，只扫描该目录
-                    start_path = self.specific_dir if self.specific_dir else drive
-                    
-                    self.progress.emit(f"正在扫描 {start_path}...")
-                    
-                    # 使用 os.walk 进行文件系统扫描
-                    for root, dirs, files in os.walk(start_path):
-                        # 修改 dirs 列表来跳过不需要的目录
-                        dirs[:] = [d for d in dirs if d not in skip_dirs and not d.startswith('$')]
-                        
-                        if self.isInterruptionRequested():
-                            raise InterruptedError("索引过程被用户终止")
-                        
-                        for file in files:
-                            try:
-                                full_path = os.path.join(root, file)
-                                # 跳过隐藏文件和系统文件
-                                if os.path.exists(full_path) and not os.path.isdir(full_path):
-                                    try:
-                                        attrs = win32file.GetFileAttributes(full_path)
-                                        is_hidden = attrs & win32file.FILE_ATTRIBUTE_HIDDEN
-                                        is_system = attrs & win32file.FILE_ATTRIBUTE_SYSTEM
-                                        if not is_hidden and not is_system:
-                                            stats = os.stat(full_path)
-                                            batch.append((
-                                                full_path,
-                                                file,
-                                                stats.st_size,
-                                                datetime.fromtimestamp(stats.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
-                                            ))
-                                            total_file_count += 1
-                                            
-                                            if total_file_count % 1000 == 0:
-                                                self.progress.emit(f"正在扫描 {drive} - 已找到 {total_file_count} 个文件...")
-                                            
-                                            if len(batch) >= 10000:
-                                                conn.executemany(
-                                                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
-                                                    batch
-                                                )
-                                                conn.commit()
-                                                batch = []
-                                    except WindowsError:
-                                        continue
-                                    
-                            except (OSError, FileNotFoundError):
-                                continue
-                    
-                except Exception as e:
-                    self.progress.emit(f"处理驱动器 {drive} 时出错: {str(e)}")
-                    continue
-            
-            # 处理剩余的批次
-            if batch:
-                conn.executemany(
-                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
-                    batch
-                )
-                conn.commit()
-            
-            # 计算总耗时
-            end_time = datetime.now()
-            total_time = (end_time - start_time).total_seconds()
-            
-            # 根据扫描类型生成数据库名称
-            if self.specific_dir:
-                dir_name = os.path.basename(self.specific_dir.rstrip('\\'))
-                scan_type = f"Dir_{dir_name}"
+            checkpoint = pending_index(self.db_folder) if self.resume else None
+            if checkpoint is not None:
+                roots = checkpoint['roots']
+                label = checkpoint['label']
+                scanner_name = checkpoint['scanner'] or self.scanner_name
             else:
-                drives_str = '+'.join(d.replace(':\\', '') for d in self.drives)
-                scan_type = f"Drive_{drives_str}"
-            
-            # 在数据库目录下创建最终数据库文件
-            final_db_name = f"{end_time.strftime('%Y-%m-%d_%H-%M-%S')}_{scan_type}.db"
-            final_db_path = os.path.join(self.db_folder, final_db_name)
-            print(f"最终数据库路径: {final_db_path}")
-            
-            conn.close()
-            
-            if os.path.exists(final_db_path):
-                os.remove(final_db_path)
-            os.rename(temp_db, final_db_path)
-            
+                # 如果指定了特定目录，只扫描该目录
+                if self.specific_dir:
+                    roots = [self.specific_dir]
+                else:
+                    roots = [drive for drive in self.drives if drive.endswith(':\\')]
+                label = snapshot_label(self.drives, self.specific_dir)
+                scanner_name = self.scanner_name
+
+            final_db_path, total_file_count = full_index(
+                roots,
+                self.db_folder,
+                label,
+                scanner_name=scanner_name,
+                workers=self.workers,
+                should_stop=self.isInterruptionRequested,
+                on_progress=self.progress.emit,
+                on_staging=self.staging_ready.emit,
+                metrics=self.metrics,
+                resume=checkpoint is not None,
+                throttle=self.throttle
+            )
+
+            total_time = (datetime.now() - start_time).total_seconds()
             self.progress.emit(f"索引完成！共索引 {total_file_count} 个文件")
             self.finished.emit(final_db_path, total_time)
-            
+
+        except InterruptedError:
+            self.stopped = True
+            self.progress.emit("索引已停止，已扫描的部分保存在断点中，可以稍后继续")
+            self.finished.emit("", 0)
         except Exception as e:
             self.progress.emit(f"索引过程出错: {str(e)}")
-            if os.path.exists(temp_db):
-                os.remove(temp_db)
             self.finished.emit("", 0)
 
+class SnapshotDiffWorker(QThread):
+    """在后台比较两个快照，out_path 为空时分批把变化送回界面，否则直接导出为 CSV"""
+    # 一批 DiffEntry
+    batch = pyqtSignal(object)
+    # (DiffStats, 错误信息)，出错或被终止时错误信息不为空
+    finished = pyqtSignal(object, str)
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, old_db, new_db, out_path=None):
+        super().__init__()
+        self.old_db = old_db
+        self.new_db = new_db
+        self.out_path = out_path
+        self.stop_requested = False
+
+    def stop(self):
+        self.stop_requested = True
+
+    def run(self):
+        stats = DiffStats()
+        try:
+            changes = diff_snapshots(self.old_db, self.new_db, stats, should_stop=lambda: self.stop_requested)
+            if self.out_path:
+                export_diff(changes, self.out_path)
+            else:
+                pending = []
+                for change in changes:
+                    pending.append(change)
+                    if len(pending) >= self.BATCH_SIZE:
+                        self.batch.emit(pending)
+                        pending = []
+                if pending:
+                    self.batch.emit(pending)
+            self.finished.emit(stats, "")
+        except (sqlite3.Error, OSError, ValueError, InterruptedError) as e:
+            print(f"比较数据库出错: {e}")
+            self.finished.emit(stats, str(e))
+
+class DuplicatesWorker(QThread):
+    """在后台查找重复文件"""
+    progress = pyqtSignal(str)
+    # (DuplicateGroup 列表, DuplicateStats, 错误信息)，出错或被终止时错误信息不为空
+    finished = pyqtSignal(object, object, str)
+
+    def __init__(self, db_path, min_size=1, query=None):
+        super().__init__()
+        self.db_path = db_path
+        self.min_size = min_size
+        self.query = query
+        self.stop_requested = False
+
+    def stop(self):
+        self.stop_requested = True
+
+    def run(self):
+        stats = DuplicateStats()
+        try:
+            groups = find_duplicates(self.db_path, self.min_size, self.query, stats=stats,
+                                     should_stop=lambda: self.stop_requested, on_progress=self.progress.emit)
+            self.finished.emit(groups, stats, "")
+        except (sqlite3.Error, OSError, ValueError, InterruptedError) as e:
+            print(f"查找重复文件出错: {e}")
+            self.finished.emit([], stats, str(e))
+
+class SnapshotStoreWorker(QThread):
+    """在后台执行快照库的导入、还原和压缩"""
+    progress = pyqtSignal(str)
+    # (结果, 错误信息)，出错时错误信息不为空
+    finished = pyqtSignal(object, str)
+
+    def __init__(self, store, action, *args):
+        super().__init__()
+        self.store = store
+        # 'import_folder'、'checkout' 或 'compact'，args 是对应方法的参数
+        self.action = action
+        self.args = args
+
+    def run(self):
+        try:
+            if self.action == 'compact':
+                result = self.store.compact(*self.args)
+            else:
+                result = getattr(self.store, self.action)(*self.args, on_progress=self.progress.emit)
+            self.finished.emit(result, "")
+        except (sqlite3.Error, OSError, ValueError) as e:
+            print(f"快照库操作出错: {e}")
+            self.finished.emit(None, str(e))
+
 def resource_path(relative_path):
     """获取资源的绝对路径"""
     try:
@@ -166,7 +261,620 @@ def resource_path(relative_path):
     
     return os.path.join(base_path, relative_path)
 
+class ResultTableModel(QAbstractTableModel):
+    """按需加载的搜索结果模型
+
+    只保存已经加载的行，视图滚动到底部时通过 canFetchMore/fetchMore 请求下一页，
+    下一页由搜索线程查询后再通过 append_rows 追加，几十万条结果也不会一次性创建。
+    """
+    HEADERS = ['文件名', '路径', '大小', '修改时间']
+
+    # 请求下一页：(代号, 下一页起点)
+    fetch_requested = pyqtSignal(int, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+        self.generation = 0
+        self.next_after = None
+        self.fetching = False
+
+    def set_rows(self, generation, rows, next_after):
+        """用新搜索的第一页替换全部结果"""
+        self.beginResetModel()
+        self.rows = list(rows)
+        self.generation = generation
+        self.next_after = next_after
+        self.fetching = False
+        self.endResetModel()
+
+    def append_rows(self, generation, rows, next_after):
+        """追加下一页结果"""
+        if generation != self.generation:
+            return
+        self.fetching = False
+        self.next_after = next_after
+        if rows:
+            first = len(self.rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+
+    def clear(self):
+        self.set_rows(self.generation, [], None)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        path, filename, size, mtime = self.rows[index.row()]
+        column = index.column()
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == 0:
+                return filename
+            if column == 1:
+                return path
+            if column == 2:
+                return f"{size:,} bytes"
+            return format_mtime(mtime)
+        if role == Qt.ItemDataRole.TextAlignmentRole and column == 2:
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.next_after is not None and not self.fetching
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.canFetchMore(parent):
+            self.fetching = True
+            self.fetch_requested.emit(self.generation, self.next_after)
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        """只对已经加载的行排序"""
+        keys = [
+            lambda row: row[1].lower(),
+            lambda row: row[0].lower(),
+            lambda row: row[2],
+            lambda row: row[3],
+        ]
+        self.layoutAboutToBeChanged.emit()
+        self.rows.sort(key=keys[column], reverse=order == Qt.SortOrder.DescendingOrder)
+        self.layoutChanged.emit()
+
+
+class DiffTableModel(QAbstractTableModel):
+    """快照比较结果，最多保存 limit 行，更多的变化只能导出查看"""
+
+    def __init__(self, limit=100000, parent=None):
+        super().__init__(parent)
+        self.limit = limit
+        self.entries = []
+        self.truncated = False
+
+    def append_entries(self, entries):
+        room = self.limit - len(self.entries)
+        if room < len(entries):
+            self.truncated = True
+            entries = entries[:room]
+        if entries:
+            first = len(self.entries)
+            self.beginInsertRows(QModelIndex(), first, first + len(entries) - 1)
+            self.entries.extend(entries)
+            self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.entries)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(CSV_HEADERS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.ItemDataRole.DisplayRole:
+            value = diff_row(self.entries[index.row()])[index.column()]
+            return f"{value:,}" if isinstance(value, int) else value
+        if role == Qt.ItemDataRole.TextAlignmentRole and index.column() in (2, 3):
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return CSV_HEADERS[section]
+        return None
+
+
+class SnapshotDiffDialog(QDialog):
+    """显示两个快照之间的变化，可以导出为 CSV"""
+
+    def __init__(self, old_db, new_db, parent=None):
+        super().__init__(parent)
+        self.old_db = old_db
+        self.new_db = new_db
+        self.setWindowTitle(f"比较 {os.path.basename(old_db)} -> {os.path.basename(new_db)}")
+        self.resize(1000, 600)
+
+        layout = QVBoxLayout(self)
+        self.model = DiffTableModel(parent=self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
+        self.table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.table.setAlternatingRowColors(True)
+        layout.addWidget(self.table)
+
+        bottom = QHBoxLayout()
+        self.status_label = QLabel("正在比较...")
+        bottom.addWidget(self.status_label, 1)
+        self.export_btn = QPushButton("导出 CSV")
+        self.export_btn.clicked.connect(self.export_csv)
+        bottom.addWidget(self.export_btn)
+        close_btn = QPushButton("关闭")
+        close_btn.clicked.connect(self.close)
+        bottom.addWidget(close_btn)
+        layout.addLayout(bottom)
+
+        self.export_worker = None
+        self.worker = SnapshotDiffWorker(old_db, new_db)
+        self.worker.batch.connect(self.model.append_entries)
+        self.worker.finished.connect(self.diff_finished)
+        self.worker.start()
+
+    def diff_finished(self, stats, error):
+        if error:
+            self.status_label.setText(f"比较失败: {error}")
+            return
+        text = str(stats)
+        if self.model.truncated:
+            text += f"（只显示前 {self.model.limit} 条，完整结果请导出）"
+        self.status_label.setText(text)
+
+    def export_csv(self):
+        out_path, _ = QFileDialog.getSaveFileName(self, "导出比较结果", "", "CSV 文件 (*.csv)")
+        if not out_path:
+            return
+        if not self.worker.isRunning() and not self.model.truncated:
+            # 结果已经全部在表格中，直接写出
+            try:
+                written = export_diff(self.model.entries, out_path)
+            except OSError as e:
+                QMessageBox.warning(self, "导出失败", str(e))
+                return
+            self.status_label.setText(f"已导出 {written} 条变化到 {out_path}")
+            return
+        # 表格中只有部分结果，重新比较一次直接写入文件
+        self.export_btn.setEnabled(False)
+        self.export_worker = SnapshotDiffWorker(self.old_db, self.new_db, out_path)
+        self.export_worker.finished.connect(lambda stats, error: self.export_finished(out_path, stats, error))
+        self.export_worker.start()
+        self.status_label.setText(f"正在导出到 {out_path}...")
+
+    def export_finished(self, out_path, stats, error):
+        self.export_btn.setEnabled(True)
+        if error:
+            QMessageBox.warning(self, "导出失败", error)
+        else:
+            self.status_label.setText(f"已导出 {stats.total} 条变化到 {out_path}")
+
+    def closeEvent(self, event):
+        for worker in (self.worker, self.export_worker):
+            if worker is not None and worker.isRunning():
+                worker.stop()
+                worker.wait()
+        event.accept()
+
+
+DUPLICATE_HEADERS = ['组', '路径', '大小', '可释放']
+
+
+class DuplicateTableModel(QAbstractTableModel):
+    """重复文件，每个文件一行，同一组的文件相邻；最多显示 limit 行"""
+
+    def __init__(self, limit=100000, parent=None):
+        super().__init__(parent)
+        self.limit = limit
+        self.rows = []
+        self.truncated = False
+
+    def set_groups(self, groups):
+        self.beginResetModel()
+        self.rows = []
+        self.truncated = False
+        for number, group in enumerate(groups, 1):
+            for path in group.paths:
+                if len(self.rows) >= self.limit:
+                    self.truncated = True
+                    break
+                self.rows.append((number, path, group.size, wasted_bytes(group)))
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(DUPLICATE_HEADERS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.ItemDataRole.DisplayRole:
+            value = self.rows[index.row()][index.column()]
+            return f"{value:,}" if isinstance(value, int) else value
+        if role == Qt.ItemDataRole.TextAlignmentRole and index.column() != 1:
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return DUPLICATE_HEADERS[section]
+        return None
+
+
+class DuplicatesDialog(QDialog):
+    """在当前数据库索引到的文件中查找重复文件，可以用搜索语法限定范围"""
+
+    def __init__(self, db_path, query='', parent=None):
+        super().__init__(parent)
+        self.db_path = db_path
+        self.setWindowTitle(f"查找重复文件 - {os.path.basename(db_path)}")
+        self.resize(1000, 600)
+
+        layout = QVBoxLayout(self)
+        top = QHBoxLayout()
+        top.addWidget(QLabel("条件:"))
+        self.query_input = QLineEdit(query)
+        self.query_input.setPlaceholderText("留空表示全部文件，语法与搜索框相同，例如 ext:jpg;png")
+        top.addWidget(self.query_input, 1)
+        top.addWidget(QLabel("最小大小:"))
+        self.min_size_input = QLineEdit("1mb")
+        self.min_size_input.setFixedWidth(80)
+        top.addWidget(self.min_size_input)
+        self.find_btn = QPushButton("查找")
+        self.find_btn.clicked.connect(self.start_search)
+        top.addWidget(self.find_btn)
+        layout.addLayout(top)
+
+        self.model = DuplicateTableModel(parent=self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
+        self.table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        layout.addWidget(self.table)
+
+        bottom = QHBoxLayout()
+        self.status_label = QLabel("已经计算过的文件哈希保存在数据库目录下，再次查找时不需要重新读取")
+        bottom.addWidget(self.status_label, 1)
+        close_btn = QPushButton("关闭")
+        close_btn.clicked.connect(self.close)
+        bottom.addWidget(close_btn)
+        layout.addLayout(bottom)
+
+        self.worker = None
+
+    def start_search(self):
+        if self.worker is not None and self.worker.isRunning():
+            return
+        try:
+            text = self.min_size_input.text().strip()
+            min_size = parse_size('>=' + text)[0] if text else 1
+        except QueryError as e:
+            QMessageBox.warning(self, "查找重复文件", str(e))
+            return
+        self.find_btn.setEnabled(False)
+        self.status_label.setText("正在查找...")
+        self.worker = DuplicatesWorker(self.db_path, min_size, self.query_input.text().strip() or None)
+        self.worker.progress.connect(self.status_label.setText)
+        self.worker.finished.connect(self.search_finished)
+        self.worker.start()
+
+    def search_finished(self, groups, stats, error):
+        self.find_btn.setEnabled(True)
+        if error:
+            self.status_label.setText(f"查找失败: {error}")
+            return
+        self.model.set_groups(groups)
+        text = str(stats)
+        if self.model.truncated:
+            text += f"（只显示前 {self.model.limit} 个文件）"
+        self.status_label.setText(text)
+
+    def closeEvent(self, event):
+        if self.worker is not None and self.worker.isRunning():
+            self.worker.stop()
+            self.worker.wait()
+        event.accept()
+
+
+DIR_SIZE_HEADERS = ['名称', '大小', '文件数', '占比']
+
+
+class DirSizeTableModel(QAbstractTableModel):
+    """一个目录下最大的子目录，最后一行是目录中直接包含的文件"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # (目录编号, 名称, 大小, 文件数)，直接包含的文件那一行目录编号为 None
+        self.rows = []
+        self.total = 0
+
+    def set_rows(self, rows, total):
+        self.beginResetModel()
+        self.rows = rows
+        self.total = total
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(DIR_SIZE_HEADERS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        dir_id, name, size, files = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            column = index.column()
+            if column == 0:
+                return name
+            if column == 1:
+                return format_size(size)
+            if column == 2:
+                return f"{files:,}"
+            return f"{size * 100 / self.total:.1f}%" if self.total else ""
+        if role == Qt.ItemDataRole.TextAlignmentRole and index.column() != 0:
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        if role == Qt.ItemDataRole.ToolTipRole and dir_id is not None:
+            return "双击查看子目录"
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return DIR_SIZE_HEADERS[section]
+        return None
+
+
+class DirSizesDialog(QDialog):
+    """从扫描的根目录逐级查看最占空间的子目录，数据来自索引时算好的目录大小汇总"""
+
+    def __init__(self, db_path, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"目录大小 - {os.path.basename(db_path)}")
+        self.resize(800, 600)
+        self.conn = open_readonly(db_path)
+        # 已经进入的目录 [(目录编号, 完整路径)]，为空表示在根目录列表
+        self.trail = []
+
+        layout = QVBoxLayout(self)
+        top = QHBoxLayout()
+        self.up_btn = QPushButton("上一级")
+        self.up_btn.clicked.connect(self.go_up)
+        top.addWidget(self.up_btn)
+        self.path_label = QLabel()
+        top.addWidget(self.path_label, 1)
+        layout.addLayout(top)
+
+        self.model = DirSizeTableModel(self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.table.doubleClicked.connect(self.open_row)
+        layout.addWidget(self.table)
+
+        self.status_label = QLabel()
+        layout.addWidget(self.status_label)
+
+        if has_rollups(self.conn):
+            self.show_current()
+        else:
+            self.up_btn.setEnabled(False)
+            self.status_label.setText("这个数据库还没有目录大小汇总，增量更新一次当前索引后即可查看")
+
+    def show_current(self):
+        dir_id, path = self.trail[-1] if self.trail else (None, None)
+        rows = [(child.dir_id, child.name, child.total_size, child.total_files)
+                for child in top_children(self.conn, dir_id, TOP_N)]
+        if dir_id is None:
+            total = sum(row[2] for row in rows)
+            files = sum(row[3] for row in rows)
+        else:
+            direct_files, direct_size, files, total = dir_size(self.conn, dir_id) or (0, 0, 0, 0)
+            if direct_files:
+                rows.append((None, "[本目录中的文件]", direct_size, direct_files))
+        self.model.set_rows(rows, total)
+        self.up_btn.setEnabled(bool(self.trail))
+        self.path_label.setText(path or "所有扫描的根目录")
+        text = f"共 {format_size(total)}，{files:,} 个文件"
+        if len(rows) >= TOP_N:
+            text += f"（只显示最大的 {TOP_N} 个子目录）"
+        self.status_label.setText(text)
+
+    def open_row(self, index):
+        dir_id, name, _, _ = self.model.rows[index.row()]
+        if dir_id is None:
+            return
+        path = os.path.join(self.trail[-1][1], name) if self.trail else name
+        self.trail.append((dir_id, path))
+        self.show_current()
+
+    def go_up(self):
+        if self.trail:
+            self.trail.pop()
+            self.show_current()
+
+    def closeEvent(self, event):
+        self.conn.close()
+        event.accept()
+
+
+SNAPSHOT_STORE_HEADERS = ['快照', '时间', '文件数', '大小', '差异']
+
+
+class SnapshotStoreTableModel(QAbstractTableModel):
+    """快照库中的快照，最新的（基准）在前"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.snapshots = []
+
+    def set_snapshots(self, snapshots):
+        self.beginResetModel()
+        self.snapshots = snapshots
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.snapshots)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(SNAPSHOT_STORE_HEADERS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        snapshot = self.snapshots[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            column = index.column()
+            if column == 0:
+                return snapshot.name
+            if column == 1:
+                return datetime.fromtimestamp(snapshot.created).strftime('%Y-%m-%d %H:%M:%S')
+            if column == 2:
+                return f"{snapshot.files:,}"
+            if column == 3:
+                return format_size(snapshot.total_size)
+            return "基准" if index.row() == 0 else f"{snapshot.delta_rows:,} 行"
+        if role == Qt.ItemDataRole.TextAlignmentRole and index.column() >= 2:
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return "双击还原并打开这个快照"
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return SNAPSHOT_STORE_HEADERS[section]
+        return None
+
+
+class SnapshotStoreDialog(QDialog):
+    """查看快照库，把数据库目录中的快照收进库中，还原并打开任意一个快照"""
+
+    def __init__(self, db_folder, current_db, on_open, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("快照库")
+        self.resize(900, 500)
+        self.store = SnapshotStore(db_folder)
+        self.current_db = current_db
+        self.on_open = on_open
+        self.worker = None
+
+        layout = QVBoxLayout(self)
+        self.model = SnapshotStoreTableModel(self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.table.setSelectionMode(QTableView.SelectionMode.SingleSelection)
+        self.table.doubleClicked.connect(lambda index: self.open_snapshot())
+        layout.addWidget(self.table)
+
+        bottom = QHBoxLayout()
+        self.status_label = QLabel()
+        bottom.addWidget(self.status_label, 1)
+        self.import_btn = QPushButton("导入数据库目录中的快照")
+        self.import_btn.clicked.connect(self.import_folder)
+        bottom.addWidget(self.import_btn)
+        self.compact_btn = QPushButton("压缩")
+        self.compact_btn.clicked.connect(self.compact)
+        bottom.addWidget(self.compact_btn)
+        self.open_btn = QPushButton("打开")
+        self.open_btn.clicked.connect(self.open_snapshot)
+        bottom.addWidget(self.open_btn)
+        close_btn = QPushButton("关闭")
+        close_btn.clicked.connect(self.close)
+        bottom.addWidget(close_btn)
+        layout.addLayout(bottom)
+
+        self.refresh()
+
+    def refresh(self, message=None):
+        self.model.set_snapshots(self.store.snapshots())
+        text = f"共 {len(self.model.snapshots)} 个快照，占用 {format_size(self.store.store_bytes())}"
+        self.status_label.setText(f"{message}；{text}" if message else text)
+
+    def run_worker(self, action, *args, on_done):
+        for button in (self.import_btn, self.compact_btn, self.open_btn):
+            button.setEnabled(False)
+        self.worker = SnapshotStoreWorker(self.store, action, *args)
+        self.worker.progress.connect(self.status_label.setText)
+        self.worker.finished.connect(lambda result, error: self.worker_finished(result, error, on_done))
+        self.worker.start()
+
+    def worker_finished(self, result, error, on_done):
+        for button in (self.import_btn, self.compact_btn, self.open_btn):
+            button.setEnabled(True)
+        if error:
+            QMessageBox.warning(self, "快照库", error)
+            self.refresh()
+            return
+        on_done(result)
+
+    def import_folder(self):
+        # 正在使用的数据库加入快照库后保留原文件
+        self.status_label.setText("正在导入...")
+        self.run_worker('import_folder', [self.current_db] if self.current_db else [],
+                        on_done=lambda added: self.refresh(f"导入了 {added} 个快照"))
+
+    def compact(self):
+        reply = QMessageBox.question(
+            self,
+            "压缩快照库",
+            f"将保留最新的 {KEEP_LAST} 个快照，以及最近 {KEEP_DAILY} 天中每天的最后一个快照，"
+            "其余快照的差异合并后删除。确定吗？",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        self.status_label.setText("正在压缩...")
+        self.run_worker('compact', on_done=lambda dropped: self.refresh(f"删除了 {dropped} 个快照"))
+
+    def open_snapshot(self):
+        rows = self.table.selectionModel().selectedRows()
+        if not rows or (self.worker is not None and self.worker.isRunning()):
+            return
+        snapshot = self.model.snapshots[rows[0].row()]
+        self.status_label.setText(f"正在还原 {snapshot.name}...")
+        self.run_worker('checkout', snapshot.id, on_done=self.snapshot_ready)
+
+    def snapshot_ready(self, db_path):
+        self.on_open(db_path)
+        self.close()
+
+    def closeEvent(self, event):
+        if self.worker is not None and self.worker.isRunning():
+            self.worker.wait()
+        event.accept()
+
+
 class EverythingGUI(QMainWindow):
+    # 搜索线程通过信号把结果送回界面线程
+    # (代号, 关键词, 结果, 下一页起点, 是否追加)
+    search_results_ready = pyqtSignal(int, str, object, object, bool)
+    # (代号, 匹配总数)
+    search_count_ready = pyqtSignal(int, int)
+    # (代号, 按相似度排列的近似匹配结果)
+    search_fuzzy_ready = pyqtSignal(int, object)
+
     def __init__(self):
         super().__init__()
         # 使用 resource_path 获取图标路径
@@ -177,16 +885,32 @@ class EverythingGUI(QMainWindow):
         self.setWindowIcon(self.icon)
         
         # 创建数据库目录
-        self.db_folder = os.path.join(os.path.expanduser('~'), 'Everything_like_By_WZ')
+        self.db_folder = DEFAULT_DB_FOLDER
         if not os.path.exists(self.db_folder):
             os.makedirs(self.db_folder)
             print(f"创建数据库目录: {self.db_folder}")
         
         self.db_path = None
         self.conn = None
+        self.change_tracker = None
+        
+        # 后台搜索线程，使用自己的只读连接
+        self.search_results_ready.connect(self.show_search_results)
+        self.search_count_ready.connect(self.show_search_count)
+        self.search_fuzzy_ready.connect(self.show_fuzzy_results)
+        self.search_executor = SearchExecutor(self.search_results_ready.emit, self.search_count_ready.emit,
+                                              on_fuzzy=self.search_fuzzy_ready.emit,
+                                              metrics_log=os.path.join(self.db_folder, METRICS_LOG))
+        # 退出时停止搜索线程，同时写出本次运行的搜索统计
+        QApplication.instance().aboutToQuit.connect(self.search_executor.stop)
+        # 本地查询服务，默认关闭，在文件菜单中开启
+        self.query_server = None
+        QApplication.instance().aboutToQuit.connect(self.stop_query_server)
+        
         self.init_database()
         self.initUI()
         self.init_tray()
+        self.upgrade_database_if_needed()
 
     def init_database(self):
         # 尝试从配置文件读取最后使用的数据库路径
@@ -205,42 +929,162 @@ class EverythingGUI(QMainWindow):
         
         # 保存当前数据库路径
         self.save_last_database()
+        self.load_name_index()
+
+    def load_name_index(self):
+        """让搜索线程切换到当前数据库，并加载对应的 .names 文件名索引"""
+        self.switch_search_database(self.db_path)
+
+    def search_staging_database(self, temp_db):
+        """索引进行中让搜索使用正在写入的临时数据库，已经扫描到的文件立即可以搜索"""
+        self.switch_search_database(temp_db, use_name_index=False, live=True)
+        self.search_files()
+
+    def toggle_federated_search(self, checked):
+        """开启时选择多个快照数据库联合搜索，关闭时回到当前数据库"""
+        if not checked:
+            self.load_name_index()
+            self.status_label.setText(f'当前数据库: {os.path.basename(self.db_path)}')
+            self.search_files()
+            return
+
+        # 默认选中目录下的全部快照，最新的排在前面
+        snapshots = [os.path.basename(path) for path in list_snapshots(self.db_folder)]
+        default = ' '.join(f'"{name}"' for name in snapshots)
+        dialog = QFileDialog(self, "选择要联合搜索的数据库", self.db_folder, "SQLite数据库 (*.db)")
+        dialog.setFileMode(QFileDialog.FileMode.ExistingFiles)
+        dialog.selectFile(default)
+        if not dialog.exec() or not dialog.selectedFiles():
+            self.leave_federated_search()
+            return
+
+        db_paths = dialog.selectedFiles()
+        self.search_executor.set_snapshots(db_paths)
+        self.status_label.setText(f"联合搜索 {len(db_paths)} 个数据库（同一路径以最新的快照为准）")
+        self.search_files()
+
+    def compare_snapshots(self):
+        """选择两个快照数据库，显示较旧的快照到较新的快照之间的变化"""
+        db_paths, _ = QFileDialog.getOpenFileNames(
+            self,
+            "选择要比较的两个数据库",
+            self.db_folder,
+            "SQLite数据库 (*.db)"
+        )
+        if not db_paths:
+            return
+        if len(db_paths) != 2:
+            QMessageBox.warning(self, "比较数据库", "请选择两个数据库文件。", QMessageBox.StandardButton.Ok)
+            return
+        old_db, new_db = sorted(db_paths, key=snapshot_time)
+        dialog = SnapshotDiffDialog(old_db, new_db, self)
+        dialog.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        dialog.show()
+
+    def find_duplicates(self):
+        """在当前数据库中查找重复文件，默认只在当前搜索条件匹配的文件中查找"""
+        if not self.db_path or not os.path.exists(self.db_path):
+            QMessageBox.warning(self, "查找重复文件", "请先选择或建立数据库。", QMessageBox.StandardButton.Ok)
+            return
+        dialog = DuplicatesDialog(self.db_path, self.search_input.text().strip(), self)
+        dialog.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        dialog.show()
+
+    def show_dir_sizes(self):
+        """逐级查看当前数据库中最占空间的目录"""
+        if not self.db_path or not os.path.exists(self.db_path):
+            QMessageBox.warning(self, "目录大小", "请先选择或建立数据库。", QMessageBox.StandardButton.Ok)
+            return
+        try:
+            dialog = DirSizesDialog(self.db_path, self)
+        except sqlite3.Error as e:
+            QMessageBox.warning(self, "目录大小", f"无法打开数据库: {e}", QMessageBox.StandardButton.Ok)
+            return
+        dialog.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        dialog.show()
+
+    def show_snapshot_store(self):
+        """查看快照库，还原的快照作为当前数据库打开"""
+        try:
+            dialog = SnapshotStoreDialog(self.db_folder, self.db_path, self.open_database_file, self)
+        except (sqlite3.Error, OSError) as e:
+            QMessageBox.warning(self, "快照库", f"无法打开快照库: {e}", QMessageBox.StandardButton.Ok)
+            return
+        dialog.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        dialog.show()
+
+    def switch_search_database(self, db_path, **options):
+        """让搜索线程切换到一个数据库，同时退出联合搜索"""
+        # 启动时界面还没有创建
+        if hasattr(self, 'federated_action'):
+            self.leave_federated_search()
+        self.search_executor.set_database(db_path, **options)
+        # 查询服务跟随当前数据库，不使用索引中的临时数据库
+        if self.query_server is not None and not options.get('live'):
+            self.query_server.set_database(db_path, options.get('use_name_index', True))
+
+    def leave_federated_search(self):
+        """取消联合搜索的勾选状态，不触发切换"""
+        self.federated_action.blockSignals(True)
+        self.federated_action.setChecked(False)
+        self.federated_action.blockSignals(False)
+
+    def close_name_index(self):
+        """让搜索线程释放 .names 文件名索引，只使用数据库查询"""
+        self.switch_search_database(self.db_path, use_name_index=False)
 
     def load_last_database(self):
         """加载最后使用的数据库路径"""
-        try:
-            config_path = os.path.join(self.db_folder, 'config.ini')
-            if os.path.exists(config_path):
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    last_db = f.read().strip()
-                    print(f"读取到上次数据库路径: {last_db}")
-                    return last_db
-        except Exception as e:
-            print(f"读取配置文件出错: {e}")
-        return None
+        last_db = load_last_database(self.db_folder)
+        print(f"读取到上次数据库路径: {last_db}")
+        return last_db
 
     def save_last_database(self):
         """保存当前数据库路径到配置文件"""
-        try:
-            config_path = os.path.join(self.db_folder, 'config.ini')
-            with open(config_path, 'w', encoding='utf-8') as f:
-                # 只保存数据库文件名，不保存完整路径
-                db_name = os.path.basename(self.db_path)
-                f.write(db_name)
-                print(f"保存数据库路径: {db_name}")
-        except Exception as e:
-            print(f"保存配置文件出错: {e}")
+        save_last_database(self.db_folder, self.db_path)
+        print(f"保存数据库路径: {os.path.basename(self.db_path)}")
 
     def create_tables(self):
-        self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS files (
-                path TEXT PRIMARY KEY,
-                filename TEXT,
-                size INTEGER,
-                modified_time TEXT
-            )
-        """)
-        self.conn.commit()
+        create_tables(self.conn)
+
+    def toggle_query_server(self, checked):
+        """开启或关闭本地查询服务（见 query_server.py）"""
+        if not checked:
+            self.stop_query_server()
+            self.status_label.setText("本地查询服务已关闭")
+            return
+        try:
+            self.query_server = QueryServer(self.db_path, self.db_folder)
+        except OSError as e:
+            QMessageBox.warning(self, "无法启动查询服务", f"无法监听端口: {e}")
+            self.query_server_action.blockSignals(True)
+            self.query_server_action.setChecked(False)
+            self.query_server_action.blockSignals(False)
+            return
+        self.query_server.start()
+        self.status_label.setText(f"本地查询服务: http://127.0.0.1:{self.query_server.port}/")
+
+    def stop_query_server(self):
+        if self.query_server is not None:
+            self.query_server.stop()
+            self.query_server = None
+            print("本地查询服务已停止")
+
+    def upgrade_database_if_needed(self):
+        """当前数据库是旧格式时在后台升级，升级完成前不能搜索"""
+        if self.conn is None or schema_version(self.conn) != 1:
+            return False
+        self.stop_change_tracking()
+        self.switch_search_database(None)
+        self.status_label.setText("正在升级数据库格式...")
+        self.progress_bar.show()
+        self.progress_bar.setRange(0, 0)
+
+        self.worker = FastIndexWorker([], self.db_folder, migrate_db=self.db_path)
+        self.worker.progress.connect(self.update_index_status)
+        self.worker.finished.connect(self.handle_indexing_finished)
+        self.worker.start()
+        return True
 
     def initUI(self):
         self.setWindowTitle('Python Everything')
@@ -253,7 +1097,7 @@ class EverythingGUI(QMainWindow):
         # 搜索区域
         search_layout = QHBoxLayout()
         self.search_input = QLineEdit()
-        self.search_input.setPlaceholderText('输入搜索关键词...')
+        self.search_input.setPlaceholderText('输入搜索关键词，支持 * ? 通配符、| ! 和 ext: size: dm: path: regex: 过滤...')
         self.search_input.textChanged.connect(self.search_files)
         
         # 添加快捷键 Alt+D 聚焦到搜索框
@@ -264,9 +1108,11 @@ class EverythingGUI(QMainWindow):
         layout.addLayout(search_layout)
 
         # 结果表格
-        self.result_table = QTableWidget()
-        self.result_table.setColumnCount(4)
-        self.result_table.setHorizontalHeaderLabels(['文件名', '路径', '大小', '修改时间'])
+        self.result_model = ResultTableModel(self)
+        self.result_model.fetch_requested.connect(self.search_executor.fetch_more)
+        self.result_table = QTableView()
+        self.result_table.setModel(self.result_model)
+        self.result_table.verticalHeader().setDefaultSectionSize(22)
         
         # 设置表格列的调整方式
         header = self.result_table.horizontalHeader()
@@ -288,6 +1134,21 @@ class EverythingGUI(QMainWindow):
         
         layout.addWidget(self.result_table)
 
+        # 近似匹配结果，按相似度排列，没有结果时隐藏
+        self.fuzzy_label = QLabel('近似匹配（按相似度排列）:')
+        self.fuzzy_model = ResultTableModel(self)
+        self.fuzzy_table = QTableView()
+        self.fuzzy_table.setModel(self.fuzzy_model)
+        self.fuzzy_table.verticalHeader().setDefaultSectionSize(22)
+        self.fuzzy_table.setAlternatingRowColors(True)
+        self.fuzzy_table.setMaximumHeight(160)
+        for column, width in enumerate((200, 400, 100, 150)):
+            self.fuzzy_table.setColumnWidth(column, width)
+        self.fuzzy_label.hide()
+        self.fuzzy_table.hide()
+        layout.addWidget(self.fuzzy_label)
+        layout.addWidget(self.fuzzy_table)
+
         # 创建菜单栏
         menubar = self.menuBar()
         
@@ -299,6 +1160,33 @@ class EverythingGUI(QMainWindow):
         select_db_action.setShortcut('Ctrl+O')
         select_db_action.triggered.connect(self.select_database)
         
+        # 同时搜索多个快照数据库
+        self.federated_action = file_menu.addAction('联合搜索多个数据库(&M)...')
+        self.federated_action.setShortcut('Ctrl+M')
+        self.federated_action.setCheckable(True)
+        self.federated_action.toggled.connect(self.toggle_federated_search)
+        
+        # 比较两个快照数据库
+        diff_action = file_menu.addAction('比较两个数据库(&D)...')
+        diff_action.triggered.connect(self.compare_snapshots)
+        
+        # 在当前数据库中查找重复文件
+        duplicates_action = file_menu.addAction('查找重复文件(&U)...')
+        duplicates_action.triggered.connect(self.find_duplicates)
+        
+        # 按目录查看空间占用
+        dir_sizes_action = file_menu.addAction('目录大小(&Z)...')
+        dir_sizes_action.triggered.connect(self.show_dir_sizes)
+        
+        # 把历次索引的快照收进快照库，只保存一个完整数据库和每次的差异
+        snapshot_store_action = file_menu.addAction('快照库(&K)...')
+        snapshot_store_action.triggered.connect(self.show_snapshot_store)
+        
+        # 让其他程序通过本机 HTTP 查询当前数据库
+        self.query_server_action = file_menu.addAction('本地查询服务(&L)')
+        self.query_server_action.setCheckable(True)
+        self.query_server_action.toggled.connect(self.toggle_query_server)
+        
         file_menu.addSeparator()
         
         # 添加退出选项
@@ -324,8 +1212,34 @@ class EverythingGUI(QMainWindow):
         index_dir_action.setShortcut('Ctrl+F')
         index_dir_action.triggered.connect(self.select_directory_to_index)
         
+        # 添加增量更新选项
+        update_index_action = index_menu.addAction('增量更新当前索引(&U)')
+        update_index_action.setShortcut('Ctrl+U')
+        update_index_action.triggered.connect(self.update_current_index)
+        
+        # 添加实时监控选项
+        self.track_changes_action = index_menu.addAction('实时监控文件变化(&W)')
+        self.track_changes_action.setCheckable(True)
+        self.track_changes_action.toggled.connect(self.toggle_change_tracking)
+        
         index_menu.addSeparator()
         
+        # 索引速度：全速，或者限速并在磁盘繁忙时自动降速的后台模式
+        speed_menu = index_menu.addMenu('索引速度(&P)')
+        self.throttle_profile = DEFAULT_PROFILE
+        speed_group = QActionGroup(self)
+        for profile, title in PROFILE_NAMES.items():
+            action = speed_menu.addAction(title)
+            action.setCheckable(True)
+            action.setChecked(profile == self.throttle_profile)
+            action.triggered.connect(lambda checked, profile=profile: self.set_throttle_profile(profile))
+            speed_group.addAction(action)
+        
+        # 继续上次停止或中断的完整索引
+        self.resume_index_action = index_menu.addAction('继续上次中断的索引(&R)')
+        self.resume_index_action.triggered.connect(self.resume_indexing)
+        self.update_resume_action()
+        
         # 添加停止索引选项
         self.stop_index_action = index_menu.addAction('停止索引(&S)')
         self.stop_index_action.setShortcut('Ctrl+S')
@@ -343,6 +1257,14 @@ class EverythingGUI(QMainWindow):
         self.status_label = QLabel()
         self.statusBar().addWidget(self.status_label)
         
+        # 显示匹配总数
+        self.result_count_label = QLabel()
+        self.statusBar().addPermanentWidget(self.result_count_label)
+        
+        # 索引的实时统计：吞吐量和各阶段耗时占比
+        self.metrics_label = QLabel()
+        self.statusBar().addPermanentWidget(self.metrics_label)
+
         # 添加进度条
         self.progress_bar = QProgressBar()
         self.progress_bar.setTextVisible(True)
@@ -360,14 +1282,22 @@ class EverythingGUI(QMainWindow):
             "SQLite数据库 (*.db);;所有文件 (*.*)"
         )
         if file_name:
-            if self.conn:
-                self.conn.close()
-            self.db_path = file_name
-            self.conn = sqlite3.connect(self.db_path)
-            self.create_tables()
-            self.status_label.setText(f'当前数据库: {os.path.basename(self.db_path)}')
-            # 保存当前选择的数据库
-            self.save_last_database()
+            self.open_database_file(file_name)
+
+    def open_database_file(self, file_name):
+        """把 file_name 作为当前数据库打开，快照库还原的快照也从这里打开"""
+        if self.conn:
+            self.conn.close()
+        self.db_path = file_name
+        self.conn = sqlite3.connect(self.db_path)
+        self.status_label.setText(f'当前数据库: {os.path.basename(self.db_path)}')
+        # 保存当前选择的数据库
+        self.save_last_database()
+        if self.upgrade_database_if_needed():
+            return
+        self.create_tables()
+        self.load_name_index()
+        self.restart_change_tracking()
 
     def create_new_database(self):
         current_time = datetime.now().strftime('%Y-%m-%d_%H-%M-%S.db')
@@ -384,7 +1314,7 @@ class EverythingGUI(QMainWindow):
         if self.conn:
             self.conn.execute("DROP TABLE IF EXISTS files")
             self.create_tables()
-            self.result_table.setRowCount(0)
+            self.result_model.clear()
             self.db_label.setText(f'当前数据库: {os.path.basename(self.db_path)} (已重置)')
 
     def select_directory(self):
@@ -426,17 +1356,57 @@ class EverythingGUI(QMainWindow):
         self.status_label.setText(status)
         self.progress_bar.show()
         self.progress_bar.setFormat(status)  # 在进度条上显示状态文本
-        
-        # 让进度条显示忙碌状态
-        self.progress_bar.setRange(0, 0)
+
+        worker = getattr(self, 'worker', None)
+        metrics = worker.metrics if worker is not None else None
+        if metrics is not None:
+            summary = metrics.summary()
+            if worker.throttle is not None:
+                summary = f"{worker.throttle.describe()} | {summary}" if summary else worker.throttle.describe()
+            self.metrics_label.setText(summary)
+            self.metrics_label.setToolTip(self.format_metrics_tooltip(metrics))
+        written = metrics.counters.get('rows', 0) if metrics is not None else 0
+        if worker is not None and worker.expected_files and written:
+            # 知道预计文件数时按已写入的行数显示进度，超出预计时停在 99%
+            self.progress_bar.setRange(0, worker.expected_files)
+            self.progress_bar.setValue(min(written, worker.expected_files - 1))
+            self.progress_bar.setFormat(f"{status}  %p%")
+        else:
+            # 让进度条显示忙碌状态
+            self.progress_bar.setRange(0, 0)
         
         # 更新窗口标题
         self.setWindowTitle('Python Everything - 正在索引...')
 
+    def format_metrics_tooltip(self, metrics):
+        """各阶段的累计耗时和平均延迟"""
+        snapshot = metrics.snapshot()
+        lines = [f"已运行 {snapshot['elapsed_sec']:.1f} 秒"]
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f"{name}: {value:,}")
+        for name, timer in sorted(snapshot['timers'].items()):
+            lines.append(f"{name}: {timer['total_sec']:.2f} 秒, {timer['calls']:,} 次, "
+                         f"平均 {timer['mean_ms']:.2f} ms, 最长 {timer['max_ms']:.1f} ms")
+        return '\n'.join(lines)
+
+    def expected_file_count(self):
+        """当前数据库是驱动器快照时，用它的文件数估计完整索引的进度"""
+        if not self.db_path or 'Drive_' not in os.path.basename(self.db_path):
+            return None
+        try:
+            return self.conn.execute("SELECT count(*) FROM files").fetchone()[0] or None
+        except sqlite3.Error:
+            return None
+
     def indexing_finished(self):
         """索引完成后的处理"""
         self.stop_index_action.setEnabled(False)
+        self.update_resume_action()
         self.progress_bar.hide()
+        worker = getattr(self, 'worker', None)
+        if worker is not None:
+            # 保留最后一次运行的统计，详细数据已写入 metrics.jsonl
+            self.metrics_label.setText(worker.metrics.summary())
         self.setWindowTitle('Python Everything')
 
     def handle_indexing_finished(self, new_db_path, total_time):
@@ -455,6 +1425,13 @@ class EverythingGUI(QMainWindow):
             
             # 保存新的数据库路径
             self.save_last_database()
+            # 搜索切换到最终数据库，当前的关键词在新数据库上重新搜索。
+            # 只有完整索引（包括继续的索引）用过临时数据库，完成后删除；增量更新和升级
+            # 不碰它，里面可能是之前停止的完整索引留下的断点
+            full = not self.worker.incremental_db and not self.worker.migrate_db
+            self.switch_search_database(self.db_path, discard=self.worker.temp_db if full else None)
+            self.search_files()
+            self.restart_change_tracking()
             
             # 格式化时间显示
             hours = int(total_time // 3600)
@@ -470,42 +1447,80 @@ class EverythingGUI(QMainWindow):
                 time_str += f"{seconds}秒"
             
             # 显示完成消息，包含耗时信息
-            QMessageBox.information(
-                self,
-                "索引完成",
-                f"文件索引已完成！\n"
-                f"数据库已保存为: {self.db_path}\n"
-                f"总耗时: {time_str}",
-                QMessageBox.StandardButton.Ok
-            )
-        else:  # 如果索引失败
-            QMessageBox.warning(
-                self,
-                "索引失败",
-                "文件索引过程中出现错误，请重试。",
-                QMessageBox.StandardButton.Ok
-            )
+            if self.worker.report is not None:
+                QMessageBox.information(
+                    self,
+                    "升级完成",
+                    f"数据库格式已升级！\n"
+                    f"{self.worker.report}",
+                    QMessageBox.StandardButton.Ok
+                )
+            else:
+                QMessageBox.information(
+                    self,
+                    "索引完成",
+                    f"文件索引已完成！\n"
+                    f"数据库已保存为: {self.db_path}\n"
+                    f"总耗时: {time_str}",
+                    QMessageBox.StandardButton.Ok
+                )
+        else:  # 如果索引被停止或失败
+            # 搜索切回原来的数据库；临时数据库中有断点时保留下来，以后可以继续
+            resumable = pending_index(self.db_folder) is not None
+            self.switch_search_database(self.db_path, discard=None if resumable else self.worker.temp_db)
+            if self.worker.stopped:
+                self.status_label.setText("索引已停止" + ("，可以在索引菜单中继续" if resumable else ""))
+            else:
+                QMessageBox.warning(
+                    self,
+                    "索引失败",
+                    "文件索引过程中出现错误，" + ("可以在索引菜单中从断点继续。" if resumable else "请重试。"),
+                    QMessageBox.StandardButton.Ok
+                )
         
         self.indexing_finished()
 
     def search_files(self):
+        """把搜索提交给后台线程，结果通过 show_search_results 返回"""
         keyword = self.search_input.text()
+        self.search_executor.submit(keyword)
         if not keyword:
-            self.result_table.setRowCount(0)
+            self.result_model.clear()
+            self.fuzzy_model.clear()
+            self.fuzzy_label.hide()
+            self.fuzzy_table.hide()
+            self.result_count_label.clear()
+
+    def show_search_results(self, generation, keyword, rows, next_after, append):
+        """显示搜索结果，已经被新输入取代的结果直接丢弃"""
+        if generation != self.search_executor.generation:
             return
 
-        cursor = self.conn.execute(
-            "SELECT * FROM files WHERE filename LIKE ? LIMIT 100",
-            (f"%{keyword}%",)
-        )
-        results = cursor.fetchall()
+        if append:
+            self.result_model.append_rows(generation, rows, next_after)
+        else:
+            self.result_model.set_rows(generation, rows, next_after)
+            self.result_count_label.setText("正在统计...")
+            self.show_fuzzy_results(generation, [])
+
+    def show_fuzzy_results(self, generation, rows):
+        """显示近似匹配结果"""
+        if generation != self.search_executor.generation:
+            return
+        self.fuzzy_model.set_rows(generation, rows, None)
+        self.fuzzy_label.setVisible(bool(rows))
+        self.fuzzy_table.setVisible(bool(rows))
 
-        self.result_table.setRowCount(len(results))
-        for row, (path, filename, size, modified_time) in enumerate(results):
-            self.result_table.setItem(row, 0, QTableWidgetItem(filename))
-            self.result_table.setItem(row, 1, QTableWidgetItem(path))
-            self.result_table.setItem(row, 2, QTableWidgetItem(f"{size:,} bytes"))
-            self.result_table.setItem(row, 3, QTableWidgetItem(modified_time))
+    def show_search_count(self, generation, total):
+        """显示匹配总数"""
+        if generation == self.search_executor.generation:
+            self.result_count_label.setText(f"共 {total:,} 个结果")
+            tooltip = f"搜索缓存: {self.search_executor.cache.stats}"
+            queries = self.search_executor.recent_queries
+            if queries:
+                last = queries[-1]
+                tooltip += f"\n上次查询: {last['plan']}, {last['ms']:.1f} ms, {last['rows']:,} 条"
+            self.result_count_label.setToolTip(tooltip)
 
     def index_all_drives(self):
         """索引所有可用驱动器"""
@@ -525,14 +1540,17 @@ class EverythingGUI(QMainWindow):
             QMessageBox.StandardButton.No
         )
         
-        if reply == QMessageBox.StandardButton.Yes:
+        if reply == QMessageBox.StandardButton.Yes and self.confirm_discard_checkpoint():
             self.stop_index_action.setEnabled(True)
+            self.resume_index_action.setEnabled(False)
             self.status_label.setText("准备开始索引...")
             self.progress_bar.show()
             
             # 使用 FastIndexWorker
-            self.worker = FastIndexWorker(drives, self.db_folder)
+            self.worker = FastIndexWorker(drives, self.db_folder, expected_files=self.expected_file_count(),
+                                          throttle_profile=self.throttle_profile)
             self.worker.progress.connect(self.update_index_status)
+            self.worker.staging_ready.connect(self.search_staging_database)
             self.worker.finished.connect(self.handle_indexing_finished)
             self.worker.start()
 
@@ -542,15 +1560,16 @@ class EverythingGUI(QMainWindow):
             reply = QMessageBox.question(
                 self,
                 "确认停止",
-                "确定要停止索引过程吗？\n已索引的文件将被保留。",
+                "确定要停止索引过程吗？\n已扫描的部分会保存为断点，可以稍后继续。",
                 QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
             )
             
             if reply == QMessageBox.StandardButton.Yes:
-                self.worker.terminate()
-                self.worker.wait()
-                self.status_label.setText("索引已停止")
-                self.indexing_finished()
+                # 通知工作线程在处理完当前目录后停止，已经扫描的部分写完并保存断点后
+                # 由 handle_indexing_finished 收尾，界面不需要等待
+                self.worker.requestInterruption()
+                self.stop_index_action.setEnabled(False)
+                self.status_label.setText("正在停止索引...")
 
     def focus_search(self):
         """聚焦到搜索框并选中所有文本"""
@@ -611,8 +1630,16 @@ class EverythingGUI(QMainWindow):
             "快捷键：\n"
             "Ctrl+A: 索引所有驱动器\n"
             "Ctrl+S: 停止索引\n"
+            "Ctrl+U: 增量更新当前索引\n"
+            "Ctrl+M: 联合搜索多个数据库\n"
             "Ctrl+O: 选择数据库\n"
-            "Alt+D: 聚焦搜索框"
+            "Alt+D: 聚焦搜索框\n\n"
+            "搜索语法：\n"
+            "空格: 同时满足  |: 或  !: 排除  (): 分组\n"
+            "ext:log;txt  size:>100mb  size:large\n"
+            "dm:today  dm:lastweek  dm:2024-01..2024-03\n"
+            "path:C:\\Users\\  regex:^report_\\d+\n\n"
+            "中文文件名可以用拼音或首字母搜索，例如 baogao、bg 找到 报告.docx（需要安装 pypinyin）"
         )
 
     def select_drive_to_index(self):
@@ -691,21 +1718,123 @@ class EverythingGUI(QMainWindow):
             if reply == QMessageBox.StandardButton.Yes:
                 self.start_indexing([drive], specific_dir=directory)
 
-    def start_indexing(self, drives, specific_dir=None):
+    def toggle_change_tracking(self, checked):
+        """开启或关闭实时监控"""
+        self.stop_change_tracking()
+        if not checked:
+            self.status_label.setText("实时监控已关闭")
+            return
+        
+        try:
+            # 应用变化后缓存的搜索结果可能过期
+            self.change_tracker = ChangeTracker(
+                self.db_path,
+                on_applied=lambda stats: self.search_executor.invalidate_cache()
+            )
+            self.change_tracker.start()
+            self.status_label.setText(f"实时监控已开启 ({self.change_tracker.source_name})")
+        except Exception as e:
+            self.change_tracker = None
+            self.track_changes_action.blockSignals(True)
+            self.track_changes_action.setChecked(False)
+            self.track_changes_action.blockSignals(False)
+            QMessageBox.warning(
+                self,
+                "错误",
+                f"无法开启实时监控: {str(e)}",
+                QMessageBox.StandardButton.Ok
+            )
+
+    def stop_change_tracking(self):
+        """停止实时监控"""
+        if self.change_tracker:
+            self.change_tracker.stop()
+            self.change_tracker = None
+
+    def restart_change_tracking(self):
+        """数据库切换后，让实时监控跟随新的数据库"""
+        if self.track_changes_action.isChecked():
+            self.toggle_change_tracking(True)
+
+    def update_current_index(self):
+        """增量更新当前数据库"""
+        reply = QMessageBox.question(
+            self,
+            "确认更新",
+            f"确定要增量更新当前数据库吗？\n{self.db_path}\n只会重新扫描有变化的目录。",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        
+        if reply == QMessageBox.StandardButton.Yes:
+            # 增量更新结束后会重新生成 .names 文件，Windows 上映射中的文件不能被替换
+            self.close_name_index()
+            self.start_indexing([], incremental=True)
+
+    def set_throttle_profile(self, profile):
+        """选择之后开始的索引和增量更新使用的速度，正在进行的索引不受影响"""
+        self.throttle_profile = profile
+        self.status_label.setText(f"索引速度: {PROFILE_NAMES[profile]}")
+
+    def update_resume_action(self):
+        """有断点时启用“继续上次中断的索引”，提示中显示断点的范围和进度"""
+        checkpoint = pending_index(self.db_folder)
+        running = hasattr(self, 'worker') and self.worker.isRunning()
+        self.resume_index_action.setEnabled(checkpoint is not None and not running)
+        if checkpoint is not None:
+            self.resume_index_action.setToolTip(
+                f"{', '.join(checkpoint['roots'])}：已提交 {checkpoint['rows']} 个文件")
+
+    def confirm_discard_checkpoint(self):
+        """开始新的完整索引会丢弃上次中断的断点，有断点时先确认"""
+        checkpoint = pending_index(self.db_folder)
+        if checkpoint is None:
+            return True
+        reply = QMessageBox.question(
+            self,
+            "丢弃断点",
+            f"上次对 {', '.join(checkpoint['roots'])} 的索引没有完成（已提交 {checkpoint['rows']} 个文件）。\n"
+            "开始新的索引会丢弃这个断点，确定吗？\n选择“否”后可以在索引菜单中继续上次的索引。",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        return reply == QMessageBox.StandardButton.Yes
+
+    def resume_indexing(self):
+        """从临时数据库中的断点继续完整索引"""
+        if hasattr(self, 'worker') and self.worker.isRunning():
+            QMessageBox.warning(self, "警告", "索引正在进行中，请等待当前索引完成。")
+            return
+        if pending_index(self.db_folder) is None:
+            self.update_resume_action()
+            return
+        self.start_indexing([], resume=True)
+
+    def start_indexing(self, drives, specific_dir=None, incremental=False, resume=False):
         """开始索引过程"""
+        if not incremental and not resume and not self.confirm_discard_checkpoint():
+            return
         try:
-            print(f"开始索引驱动器: {drives}, 特定目录: {specific_dir}")
+            print(f"开始索引驱动器: {drives}, 特定目录: {specific_dir}, 增量: {incremental}")
             
             self.stop_index_action.setEnabled(True)
+            self.resume_index_action.setEnabled(False)
             self.status_label.setText("准备开始索引...")
             self.progress_bar.show()
             self.progress_bar.setRange(0, 0)
             
             # 创建并启动工作线程，传递数据库目录
-            self.worker = FastIndexWorker(drives, self.db_folder, specific_dir)
+            self.worker = FastIndexWorker(
+                drives,
+                self.db_folder,
+                specific_dir,
+                incremental_db=self.db_path if incremental else None,
+                expected_files=None if incremental or specific_dir or resume else self.expected_file_count(),
+                resume=resume,
+                throttle_profile=self.throttle_profile
+            )
             print("已创建 FastIndexWorker")
             
             self.worker.progress.connect(self.update_index_status)
+            self.worker.staging_ready.connect(self.search_staging_database)
             self.worker.finished.connect(self.handle_indexing_finished)
             print("已连接信号")
             
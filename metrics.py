@@ -0,0 +1,151 @@
+"""索引和搜索的分阶段统计
+
+Metrics 在热路径上累计各阶段的耗时、计数和批次延迟直方图，可以在多个扫描线程中
+同时使用。扫描器按目录、写入线程按批次调用一次，不会每个文件都加锁。
+
+阶段名称约定：
+- scan.list / scan.stat / scan.attr  列目录、读取 stat、判断隐藏和系统属性
+- scan.backpressure                  扫描线程等待写入队列的时间
+- scan.throttle                      后台模式下扫描线程限速等待的时间（见 throttle.py）
+- write.insert / write.commit        executemany 和 commit，每次调用记入直方图
+- write.idle                         写入线程等待扫描结果的时间
+- phase.*                            索引的各个大阶段（扫描、建索引、全文索引等）
+- query.*                            各类搜索任务
+- dupes.partial / dupes.full          查找重复文件时计算部分哈希和完整哈希（见 duplicates.py）
+
+snapshot() 给出可以直接转换为 JSON 的当前状态，dump() 在运行结束时把它作为一行
+追加到 JSON lines 文件中。
+"""
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# 直方图各个桶的上界（毫秒），超过最后一个上界的记入最后一个桶
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+# 数据库目录下保存每次运行统计的文件
+METRICS_LOG = 'metrics.jsonl'
+
+
+class Metrics:
+    def __init__(self, run, **labels):
+        # run 是这次运行的类别（例如 index、update、search），labels 随结果一起输出
+        self.run = run
+        self.labels = labels
+        self.started_at = time.time()
+        self._begin = time.perf_counter()
+        self._lock = threading.Lock()
+        # 名称 -> [次数, 总秒数, 最大秒数]
+        self.timers = {}
+        self.counters = {}
+        # 名称 -> 每个桶的次数
+        self.histograms = {}
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self._begin
+
+    def add_time(self, name, seconds, calls=1):
+        with self._lock:
+            self._add_time_locked(name, seconds, calls)
+
+    def _add_time_locked(self, name, seconds, calls):
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [calls, seconds, seconds]
+        else:
+            timer[0] += calls
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+
+    def add_times(self, times, counts=None):
+        """一次记入多个阶段的耗时和计数，times 是 {名称: 秒数}"""
+        with self._lock:
+            for name, seconds in times.items():
+                self._add_time_locked(name, seconds, 1)
+            for name, value in (counts or {}).items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        """记入耗时，同时记入该阶段的延迟直方图"""
+        bucket = min(bisect_left(HISTOGRAM_BOUNDS_MS, seconds * 1000), len(HISTOGRAM_BOUNDS_MS) - 1)
+        with self._lock:
+            self._add_time_locked(name, seconds, 1)
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = [0] * len(HISTOGRAM_BOUNDS_MS)
+            histogram[bucket] += 1
+
+    @contextmanager
+    def timed(self, name):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - begin)
+
+    def snapshot(self):
+        elapsed = self.elapsed
+        with self._lock:
+            counters = dict(self.counters)
+            timers = {
+                name: {
+                    'calls': calls,
+                    'total_sec': round(total, 4),
+                    'mean_ms': round(total / calls * 1000, 3) if calls else 0.0,
+                    'max_ms': round(peak * 1000, 3),
+                }
+                for name, (calls, total, peak) in self.timers.items()
+            }
+            histograms = {name: list(counts) for name, counts in self.histograms.items()}
+        return {
+            'run': self.run,
+            'started_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at)),
+            'elapsed_sec': round(elapsed, 3),
+            **self.labels,
+            'counters': counters,
+            'rates': {f"{name}_per_sec": round(value / elapsed, 1) for name, value in counters.items()}
+            if elapsed > 0 else {},
+            'timers': timers,
+            'histogram_bounds_ms': list(HISTOGRAM_BOUNDS_MS),
+            'histograms': histograms,
+        }
+
+    def summary(self):
+        """状态栏上显示的一行摘要：吞吐量和扫描各阶段的耗时占比"""
+        elapsed = self.elapsed
+        with self._lock:
+            files = self.counters.get('files', 0)
+            dirs = self.counters.get('dirs', 0)
+            scan = {name: self.timers.get(f"scan.{name}", (0, 0.0))[1] for name in ('list', 'stat', 'attr')}
+            insert = self.timers.get('write.insert')
+            throttle = self.timers.get('scan.throttle')
+        parts = []
+        if elapsed > 0 and (files or dirs):
+            parts.append(f"{files / elapsed:,.0f} 文件/秒, {dirs / elapsed:,.0f} 目录/秒")
+        scan_total = sum(scan.values())
+        if scan_total > 0:
+            parts.append(f"列目录 {scan['list'] / scan_total:.0%} stat {scan['stat'] / scan_total:.0%} "
+                         f"属性 {scan['attr'] / scan_total:.0%}")
+        if insert:
+            parts.append(f"写入 {insert[1] / insert[0] * 1000:.1f} ms/批")
+        if throttle:
+            parts.append(f"限速等待 {throttle[1]:.0f} 秒")
+        return ' | '.join(parts)
+
+    def dump(self, path, **extra):
+        """把当前状态作为一行 JSON 追加到 path，写入失败只打印错误"""
+        record = self.snapshot()
+        record.update(extra)
+        try:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"无法写入统计文件 {path}: {e}")
+        return record
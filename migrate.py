@@ -0,0 +1,171 @@
+"""旧格式数据库升级
+
+第 1 版的 files 表以完整路径为主键，同一个目录前缀在每一行里重复保存，还多存了一份
+文件名，修改时间是格式化后的字符串。第 2 版把目录拆到 dirs 表，files 只保存目录编号、
+文件名和整数时间戳（见 index_db.py）。
+
+升级在原数据库上进行：在一个事务里生成新表并删除旧表，重建全文索引，最后 VACUUM
+把空出来的页面还给文件系统，返回升级前后的文件大小。
+
+运行 `python migrate.py <数据库>...` 可以直接升级已有的快照。
+"""
+import itertools
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from index_db import (schema_version, table_exists, create_indexes, DIRS_TABLE_SQL, FILES_TABLE_SQL,
+                      INSERT_FILE_SQL, INSERT_DIR_SQL, SCHEMA_VERSION)
+from search import build_fts_index
+from dir_sizes import build_rollups
+from name_keys import build_name_keys
+
+FTS_TRIGGERS = ('files_fts_insert', 'files_fts_delete', 'files_fts_update')
+
+
+class MigrationReport:
+    """一次升级的结果"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.files = 0
+        self.dirs = 0
+        self.old_bytes = 0
+        self.new_bytes = 0
+        self.elapsed = 0.0
+
+    @property
+    def saved_ratio(self):
+        return 1 - self.new_bytes / self.old_bytes if self.old_bytes else 0.0
+
+    def __str__(self):
+        return (f"{os.path.basename(self.db_path)}: {self.files} 个文件, {self.dirs} 个目录, "
+                f"大小 {self.old_bytes / 1048576:.1f}MB -> {self.new_bytes / 1048576:.1f}MB "
+                f"(减少 {self.saved_ratio:.0%}), 耗时 {self.elapsed:.2f} 秒")
+
+
+def parse_mtime(modified_time):
+    """把旧格式中的时间字符串转换为时间戳"""
+    try:
+        return int(datetime.fromisoformat(modified_time).timestamp())
+    except (TypeError, ValueError):
+        return 0
+
+
+def _stored_roots(conn):
+    """旧数据库的扫描根目录
+
+    有 dir_mtimes 表时直接取其中的根目录；更早的数据库没有目录信息，用最小和最大路径的
+    公共目录代替（按路径排序后，所有路径的公共前缀就是首尾两个的公共前缀）。
+    """
+    if table_exists(conn, 'dir_mtimes_v1'):
+        roots = [row[0] for row in conn.execute("SELECT path FROM dir_mtimes_v1 WHERE parent IS NULL")]
+        if roots:
+            return roots
+    first, last = conn.execute("SELECT min(path), max(path) FROM files_v1").fetchone()
+    if first is None:
+        return []
+    try:
+        return [os.path.commonpath([os.path.dirname(first), os.path.dirname(last)])]
+    except ValueError:
+        # 跨驱动器的数据库没有公共目录，以各自的驱动器根目录作为根
+        return []
+
+
+def migrate_database(db_path, on_progress=None, chunk_size=10000):
+    """把第 1 版数据库升级为第 2 版，已经是新格式时返回 None"""
+    report = MigrationReport(db_path)
+    begin = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    try:
+        if schema_version(conn) != 1:
+            return None
+        report.old_bytes = os.path.getsize(db_path)
+
+        # DDL 也放进同一个事务，中途出错时数据库保持原样
+        conn.isolation_level = None
+        conn.execute("BEGIN")
+        for trigger in FTS_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        conn.execute("DROP TABLE IF EXISTS files_fts")
+        conn.execute("ALTER TABLE files RENAME TO files_v1")
+        if table_exists(conn, 'dir_mtimes'):
+            conn.execute("ALTER TABLE dir_mtimes RENAME TO dir_mtimes_v1")
+        conn.execute(DIRS_TABLE_SQL)
+        conn.execute(FILES_TABLE_SQL)
+
+        roots = set(_stored_roots(conn))
+        next_id = itertools.count(1).__next__
+        dir_ids = {}
+        dirs = {}
+
+        def dir_id(path):
+            existing = dir_ids.get(path)
+            if existing is not None:
+                return existing
+            parent, name = os.path.split(path)
+            if path in roots or not name or parent == path:
+                row = [None, path, None]
+            else:
+                row = [dir_id(parent), name, None]
+            new_id = dir_ids[path] = next_id()
+            dirs[new_id] = row
+            return new_id
+
+        if table_exists(conn, 'dir_mtimes_v1'):
+            # 按路径排序，父目录总是先于子目录分配编号
+            for path, mtime_ns in conn.execute("SELECT path, mtime_ns FROM dir_mtimes_v1 ORDER BY path"):
+                dirs[dir_id(path)][2] = mtime_ns
+        for root in roots:
+            dir_id(root)
+
+        cursor = conn.execute("SELECT path, filename, size, modified_time FROM files_v1")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            conn.executemany(INSERT_FILE_SQL, [
+                (dir_id(os.path.dirname(path)), filename, size, parse_mtime(modified_time))
+                for path, filename, size, modified_time in rows
+            ])
+            report.files += len(rows)
+            if on_progress:
+                on_progress(report)
+
+        conn.executemany(INSERT_DIR_SQL, ((key,) + tuple(row) for key, row in sorted(dirs.items())))
+        report.dirs = len(dirs)
+
+        conn.execute("DROP TABLE files_v1")
+        conn.execute("DROP TABLE IF EXISTS dir_mtimes_v1")
+        create_indexes(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("COMMIT")
+        conn.isolation_level = ''
+
+        build_fts_index(conn)
+        build_rollups(conn, recount=True)
+        build_name_keys(conn)
+        conn.commit()
+        conn.execute("VACUUM")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    report.new_bytes = os.path.getsize(db_path)
+    report.elapsed = time.perf_counter() - begin
+    return report
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("用法: python migrate.py <数据库>...")
+        sys.exit(1)
+
+    for path in sys.argv[1:]:
+        result = migrate_database(path)
+        print(result if result is not None else f"{path}: 已经是新格式")
@@ -0,0 +1,153 @@
+"""内存映射的紧凑文件名索引
+
+每个 .db 旁边生成一个同名的 .names 文件，布局如下（全部小端，8 字节对齐）：
+
+    头部     magic, count, names_len, max_rowid
+    offsets  int64[count + 1]  每个文件名在 names 中的起始偏移，最后一个是结束哨兵
+    rowids   int64[count]      对应 files 表的 rowid
+    sizes    int64[count]
+    mtimes   int64[count]      修改时间（秒级时间戳）
+    names    小写文件名依次拼接，每个以 '\\n' 结尾
+
+加载时只做 mmap，数组列通过 memoryview.cast 直接访问映射的内存，不产生任何拷贝；
+搜索就是在 names 上做 mmap.find 的原始字节扫描，只有命中的行才回 files 表取完整记录。
+500 万个文件大约占用 100MB 文件名加 160MB 数组列，冷启动只需要一次 mmap 调用。
+"""
+import array
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from bisect import bisect_right
+
+MAGIC = b'EVNAMES1'
+HEADER = struct.Struct('<8sQQQ')
+SEPARATOR = b'\n'
+
+
+def sidecar_path(db_path):
+    """数据库对应的文件名索引路径"""
+    return os.path.splitext(db_path)[0] + '.names'
+
+
+def build_name_index(conn, db_path):
+    """从 files 表生成文件名索引，先写临时文件再原子替换"""
+    offsets = array.array('q', [0])
+    rowids = array.array('q')
+    sizes = array.array('q')
+    mtimes = array.array('q')
+    target = sidecar_path(db_path)
+    folder = os.path.dirname(os.path.abspath(target))
+
+    with tempfile.TemporaryFile(dir=folder) as names_file:
+        position = 0
+        cursor = conn.execute("SELECT id, filename, size, mtime FROM files ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            chunk = []
+            for rowid, filename, size, mtime in rows:
+                name = (filename or '').lower().encode('utf-8', 'surrogatepass').replace(SEPARATOR, b' ')
+                chunk.append(name)
+                position += len(name) + 1
+                offsets.append(position)
+                rowids.append(rowid)
+                sizes.append(size or 0)
+                mtimes.append(mtime or 0)
+            chunk.append(b'')
+            names_file.write(SEPARATOR.join(chunk))
+        names_len = position
+        max_rowid = rowids[-1] if rowids else 0
+
+        fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.names.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(HEADER.pack(MAGIC, len(rowids), names_len, max_rowid))
+                for column in (offsets, rowids, sizes, mtimes):
+                    if sys.byteorder != 'little':
+                        column.byteswap()
+                    column.tofile(out)
+                names_file.seek(0)
+                while True:
+                    block = names_file.read(1 << 20)
+                    if not block:
+                        break
+                    out.write(block)
+            os.replace(temp_path, target)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    return target
+
+
+class NameIndex:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.count, self.names_len, self.max_rowid = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC:
+                raise ValueError(f"不是有效的文件名索引: {path}")
+
+            view = self._view = memoryview(self._mm)
+            start = HEADER.size
+            column_bytes = self.count * 8
+            self.offsets = view[start:start + column_bytes + 8].cast('q')
+            start += column_bytes + 8
+            self.rowids = view[start:start + column_bytes].cast('q')
+            start += column_bytes
+            self.sizes = view[start:start + column_bytes].cast('q')
+            start += column_bytes
+            self.mtimes = view[start:start + column_bytes].cast('q')
+            start += column_bytes
+            self._names_start = start
+            if start + self.names_len > len(self._mm):
+                raise ValueError(f"文件名索引已损坏: {path}")
+        except BaseException:
+            self.close()
+            raise
+
+    @classmethod
+    def open(cls, db_path):
+        """打开数据库对应的文件名索引，不存在或无法使用时返回 None"""
+        path = sidecar_path(db_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls(path)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"无法加载文件名索引 {path}: {e}")
+            return None
+
+    def close(self):
+        # 先释放 memoryview，否则 mmap 无法关闭
+        for name in ('offsets', 'rowids', 'sizes', 'mtimes', '_view'):
+            column = self.__dict__.pop(name, None)
+            if column is not None:
+                column.release()
+        mm = self.__dict__.pop('_mm', None)
+        if mm is not None:
+            mm.close()
+        self._file.close()
+
+    def iter_matches(self, keyword, start=0):
+        """从第 start 行开始，逐个返回文件名包含 keyword（不区分大小写）的行号"""
+        needle = keyword.lower().encode('utf-8', 'surrogatepass')
+        if not needle or SEPARATOR in needle or start >= self.count:
+            return
+        mm = self._mm
+        base = self._names_start
+        end = base + self.names_len
+        pos = base + self.offsets[start]
+        while True:
+            hit = mm.find(needle, pos, end)
+            if hit < 0:
+                return
+            i = bisect_right(self.offsets, hit - base) - 1
+            yield i
+            # 同一个文件名里的多次命中只算一次
+            pos = base + self.offsets[i + 1]
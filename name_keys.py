@@ -0,0 +1,214 @@
+"""文件名的搜索键：大小写折叠、全拼和拼音首字母
+
+只为含有非 ASCII 字符的文件名生成，纯 ASCII 文件名用 LIKE 和全文索引就能正确地
+不区分大小写匹配，不需要额外的键。name_keys 表每个这样的文件一行：
+- folded    str.casefold() 折叠后的文件名，LIKE 只能折叠 ASCII 字母，这里 Ä/ä、ß/ss 也能匹配
+- pinyin    全拼，例如 项目报告.docx -> xiangmubaogao.docx，ü 写作 v
+- initials  首字母，例如 项目报告.docx -> xmbg.docx
+
+拼音需要可选依赖 pypinyin，没有安装时只生成 folded，pinyin 和 initials 为 NULL；
+之后安装了 pypinyin，下一次增量更新会重新生成全部搜索键。文件名中没有汉字时两者为空字符串。
+
+搜索键和文件行一起生成，搜索时直接匹配已经存好的键，不在查询时做任何转换：
+- 完整索引时写入线程在写入文件的同一个事务中为这一批新行生成键，扫描结束后
+  finish_name_keys() 为键建立三元组全文索引 name_keys_fts 和维护用的触发器
+- 之后 files 上的触发器把新插入的文件编号记入 name_keys_pending，增量更新和实时监控
+  提交前调用 update_name_keys() 为它们生成键；删除文件时触发器同时删除它的键
+"""
+import sqlite3
+
+from index_db import table_exists
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:
+    lazy_pinyin = None
+
+# 每次从 files 取出多少行生成键
+KEY_BATCH = 10000
+
+NAME_KEYS_TABLES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS name_keys (
+        file_id INTEGER PRIMARY KEY,
+        folded TEXT NOT NULL,
+        pinyin TEXT,
+        initials TEXT
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS name_keys_pending (file_id INTEGER PRIMARY KEY)",
+    """
+    CREATE TRIGGER IF NOT EXISTS name_keys_file_delete AFTER DELETE ON files BEGIN
+        DELETE FROM name_keys WHERE file_id = old.id;
+    END
+    """,
+]
+
+NAME_KEYS_FTS_SQL = """
+    CREATE VIRTUAL TABLE name_keys_fts USING fts5(
+        folded, pinyin, initials,
+        content='name_keys',
+        content_rowid='file_id',
+        tokenize='trigram'
+    )
+"""
+
+# 触发器里的冲突处理会被触发它的外层语句覆盖，这里不用 OR IGNORE
+NAME_KEYS_TRIGGERS_SQL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS name_keys_file_insert AFTER INSERT ON files
+    WHEN NOT EXISTS (SELECT 1 FROM name_keys_pending WHERE file_id = new.id) BEGIN
+        INSERT INTO name_keys_pending (file_id) VALUES (new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS name_keys_file_rename AFTER UPDATE OF filename ON files BEGIN
+        DELETE FROM name_keys WHERE file_id = old.id;
+        INSERT INTO name_keys_pending (file_id) SELECT new.id
+        WHERE NOT EXISTS (SELECT 1 FROM name_keys_pending WHERE file_id = new.id);
+    END
+    """,
+]
+
+NAME_KEYS_FTS_TRIGGERS_SQL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS name_keys_fts_insert AFTER INSERT ON name_keys BEGIN
+        INSERT INTO name_keys_fts(rowid, folded, pinyin, initials)
+        VALUES (new.file_id, new.folded, new.pinyin, new.initials);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS name_keys_fts_delete AFTER DELETE ON name_keys BEGIN
+        INSERT INTO name_keys_fts(name_keys_fts, rowid, folded, pinyin, initials)
+        VALUES ('delete', old.file_id, old.folded, old.pinyin, old.initials);
+    END
+    """,
+]
+
+INSERT_KEYS_SQL = "INSERT OR REPLACE INTO name_keys (file_id, folded, pinyin, initials) VALUES (?, ?, ?, ?)"
+
+
+def pinyin_available():
+    return lazy_pinyin is not None
+
+
+def _split_chars(text):
+    # 不是汉字的部分逐个字符返回，和汉字的拼音一一对应
+    return list(text)
+
+
+def make_keys(filename):
+    """文件名的 (folded, pinyin, initials)，纯 ASCII 文件名返回 None
+
+    文件名中没有汉字时 pinyin 和 initials 为空字符串，没有安装 pypinyin 时为 None。
+    """
+    if not filename or filename.isascii():
+        return None
+    folded = filename.casefold()
+    if lazy_pinyin is None:
+        return folded, None, None
+    syllables = [syllable.casefold() for syllable in lazy_pinyin(filename, errors=_split_chars)]
+    pinyin = ''.join(syllables)
+    if pinyin == folded:
+        return folded, '', ''
+    return folded, pinyin, ''.join(syllable[:1] for syllable in syllables)
+
+
+def has_name_keys(conn):
+    """数据库中是否已经生成了搜索键"""
+    return table_exists(conn, 'name_keys') and table_exists(conn, 'name_keys_pending')
+
+
+def has_name_keys_fts(conn):
+    return table_exists(conn, 'name_keys_fts')
+
+
+def create_name_keys(conn):
+    """建立搜索键的表，完整索引的写入线程在扫描开始前调用"""
+    for sql in NAME_KEYS_TABLES_SQL:
+        conn.execute(sql)
+
+
+def _key_rows(rows):
+    for file_id, filename in rows:
+        keys = make_keys(filename)
+        if keys is not None:
+            yield (file_id,) + keys
+
+
+def add_name_keys(conn, after_id):
+    """为编号大于 after_id 的文件生成搜索键，返回处理到的最大编号
+
+    只用于正在写入的全新数据库：文件编号只增不减，上一次处理到的编号之后就是新写入的行。
+    """
+    while True:
+        rows = conn.execute(
+            "SELECT id, filename FROM files WHERE id > ? ORDER BY id LIMIT ?", (after_id, KEY_BATCH)
+        ).fetchall()
+        if not rows:
+            return after_id
+        conn.executemany(INSERT_KEYS_SQL, _key_rows(rows))
+        after_id = rows[-1][0]
+
+
+def update_name_keys(conn):
+    """为 name_keys_pending 中记下的新文件生成搜索键，返回处理的文件数，调用方负责提交"""
+    if not has_name_keys(conn):
+        return 0
+    total = 0
+    while True:
+        rows = conn.execute(
+            "SELECT f.id, f.filename FROM name_keys_pending p JOIN files f ON f.id = p.file_id "
+            "ORDER BY p.file_id LIMIT ?", (KEY_BATCH,)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(INSERT_KEYS_SQL, _key_rows(rows))
+        conn.executemany("DELETE FROM name_keys_pending WHERE file_id = ?", ((row[0],) for row in rows))
+        total += len(rows)
+    # 记下之后又被删除的文件
+    conn.execute("DELETE FROM name_keys_pending")
+    return total
+
+
+def finish_name_keys(conn):
+    """键全部生成之后建立全文索引和触发器，SQLite 不支持三元组全文索引时只建触发器
+
+    搜索键较短（少于三个字符）的搜索直接扫描 name_keys，不需要全文索引。调用方负责提交。
+    """
+    for sql in NAME_KEYS_TRIGGERS_SQL:
+        conn.execute(sql)
+    try:
+        conn.execute("SAVEPOINT name_keys_fts")
+        conn.execute("DROP TABLE IF EXISTS name_keys_fts")
+        conn.execute(NAME_KEYS_FTS_SQL)
+        conn.execute("INSERT INTO name_keys_fts(name_keys_fts) VALUES ('rebuild')")
+        for sql in NAME_KEYS_FTS_TRIGGERS_SQL:
+            conn.execute(sql)
+        conn.execute("RELEASE name_keys_fts")
+    except sqlite3.OperationalError as e:
+        conn.execute("ROLLBACK TO name_keys_fts")
+        conn.execute("RELEASE name_keys_fts")
+        print(f"当前 SQLite 不支持三元组全文索引，拼音搜索将逐行匹配: {e}")
+
+
+def build_name_keys(conn):
+    """为已有数据库的全部文件重新生成搜索键（旧数据库、升级格式、安装了 pypinyin 之后），调用方负责提交"""
+    conn.execute("DROP TRIGGER IF EXISTS name_keys_fts_insert")
+    conn.execute("DROP TRIGGER IF EXISTS name_keys_fts_delete")
+    conn.execute("DROP TABLE IF EXISTS name_keys_fts")
+    conn.execute("DROP TABLE IF EXISTS name_keys")
+    create_name_keys(conn)
+    conn.execute("DELETE FROM name_keys_pending")
+    add_name_keys(conn, 0)
+    finish_name_keys(conn)
+
+
+def name_keys_outdated(conn):
+    """搜索键是否需要重新生成：还没有生成过，或者生成时没有 pypinyin 而现在有了"""
+    if not has_name_keys(conn):
+        return True
+    if lazy_pinyin is None:
+        return False
+    row = conn.execute("SELECT 1 FROM name_keys WHERE pinyin IS NULL LIMIT 1").fetchone()
+    return row is not None
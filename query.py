@@ -0,0 +1,558 @@
+"""搜索语法
+
+关键词按下面的语法解析，编译为 files f 上的 WHERE 条件：
+
+- 空格分隔的多个条件需要同时满足，也可以写 AND；`|` 或 OR 表示满足其一；
+  `!` 或 NOT 表示排除；括号用来分组。与 Everything 相同，| 比空格结合得更紧，
+  `ext:log error | warn !debug` 等同于 `ext:log (error | warn) !debug`
+- 普通词：文件名包含该文本（不区分大小写）；带 * 或 ? 的词按通配符匹配整个文件名
+- 双引号内的空格和符号不做解析，例如 "my file" 或 path:"C:\\Program Files"
+- ext:txt;log       扩展名，多个用分号或逗号分隔
+- size:>100mb       大小，支持 > >= < <= =、区间 1mb..10mb，以及 empty tiny small medium
+                    large huge gigantic 几个档位
+- dm:today          修改时间，支持 today yesterday thisweek lastweek thismonth lastmonth
+                    thisyear lastyear，日期 2024-03-01 / 2024-03 / 2024，以及比较和区间
+- path:C:\\Users\\   路径前缀；不是绝对路径时匹配路径中任意一级目录名包含该文本
+- regex:^log_\\d+$   对文件名做正则匹配（不区分大小写），只在其他条件筛出的候选行上执行，
+                    regex: 一直读到空白为止，其中的括号和 | 不作为分组
+
+扩展名、大小和修改时间走 index_db 中对应的索引，路径前缀通过 dirs 表定位目录后
+取整个子树，子串和通配符在有全文索引时先用全文索引缩小范围。
+"""
+import os
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from index_db import EXT_SQL
+
+# 三元组索引至少需要三个字符才能命中
+FTS_MIN_LENGTH = 3
+
+Term = namedtuple('Term', ['field', 'value'])
+Not = namedtuple('Not', ['item'])
+And = namedtuple('And', ['items'])
+Or = namedtuple('Or', ['items'])
+
+KB = 1024
+MB = 1024 * KB
+GB = 1024 * MB
+
+SIZE_UNITS = {'': 1, 'b': 1, 'k': KB, 'kb': KB, 'm': MB, 'mb': MB, 'g': GB, 'gb': GB, 't': 1024 * GB, 'tb': 1024 * GB}
+
+# 与 Everything 相同的大小档位，[下限, 上限)
+SIZE_NAMES = {
+    'empty': (0, 1),
+    'tiny': (1, 10 * KB),
+    'small': (10 * KB, 100 * KB),
+    'medium': (100 * KB, MB),
+    'large': (MB, 16 * MB),
+    'huge': (16 * MB, 128 * MB),
+    'gigantic': (128 * MB, None),
+}
+
+SIZE_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([kmgt]?b?)$', re.IGNORECASE)
+COMPARE_RE = re.compile(r'^(>=|<=|>|<|=)?(.+)$')
+
+# 一段路径下的所有目录（含自身），seed 是选出起点目录的条件，前面接目录编号列
+SUBTREE_CONDITION = """ IN (
+    WITH RECURSIVE subtree(id) AS (
+        SELECT id FROM dirs WHERE {seed}
+        UNION
+        SELECT d.id FROM dirs d JOIN subtree s ON d.parent_id = s.id
+    )
+    SELECT id FROM subtree
+)"""
+
+FTS_CONDITION = "f.id IN (SELECT rowid FROM files_fts WHERE files_fts MATCH ?)"
+
+
+class QueryError(ValueError):
+    """关键词不符合搜索语法"""
+
+
+def fts_phrase(keyword):
+    """把关键词转换为 FTS5 短语，避免其中的特殊字符被当作查询语法"""
+    return '"' + keyword.replace('"', '""') + '"'
+
+
+def escape_like(text):
+    """转义 LIKE 中的通配符，配合 ESCAPE '\\' 使用"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def wildcard_to_like(pattern):
+    """把 * ? 通配符转换为 LIKE 模式"""
+    return ''.join('%' if ch == '*' else '_' if ch == '?' else escape_like(ch) for ch in pattern)
+
+
+def tokenize(text):
+    """把关键词拆分为 ('op', 符号) 和 ('word', 文本, 是否带引号)"""
+    tokens = []
+    i = 0
+    length = len(text)
+    while i < length:
+        ch = text[i]
+        if ch.isspace():
+            i += 1
+            continue
+        if ch in '()|!':
+            tokens.append(('op', ch))
+            i += 1
+            continue
+
+        regex = text.startswith('regex:', i)
+        chars = []
+        quoted = False
+        in_quotes = False
+        while i < length:
+            ch = text[i]
+            if ch == '"':
+                in_quotes = not in_quotes
+                quoted = True
+            elif not in_quotes and (ch.isspace() or (not regex and ch in '()|')):
+                break
+            else:
+                chars.append(ch)
+            i += 1
+        if in_quotes:
+            raise QueryError("引号没有闭合")
+        word = ''.join(chars)
+        if not quoted and word in ('AND', 'OR', 'NOT'):
+            tokens.append(('op', word))
+        else:
+            tokens.append(('word', word, quoted))
+    return tokens
+
+
+def _parse_size_value(text):
+    match = SIZE_RE.match(text.strip())
+    if not match:
+        raise QueryError(f"无法识别的大小: {text}")
+    unit = match.group(2).lower()
+    return int(float(match.group(1)) * SIZE_UNITS[unit])
+
+
+def _compare_range(text, parse_period):
+    """解析比较和区间，parse_period 把一个值解析为 [开始, 结束)，返回 [下限, 上限)"""
+    if '..' in text:
+        low, high = text.split('..', 1)
+        return (parse_period(low)[0] if low else None,
+                parse_period(high)[1] if high else None)
+    op, value = COMPARE_RE.match(text).groups()
+    start, end = parse_period(value)
+    if op == '>':
+        return end, None
+    if op == '>=':
+        return start, None
+    if op == '<':
+        return None, start
+    if op == '<=':
+        return None, end
+    return start, end
+
+
+def parse_size(text):
+    named = SIZE_NAMES.get(text.lower())
+    if named is not None:
+        return named
+
+    def period(value):
+        size = _parse_size_value(value)
+        return size, size + 1
+
+    return _compare_range(text, period)
+
+
+def _month_start(day, delta=0):
+    month = day.month - 1 + delta
+    return day.replace(year=day.year + month // 12, month=month % 12 + 1, day=1)
+
+
+def _relative_period(name, now):
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    monday = today - timedelta(days=today.weekday())
+    month = _month_start(today)
+    year = today.replace(month=1, day=1)
+    periods = {
+        'today': (today, today + timedelta(days=1)),
+        'yesterday': (today - timedelta(days=1), today),
+        'thisweek': (monday, monday + timedelta(days=7)),
+        'lastweek': (monday - timedelta(days=7), monday),
+        'thismonth': (month, _month_start(today, 1)),
+        'lastmonth': (_month_start(today, -1), month),
+        'thisyear': (year, year.replace(year=year.year + 1)),
+        'lastyear': (year.replace(year=year.year - 1), year),
+    }
+    return periods.get(name.lower())
+
+
+def _date_period(text, now):
+    """一个日期代表的整段时间：2024 是整年，2024-03 是整月，2024-03-01 是一天"""
+    text = text.strip()
+    relative = _relative_period(text, now)
+    if relative is not None:
+        return relative
+    for fmt, step in (('%Y-%m-%d', 'day'), ('%Y/%m/%d', 'day'), ('%Y-%m', 'month'), ('%Y/%m', 'month'),
+                      ('%Y', 'year')):
+        try:
+            start = datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        if step == 'day':
+            return start, start + timedelta(days=1)
+        if step == 'month':
+            return start, _month_start(start, 1)
+        return start, start.replace(year=start.year + 1)
+    raise QueryError(f"无法识别的日期: {text}")
+
+
+def parse_date_range(text, now=None):
+    """解析 dm: 的值，返回整数时间戳区间 [下限, 上限)"""
+    now = now or datetime.now()
+    low, high = _compare_range(text, lambda value: _date_period(value, now))
+    return (int(low.timestamp()) if low is not None else None,
+            int(high.timestamp()) if high is not None else None)
+
+
+def parse_term(word, now=None):
+    field, sep, value = word.partition(':')
+    field = field.lower()
+    if not sep or field not in ('ext', 'size', 'dm', 'path', 'regex'):
+        if '*' in word or '?' in word:
+            return Term('wildcard', word)
+        return Term('name', word)
+    if not value:
+        raise QueryError(f"{field}: 后面缺少内容")
+    if field == 'ext':
+        exts = tuple(ext.strip().lstrip('.').lower() for ext in re.split('[;,]', value) if ext.strip())
+        if not exts:
+            raise QueryError("ext: 后面缺少扩展名")
+        return Term('ext', exts)
+    if field == 'size':
+        return Term('size', parse_size(value))
+    if field == 'dm':
+        return Term('dm', parse_date_range(value, now))
+    if field == 'regex':
+        try:
+            re.compile(value)
+        except re.error as e:
+            raise QueryError(f"正则表达式有误: {e}") from None
+        return Term('regex', value)
+    return Term('path', value)
+
+
+class _Parser:
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.pos = 0
+        self.now = now
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.parse_and()
+        if self.peek() is not None:
+            raise QueryError("括号不匹配")
+        return node
+
+    def parse_and(self):
+        items = []
+        while True:
+            token = self.peek()
+            if token is None or token == ('op', ')'):
+                break
+            if token == ('op', 'AND'):
+                self.take()
+                continue
+            items.append(self.parse_or())
+        if not items:
+            raise QueryError("缺少搜索条件")
+        return items[0] if len(items) == 1 else And(tuple(items))
+
+    def parse_or(self):
+        items = [self.parse_unary()]
+        while self.peek() in (('op', '|'), ('op', 'OR')):
+            self.take()
+            items.append(self.parse_unary())
+        return items[0] if len(items) == 1 else Or(tuple(items))
+
+    def parse_unary(self):
+        token = self.take()
+        if token in (('op', '!'), ('op', 'NOT')):
+            return Not(self.parse_unary())
+        if token == ('op', '('):
+            node = self.parse_and()
+            if self.take() != ('op', ')'):
+                raise QueryError("括号不匹配")
+            return node
+        if token is None or token[0] != 'word':
+            raise QueryError("缺少搜索条件")
+        return parse_term(token[1], self.now)
+
+
+def parse_query(text, now=None):
+    """把关键词解析为语法树，不符合语法时抛出 QueryError"""
+    return _Parser(tokenize(text), now).parse()
+
+
+def is_plain_query(text):
+    """关键词是否只是一个普通的文件名子串
+
+    普通子串继续走原来的全文索引、文件名索引和缓存；不符合语法的关键词也按普通子串处理，
+    输入到一半的条件（例如 size:>）不会报错，只是搜不到结果。
+    """
+    try:
+        node = parse_query(text)
+    except QueryError:
+        return True
+    return node == Term('name', text)
+
+
+def fts_match(node, use_fts=True):
+    """能完全由全文索引回答的条件（足够长的普通词，或者只由它们组成的 |）对应的 MATCH 表达式"""
+    if not use_fts:
+        return None
+    if isinstance(node, Term) and node.field == 'name' and len(node.value) >= FTS_MIN_LENGTH:
+        return f"filename : {fts_phrase(node.value)}"
+    if isinstance(node, Or):
+        parts = [fts_match(item) for item in node.items]
+        if all(parts):
+            return ' OR '.join(parts)
+    return None
+
+
+def _prefilter_match(node, use_fts):
+    """可以用全文索引缩小候选范围的 MATCH 表达式（结果可能比条件本身多）"""
+    match = fts_match(node, use_fts)
+    if match is None and use_fts and isinstance(node, Term) and node.field == 'wildcard':
+        # 通配符之间每一段足够长的文字都必须出现在文件名中
+        literals = [part for part in re.split(r'[*?]', node.value) if len(part) >= FTS_MIN_LENGTH]
+        if literals:
+            match = ' AND '.join(f"filename : {fts_phrase(part)}" for part in literals)
+    return match
+
+
+class _Compiler:
+    """把语法树编译为 SQL 条件
+
+    indexed 为 False 时条件只用来过滤已经选出的候选行：列名前加一元 +，
+    让 SQLite 不为这些条件选择索引，子串也不再展开全文索引的结果集。
+    """
+
+    def __init__(self, conn, use_fts, indexed=True):
+        self.conn = conn
+        self.use_fts = use_fts
+        self.indexed = indexed
+        self.params = []
+
+    def compile(self, node):
+        if isinstance(node, Term):
+            return getattr(self, '_' + node.field)(node.value)
+        if isinstance(node, Not):
+            # NOT 用不上索引，展开全文索引的结果集反而更慢
+            indexed, self.indexed = self.indexed, False
+            try:
+                return f"NOT {self.compile(node.item)}"
+            finally:
+                self.indexed = indexed
+        match = fts_match(node, self.use_fts) if self.indexed else None
+        if match is not None:
+            self.params.append(match)
+            return FTS_CONDITION
+        joiner = ' AND ' if isinstance(node, And) else ' OR '
+        return '(' + joiner.join(self.compile(item) for item in node.items) + ')'
+
+    def _column(self, expr):
+        return expr if self.indexed else f"+{expr}"
+
+    def _like(self, pattern):
+        self.params.append(pattern)
+        return "f.filename LIKE ? ESCAPE '\\'"
+
+    def _name(self, text):
+        match = fts_match(Term('name', text), self.use_fts) if self.indexed else None
+        if match is not None:
+            self.params.append(match)
+            return FTS_CONDITION
+        return self._like(f"%{escape_like(text)}%")
+
+    def _wildcard(self, pattern):
+        # 通配符之间的文字先走全文索引，剩下的行再做 LIKE
+        match = _prefilter_match(Term('wildcard', pattern), self.use_fts) if self.indexed else None
+        if match is None:
+            return self._like(wildcard_to_like(pattern))
+        self.params.append(match)
+        return f"({FTS_CONDITION} AND {self._like(wildcard_to_like(pattern))})"
+
+    def _regex(self, pattern):
+        self.params.append(pattern)
+        return "f.filename REGEXP ?"
+
+    def _ext(self, exts):
+        self.params.extend(exts)
+        expr = self._column(EXT_SQL.replace('filename', 'f.filename'))
+        return f"{expr} IN ({','.join('?' * len(exts))})"
+
+    def _range(self, column, bounds):
+        low, high = bounds
+        column = self._column(column)
+        conditions = []
+        if low is not None:
+            conditions.append(f"{column} >= ?")
+            self.params.append(low)
+        if high is not None:
+            conditions.append(f"{column} < ?")
+            self.params.append(high)
+        if not conditions:
+            return "1"
+        return '(' + ' AND '.join(conditions) + ')'
+
+    def _size(self, bounds):
+        return self._range('f.size', bounds)
+
+    def _dm(self, bounds):
+        return self._range('f.mtime', bounds)
+
+    def _path(self, text):
+        if os.altsep:
+            text = text.replace(os.altsep, os.sep)
+        dir_column = self._column('f.dir_id')
+        if not (os.path.isabs(text) or os.path.splitdrive(text)[0]):
+            self.params.append(f"%{escape_like(text)}%")
+            return dir_column + SUBTREE_CONDITION.format(seed="name LIKE ? ESCAPE '\\'")
+
+        seeds, parents, partial = self._resolve_prefix(text)
+        conditions = []
+        if seeds:
+            conditions.append(dir_column + SUBTREE_CONDITION.format(seed=f"id IN ({','.join('?' * len(seeds))})"))
+            self.params.extend(seeds)
+        if parents and partial:
+            # 前缀的最后一段也可能是直接位于上级目录中的文件名开头
+            conditions.append(f"({dir_column} IN ({','.join('?' * len(parents))}) AND f.filename LIKE ? ESCAPE '\\')")
+            self.params.extend(parents)
+            self.params.append(escape_like(partial) + '%')
+        if not conditions:
+            return "0"
+        return '(' + ' OR '.join(conditions) + ')'
+
+    def _children(self, parent_ids, condition, value):
+        placeholders = ','.join('?' * len(parent_ids))
+        return [row[0] for row in self.conn.execute(
+            f"SELECT id FROM dirs WHERE parent_id IN ({placeholders}) AND {condition}",
+            list(parent_ids) + [value]
+        )]
+
+    def _resolve_prefix(self, text):
+        """在 dirs 表中逐级定位绝对路径前缀（不区分大小写）
+
+        返回 (整个子树都匹配的目录, 最后一段所在的目录, 最后一段)，
+        最后一段按名称开头匹配，例如 C:\\Us 匹配 C:\\Users 和 C:\\Users2。
+        """
+        folded = text.lower()
+        seeds, parents = [], []
+        partial = ''
+        for root_id, root in self.conn.execute("SELECT id, name FROM dirs WHERE parent_id IS NULL").fetchall():
+            if root.lower().startswith(folded):
+                seeds.append(root_id)
+                continue
+            prefix = root if root.endswith(os.sep) else root + os.sep
+            if not folded.startswith(prefix.lower()):
+                continue
+            parts = text[len(prefix):].split(os.sep)
+            current = [root_id]
+            for name in parts[:-1]:
+                if name:
+                    current = self._children(current, "name = ? COLLATE NOCASE", name)
+                    if not current:
+                        break
+            if not current:
+                continue
+            partial = parts[-1]
+            if not partial:
+                seeds.extend(current)
+            else:
+                seeds.extend(self._children(current, "name LIKE ? ESCAPE '\\'", escape_like(partial) + '%'))
+                parents.extend(current)
+        return seeds, parents, partial
+
+
+# 候选行少于这个数时先取出全部候选的编号再逐页过滤，否则按编号顺序边扫描边过滤
+MATERIALIZE_LIMIT = 20000
+
+FILES_SOURCE = "files f"
+# 固定从全文索引出发，按 rowid 顺序取出命中的行，凑满一页就停
+FTS_SOURCE = "files_fts CROSS JOIN files f ON f.id = files_fts.rowid"
+
+# source 是 FROM 子句，key 是分页和排序用的编号列，strategy 是选择的驱动方式：
+# candidates（先取出少量候选）、fts（沿全文索引扫描）或 sqlite（交给 SQLite 选择索引）
+QueryPlan = namedtuple('QueryPlan', ['source', 'key', 'where', 'params', 'strategy'])
+
+
+def _estimate(conn, node, use_fts):
+    """条件能用索引选出的候选行数，最多数到 MATERIALIZE_LIMIT；用不上索引时返回 None"""
+    match = _prefilter_match(node, use_fts)
+    if match is not None:
+        sql, params = "SELECT 1 FROM files_fts WHERE files_fts MATCH ?", (match,)
+    elif isinstance(node, Term) and node.field in ('ext', 'size', 'dm', 'path'):
+        compiler = _Compiler(conn, use_fts)
+        sql = f"SELECT 1 FROM files f WHERE {compiler.compile(node)}"
+        params = tuple(compiler.params)
+    else:
+        return None
+    return conn.execute(f"SELECT count(*) FROM ({sql} LIMIT ?)", params + (MATERIALIZE_LIMIT,)).fetchone()[0]
+
+
+def plan_query(conn, text, use_fts=False, now=None):
+    """把关键词编译为查询计划，不符合语法时抛出 QueryError
+
+    没有统计直方图时 SQLite 估不准范围条件能选出多少行，这里先对最外层 AND 的每个条件
+    在索引上数一下候选行数（数到 MATERIALIZE_LIMIT 为止），由最少的那个驱动查询：
+    - 候选很少：取出这些行的编号，其余条件只做过滤，每页都只需要处理这些候选
+    - 候选都很多但有全文索引能回答的条件：沿全文索引按 rowid 顺序扫描，凑满一页就停
+    - 否则交给 SQLite 自己选择索引
+    path: 需要在 conn 的 dirs 表中定位目录；use_fts 表示可以使用 files_fts 全文索引。
+    """
+    node = parse_query(text, now)
+    items = list(node.items) if isinstance(node, And) else [node]
+    estimates = [_estimate(conn, item, use_fts) for item in items]
+    candidates = [(count, position) for position, count in enumerate(estimates) if count is not None]
+
+    source, key, strategy = FILES_SOURCE, 'f.id', 'sqlite'
+    driver = None
+    driver_sql = None
+    if candidates and min(candidates)[0] < MATERIALIZE_LIMIT:
+        driver = min(candidates)[1]
+        strategy = 'candidates'
+        compiler = _Compiler(conn, use_fts)
+        driver_sql = compiler.compile(items[driver])
+        if not driver_sql.startswith(FTS_CONDITION):
+            driver_sql = f"f.id IN (SELECT f.id FROM files f WHERE {driver_sql})"
+    else:
+        matches = [position for position, item in enumerate(items) if _prefilter_match(item, use_fts)]
+        if matches:
+            driver = matches[0]
+            compiler = _Compiler(conn, use_fts)
+            compiler.params.append(_prefilter_match(items[driver], use_fts))
+            driver_sql = "files_fts MATCH ?"
+            source, key, strategy = FTS_SOURCE, 'files_fts.rowid', 'fts'
+            # 通配符的全文索引条件只是预筛，仍要做一次 LIKE
+            if fts_match(items[driver], use_fts) is None:
+                driver = None
+
+    if driver_sql is None:
+        compiler = _Compiler(conn, use_fts)
+        return QueryPlan(source, key, compiler.compile(node), tuple(compiler.params), strategy)
+
+    conditions = [driver_sql]
+    compiler.indexed = False
+    for position, item in enumerate(items):
+        if position != driver:
+            conditions.append(compiler.compile(item))
+    return QueryPlan(source, key, ' AND '.join(conditions), tuple(compiler.params), strategy)
@@ -0,0 +1,230 @@
+"""本地查询服务（query_server.py）的客户端和压力测试
+
+只依赖标准库，可以单独复制到其他脚本中使用：
+
+    from query_client import QueryClient
+
+    client = QueryClient()                 # 读取数据库目录下的 server.json 找到服务
+    rows, cursor = client.search('report ext:pdf', limit=50)
+    for row in client.iter_search('*.log'):   # 按游标自动翻页
+        print(row['path'])
+    for row in client.stream('*.log'):       # 服务端分块推送全部结果
+        ...
+
+QueryClient 在一个 HTTP 长连接上发送请求，不是线程安全的，每个线程各建一个。
+
+压力测试：
+
+    python query_client.py loadtest --clients 16 --duration 10 [--query 关键词 ...]
+
+每个线程一个客户端，随机选择查询不停发送，最后输出请求数、吞吐量和延迟分位数（毫秒）。
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlencode
+
+# 与 engine.DEFAULT_DB_FOLDER、query_server.SERVER_FILE 相同，这里不导入项目模块
+DEFAULT_DB_FOLDER = os.path.join(os.path.expanduser('~'), 'Everything_like_By_WZ')
+SERVER_FILE = 'server.json'
+TOKEN_HEADER = 'X-Everything-Token'
+
+# 压力测试默认使用的查询，覆盖全文索引、文件名索引和搜索语法几条路径
+LOAD_QUERIES = ('report', 'txt', 'a', 'ext:pdf', 'size:>1mb', '*.log', 'path:docs',
+                'dm:today', 'photo ext:jpg', '"data"')
+
+
+class QueryServerError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+def discover(db_folder=DEFAULT_DB_FOLDER):
+    """读取服务写下的 server.json，返回 (端口, 令牌)，服务没有运行时返回 None"""
+    try:
+        with open(os.path.join(db_folder, SERVER_FILE), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        return info['port'], info['token']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+class QueryClient:
+    def __init__(self, port=None, token=None, db_folder=DEFAULT_DB_FOLDER, host='127.0.0.1', timeout=30):
+        if port is None or token is None:
+            found = discover(db_folder)
+            if found is None:
+                raise ConnectionError(f"本地查询服务没有运行（{db_folder} 下没有 {SERVER_FILE}）")
+            port, token = port or found[0], token or found[1]
+        self.host = host
+        self.port = port
+        self.token = token
+        self.timeout = timeout
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._conn
+
+    def _request(self, path, params):
+        url = f"{path}?{urlencode({k: v for k, v in params.items() if v is not None})}"
+        headers = {TOKEN_HEADER: self.token}
+        # 长连接可能已被服务端关闭，重试一次
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request('GET', url, headers=headers)
+                return conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if attempt:
+                    raise
+
+    def _get_json(self, path, **params):
+        response = self._request(path, params)
+        data = json.loads(response.read())
+        if response.status != 200:
+            raise QueryServerError(response.status, data.get('error'))
+        return data
+
+    def search(self, keyword, limit=100, after=None):
+        """返回一页结果 (rows, 下一页的游标)，游标为 None 表示没有更多"""
+        data = self._get_json('/search', q=keyword, limit=limit, after=after)
+        return data['rows'], data['next']
+
+    def iter_search(self, keyword, page_size=1000):
+        """按游标逐页取出全部结果"""
+        after = None
+        while True:
+            rows, after = self.search(keyword, page_size, after)
+            yield from rows
+            if after is None:
+                return
+
+    def stream(self, keyword):
+        """一个请求取出全部结果，服务端边查边发送"""
+        response = self._request('/stream', {'q': keyword})
+        if response.status != 200:
+            data = json.loads(response.read())
+            raise QueryServerError(response.status, data.get('error'))
+        for line in response:
+            yield json.loads(line)
+
+    def count(self, keyword):
+        return self._get_json('/count', q=keyword)['count']
+
+    def fuzzy(self, keyword, limit=50):
+        return self._get_json('/fuzzy', q=keyword, limit=limit)['rows']
+
+    def stats(self):
+        return self._get_json('/stats')
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def load_test(client_factory, queries=LOAD_QUERIES, clients=8, duration=10.0, limit=100, seed=0):
+    """clients 个线程各用一个客户端在 duration 秒内不停搜索，返回统计字典"""
+    deadline = time.perf_counter() + duration
+    latencies = [[] for _ in range(clients)]
+    errors = [0] * clients
+    start = threading.Barrier(clients + 1)
+
+    def run(slot):
+        rng = random.Random(seed + slot)
+        client = client_factory()
+        start.wait()
+        try:
+            while time.perf_counter() < deadline:
+                keyword = rng.choice(queries)
+                begin = time.perf_counter()
+                try:
+                    client.search(keyword, limit)
+                except (QueryServerError, OSError):
+                    errors[slot] += 1
+                    continue
+                latencies[slot].append(time.perf_counter() - begin)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=run, args=(slot,), daemon=True) for slot in range(clients)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    begin = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+
+    merged = sorted(value * 1000 for values in latencies for value in values)
+    return {
+        'clients': clients,
+        'duration_sec': round(elapsed, 3),
+        'requests': len(merged),
+        'errors': sum(errors),
+        'requests_per_sec': round(len(merged) / elapsed, 1) if elapsed > 0 else 0.0,
+        'latency_ms': {
+            'p50': round(_percentile(merged, 0.50), 3),
+            'p90': round(_percentile(merged, 0.90), 3),
+            'p99': round(_percentile(merged, 0.99), 3),
+            'max': round(merged[-1], 3) if merged else 0.0,
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='query_client.py', description='本地查询服务的客户端')
+    parser.add_argument('--db-folder', default=DEFAULT_DB_FOLDER, help='服务写下 server.json 的数据库目录')
+    parser.add_argument('--port', type=int, help='服务端口（默认从 server.json 读取）')
+    parser.add_argument('--token', help='访问令牌（默认从 server.json 读取）')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    search = commands.add_parser('search', help='搜索并输出全部匹配的路径')
+    search.add_argument('keyword')
+    search.add_argument('--limit', type=int, help='最多输出多少条')
+
+    load = commands.add_parser('loadtest', help='多个客户端并发搜索，输出吞吐量和延迟分位数')
+    load.add_argument('--clients', type=int, default=8)
+    load.add_argument('--duration', type=float, default=10.0, help='持续秒数')
+    load.add_argument('--limit', type=int, default=100, help='每个请求取多少条')
+    load.add_argument('--query', action='append', help='要使用的查询，可以重复；默认使用内置的一组查询')
+    args = parser.parse_args(argv)
+
+    def make_client():
+        return QueryClient(args.port, args.token, args.db_folder)
+
+    try:
+        if args.command == 'search':
+            client = make_client()
+            for i, row in enumerate(client.stream(args.keyword)):
+                if args.limit is not None and i >= args.limit:
+                    break
+                print(row['path'])
+            client.close()
+        else:
+            make_client().close()
+            result = load_test(make_client, tuple(args.query or LOAD_QUERIES),
+                               args.clients, args.duration, args.limit)
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+    except (ConnectionError, QueryServerError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
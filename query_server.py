@@ -0,0 +1,369 @@
+"""本地查询服务
+
+让其他程序复用托盘进程里已经打开的数据库和 .names 文件名索引，而不是每次冷启动重新打开。
+服务只监听 127.0.0.1，需要手动开启（图形界面的菜单或 `python cli.py serve`）。
+
+启动后在数据库目录下写入 server.json（端口、访问令牌、进程号），客户端（见 query_client.py）
+读取它来找到服务；每个请求都要在 X-Everything-Token 头或 token 参数中带上令牌。
+
+接口（GET，返回 JSON，出错时返回 {"error": 说明}）：
+- /search?q=关键词&limit=100&after=游标   一页结果和下一页的游标 next，游标为 null 表示没有更多
+- /stream?q=关键词                        分块传输全部结果，每行一个 JSON（application/x-ndjson）
+- /count?q=关键词                         匹配总数
+- /fuzzy?q=关键词&limit=50                按相似度排列的近似匹配
+- /stats                                  数据库概况和服务统计
+
+关键词支持与搜索框相同的语法（见 query.py）。分页使用与界面相同的键集游标，服务端不保存
+任何游标状态，每一页都可以落在连接池里的不同连接上。
+"""
+import hmac
+import json
+import os
+import queue
+import secrets
+import signal
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from index_db import open_readonly
+from metrics import Metrics
+from name_index import NameIndex
+from query import QueryError
+from search import search_page, count_matches, fuzzy_search
+
+DEFAULT_PORT = 8765
+SERVER_FILE = 'server.json'
+TOKEN_HEADER = 'X-Everything-Token'
+MAX_LIMIT = 10000
+# /stream 每次查询的行数，比界面的一页大，减少往返和分块的次数
+STREAM_PAGE_SIZE = 2000
+# search_page 使用的游标类型
+CURSOR_KINDS = ('query', 'fts', 'names', 'tail', 'like', 'keys')
+# 等待空闲连接的最长秒数，超过后返回 503
+ACQUIRE_TIMEOUT = 10.0
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class PoolClosed(PoolExhausted):
+    # 数据库已经切换，请求可以改用新的连接池重试
+    pass
+
+
+class ConnectionPool:
+    """同一个数据库的只读连接池，所有连接共用一个 .names 文件名索引
+
+    连接按需创建，最多 size 个。close() 之后归还的连接直接关闭，最后一个连接归还时
+    释放文件名索引，正在处理的请求不会受到切换数据库的影响。
+    """
+
+    def __init__(self, db_path, size=8, use_name_index=True):
+        self.db_path = db_path
+        self.size = size
+        self.name_index = NameIndex.open(db_path) if use_name_index else None
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._closed = False
+
+    def acquire(self, timeout=ACQUIRE_TIMEOUT):
+        with self._lock:
+            if self._closed:
+                raise PoolClosed("数据库已切换")
+            self._in_use += 1
+            create = self._idle.empty() and self._created < self.size
+            if create:
+                self._created += 1
+        try:
+            if create:
+                return open_readonly(self.db_path, check_same_thread=False)
+            conn = self._idle.get(timeout=timeout)
+            if conn is None:
+                raise PoolClosed("数据库已切换")
+            return conn
+        except BaseException as e:
+            with self._lock:
+                self._in_use -= 1
+                if create:
+                    self._created -= 1
+            if isinstance(e, queue.Empty):
+                raise PoolExhausted("没有空闲的数据库连接")
+            raise
+
+    def release(self, conn):
+        with self._lock:
+            self._in_use -= 1
+            closed = self._closed
+            last = closed and self._in_use == 0
+        if closed:
+            conn.close()
+            if last:
+                self._close_name_index()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def _close_name_index(self):
+        if self.name_index is not None:
+            self.name_index.close()
+            self.name_index = None
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle_only = self._in_use == 0
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        # 唤醒正在等待空闲连接的请求，让它们改用新的连接池
+        for _ in range(self.size):
+            self._idle.put(None)
+        if idle_only:
+            self._close_name_index()
+
+
+def encode_cursor(after):
+    return None if after is None else f"{after[0]}:{after[1]}"
+
+
+def decode_cursor(text):
+    if not text:
+        return None
+    kind, _, value = text.partition(':')
+    if kind in CURSOR_KINDS and value.isdigit():
+        return kind, int(value)
+    raise QueryError(f"无效的游标: {text}")
+
+
+def row_json(row):
+    path, filename, size, mtime = row
+    return {'path': path, 'name': filename, 'size': size, 'mtime': mtime}
+
+
+class QueryServer:
+    """在后台线程中运行的本地 HTTP 查询服务"""
+
+    def __init__(self, db_path, db_folder, port=DEFAULT_PORT, pool_size=8, use_name_index=True):
+        self.db_folder = db_folder
+        self.pool_size = pool_size
+        self.token = secrets.token_urlsafe(24)
+        self.metrics = Metrics('server')
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.set_database(db_path, use_name_index)
+        # 端口为 0 时由系统分配
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.query_server = self
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    @property
+    def pool(self):
+        return self._pool
+
+    def set_database(self, db_path, use_name_index=True):
+        """切换数据库，正在处理的请求继续使用旧的连接直到结束"""
+        pool = ConnectionPool(db_path, self.pool_size, use_name_index) if db_path else None
+        with self._pool_lock:
+            old, self._pool = self._pool, pool
+        if old is not None:
+            old.close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='QueryServer', daemon=True)
+        self._thread.start()
+        self._write_server_file()
+        print(f"本地查询服务已启动: http://127.0.0.1:{self.port}/")
+
+    def serve_forever(self):
+        """在当前线程中运行（命令行使用），收到 SIGTERM 时同样清理 server.json 后退出"""
+        previous = signal.signal(signal.SIGTERM, _exit_on_signal) if hasattr(signal, 'SIGTERM') else None
+        self._write_server_file()
+        print(f"本地查询服务已启动: http://127.0.0.1:{self.port}/")
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self._cleanup()
+            if previous is not None:
+                signal.signal(signal.SIGTERM, previous)
+
+    def stop(self):
+        self.httpd.shutdown()
+        if self._thread is not None:
+            self._thread.join()
+        self._cleanup()
+
+    def _cleanup(self):
+        self.httpd.server_close()
+        self.set_database(None)
+        path = os.path.join(self.db_folder, SERVER_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                owned = json.load(f).get('pid') == os.getpid()
+            if owned:
+                os.remove(path)
+        except (OSError, ValueError):
+            pass
+
+    def _write_server_file(self):
+        path = os.path.join(self.db_folder, SERVER_FILE)
+        temp_path = path + '.tmp'
+        # 令牌只给当前用户读取（Windows 上由用户目录的权限保护）
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'port': self.port, 'token': self.token, 'pid': os.getpid()}, f)
+        os.replace(temp_path, path)
+
+    def check_token(self, token):
+        return bool(token) and hmac.compare_digest(token, self.token)
+
+
+def _exit_on_signal(signum, frame):
+    # 转换为 SystemExit，serve_forever() 的 finally 会删除 server.json
+    raise SystemExit(128 + signum)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # 支持长连接，客户端可以在一个连接上连续翻页
+    protocol_version = 'HTTP/1.1'
+    # 响应头和正文分两次写出，长连接上开着 Nagle 算法时每个请求都要等对方的延迟确认（约 40ms）
+    disable_nagle_algorithm = True
+    server_version = 'EverythingQuery/1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.query_server
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if not service.check_token(self.headers.get(TOKEN_HEADER) or params.get('token')):
+            self._send_json(403, {'error': '访问令牌无效'})
+            return
+
+        handler = getattr(self, f"_handle_{url.path.strip('/')}", None)
+        if handler is None:
+            self._send_json(404, {'error': f"未知的接口: {url.path}"})
+            return
+
+        begin = time.perf_counter()
+        self._streaming = False
+        try:
+            # 取到连接池之后数据库正好被切换时，用新的连接池重试一次
+            for attempt in range(2):
+                pool = service.pool
+                if pool is None:
+                    self._send_json(503, {'error': '没有打开的数据库'})
+                    return
+                try:
+                    handler(pool, params)
+                    return
+                except PoolClosed:
+                    if attempt or self._streaming:
+                        raise
+        except (QueryError, ValueError) as e:
+            self._send_json(400, {'error': str(e)})
+        except PoolExhausted as e:
+            if self._streaming:
+                # 流已经开始，数据库切换后游标失效，不写结束块，客户端会发现结果不完整
+                self.close_connection = True
+            else:
+                self._send_json(503, {'error': str(e)})
+        except sqlite3.Error as e:
+            if self._streaming:
+                self.close_connection = True
+            else:
+                self._send_json(500, {'error': f"查询出错: {e}"})
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开（例如只读了流的开头）
+            self.close_connection = True
+        finally:
+            service.metrics.observe(f"request{url.path}", time.perf_counter() - begin)
+            service.metrics.count('requests')
+
+    def _keyword(self, params):
+        keyword = params.get('q', '')
+        if not keyword:
+            raise QueryError("缺少参数 q")
+        return keyword
+
+    def _limit(self, params, default):
+        return max(1, min(MAX_LIMIT, int(params.get('limit', default))))
+
+    def _handle_search(self, pool, params):
+        keyword = self._keyword(params)
+        with pool.connection() as conn:
+            rows, after = search_page(conn, keyword, decode_cursor(params.get('after')),
+                                      self._limit(params, 100), pool.name_index)
+        self._send_json(200, {'rows': [row_json(row) for row in rows], 'next': encode_cursor(after)})
+
+    def _handle_count(self, pool, params):
+        keyword = self._keyword(params)
+        with pool.connection() as conn:
+            total = count_matches(conn, keyword, pool.name_index)
+        self._send_json(200, {'count': total})
+
+    def _handle_fuzzy(self, pool, params):
+        keyword = self._keyword(params)
+        with pool.connection() as conn:
+            rows = fuzzy_search(conn, pool.name_index, keyword, self._limit(params, 50))
+        self._send_json(200, {'rows': [row_json(row) for row in rows]})
+
+    def _handle_stats(self, pool, params):
+        with pool.connection() as conn:
+            files = conn.execute("SELECT count(*) FROM files").fetchone()[0]
+        service = self.server.query_server
+        self._send_json(200, {
+            'database': pool.db_path,
+            'files': files,
+            'name_index': pool.name_index is not None,
+            'pool_size': pool.size,
+            'server': service.metrics.snapshot(),
+        })
+
+    def _handle_stream(self, pool, params):
+        """逐页查询，每页重新从连接池取连接，按分块传输写出"""
+        keyword = self._keyword(params)
+        # 先取第一页，语法错误可以作为普通的 400 返回
+        with pool.connection() as conn:
+            rows, after = search_page(conn, keyword, None, STREAM_PAGE_SIZE, pool.name_index)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self._streaming = True
+        while True:
+            if rows:
+                chunk = ''.join(json.dumps(row_json(row), ensure_ascii=False) + '\n' for row in rows)
+                data = chunk.encode('utf-8')
+                self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            if after is None:
+                break
+            with pool.connection() as conn:
+                rows, after = search_page(conn, keyword, after, STREAM_PAGE_SIZE, pool.name_index)
+        self.wfile.write(b"0\r\n\r\n")
@@ -0,0 +1,326 @@
+"""文件名搜索
+
+按以下顺序选择查询方式：
+1. 数据库中有 files_fts 三元组全文索引且关键词至少三个字符时，走 FTS5 MATCH
+2. 已加载 .names 文件名索引时，在内存映射的文件名上做字节扫描，只按 rowid 回表取命中的行；
+   短关键词在文件名中很常见，扫描很快就能凑满结果
+3. 都不可用时（没有索引的旧数据库）退回原来的 LIKE 查询
+
+数据库中有 name_keys 搜索键（见 name_keys.py）时，上面的结果取完之后再按 rowid 顺序返回
+只有搜索键匹配的文件：大小写折叠后的文件名（Ä/ä、ß/ss）、全拼和拼音首字母，例如 bg 或
+baogao 找到 报告.docx。搜索键至少三个字符时走 name_keys_fts 三元组全文索引。
+
+关键词使用了搜索语法（多个词、ext: size: dm: path: regex:、通配符、| ! 等，见 query.py）时，
+编译为 SQL 条件后按 rowid 分页查询，由 SQLite 根据条件选择扩展名、大小、修改时间等索引。
+
+fuzzy_search() 在 .names 文件名索引上做子序列和容错的近似匹配（见 fuzzy.py），
+按相似度返回精确结果之外的文件。
+
+结果中的完整路径由 file_path(dir_id, filename) 拼出，连接需要通过
+index_db.open_readonly() 或 register_functions() 注册该函数。
+"""
+import sqlite3
+
+from fuzzy import fuzzy_matches, FUZZY_LIMIT
+from query import plan_query, is_plain_query, fts_phrase, FTS_MIN_LENGTH
+from name_keys import has_name_keys, has_name_keys_fts
+
+FTS_TABLE_SQL = """
+    CREATE VIRTUAL TABLE files_fts USING fts5(
+        filename,
+        content='files',
+        content_rowid='id',
+        tokenize='trigram'
+    )
+"""
+
+# 外部内容表需要触发器同步，增量更新和实时监控对 files 的修改会自动反映到索引中
+FTS_TRIGGERS_SQL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files BEGIN
+        INSERT INTO files_fts(rowid, filename) VALUES (new.id, new.filename);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files BEGIN
+        INSERT INTO files_fts(files_fts, rowid, filename) VALUES ('delete', old.id, old.filename);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS files_fts_update AFTER UPDATE OF filename ON files BEGIN
+        INSERT INTO files_fts(files_fts, rowid, filename) VALUES ('delete', old.id, old.filename);
+        INSERT INTO files_fts(rowid, filename) VALUES (new.id, new.filename);
+    END
+    """,
+]
+
+
+def has_fts_index(conn):
+    """数据库中是否已经建立了全文索引"""
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files_fts'").fetchone()
+    return row is not None
+
+
+def build_fts_index(conn):
+    """为 files 表建立三元组全文索引，SQLite 不支持 FTS5 或 trigram 时返回 False"""
+    try:
+        conn.execute("DROP TABLE IF EXISTS files_fts")
+        conn.execute(FTS_TABLE_SQL)
+        conn.execute("INSERT INTO files_fts(files_fts) VALUES ('rebuild')")
+        for sql in FTS_TRIGGERS_SQL:
+            conn.execute(sql)
+        conn.commit()
+        return True
+    except sqlite3.OperationalError as e:
+        conn.rollback()
+        print(f"当前 SQLite 不支持三元组全文索引，搜索将使用 LIKE: {e}")
+        return False
+
+
+def can_use_fts(conn, keyword):
+    # % 在 LIKE 中是通配符，保留原来的语义
+    return len(keyword) >= FTS_MIN_LENGTH and '%' not in keyword and has_fts_index(conn)
+
+
+PAGE_SIZE = 256
+
+RESULT_COLUMNS = "file_path(f.dir_id, f.filename), f.filename, f.size, f.mtime"
+
+
+def _rowid_page(conn, sql, params, limit, kind):
+    """执行按 id 递增的键集分页查询，返回 (rows, next_after)"""
+    rows = conn.execute(sql, params + (limit,)).fetchall()
+    if len(rows) < limit:
+        return [row[1:] for row in rows], None
+    return [row[1:] for row in rows], (kind, rows[-1][0])
+
+
+def _fts_page(conn, keyword, after_rowid, limit):
+    return _rowid_page(
+        conn,
+        f"SELECT f.id, {RESULT_COLUMNS} "
+        "FROM files_fts JOIN files f ON f.id = files_fts.rowid "
+        "WHERE files_fts MATCH ? AND files_fts.rowid > ? ORDER BY files_fts.rowid LIMIT ?",
+        (f"filename : {fts_phrase(keyword)}", after_rowid),
+        limit,
+        'fts'
+    )
+
+
+def _like_page(conn, keyword, after_rowid, limit, kind='like'):
+    return _rowid_page(
+        conn,
+        f"SELECT f.id, {RESULT_COLUMNS} FROM files f "
+        "WHERE f.id > ? AND f.filename LIKE ? ORDER BY f.id LIMIT ?",
+        (after_rowid, f"%{keyword}%"),
+        limit,
+        kind
+    )
+
+
+def _query_page(conn, keyword, after_rowid, limit, trace=None):
+    plan = plan_query(conn, keyword, has_fts_index(conn))
+    if trace is not None:
+        trace['plan'] = f"query:{plan.strategy}"
+    return _rowid_page(
+        conn,
+        f"SELECT {plan.key}, {RESULT_COLUMNS} FROM {plan.source} "
+        f"WHERE {plan.where} AND {plan.key} > ? ORDER BY {plan.key} LIMIT ?",
+        plan.params + (after_rowid,),
+        limit,
+        'query'
+    )
+
+
+def _name_index_page(conn, name_index, keyword, start, limit):
+    """通过文件名索引取一页结果
+
+    索引生成之后实时监控新增的行（rowid 大于 max_rowid）不在索引中，扫描完索引后用
+    rowid 范围补查；被删除的行回表时自然查不到，被修改过的行回表后再核对一次文件名。
+    """
+    needle = keyword.lower()
+    results = []
+    position = start
+    matches = name_index.iter_matches(keyword, start)
+    while len(results) < limit:
+        indices = [i for _, i in zip(range(limit - len(results)), matches)]
+        if not indices:
+            # 索引已扫描完，转到补查阶段
+            rows, after = _like_page(conn, keyword, name_index.max_rowid, limit - len(results), 'tail')
+            results.extend(rows)
+            return results, after
+        position = indices[-1] + 1
+        rowids = [name_index.rowids[i] for i in indices]
+        placeholders = ','.join('?' * len(rowids))
+        rows = conn.execute(
+            f"SELECT {RESULT_COLUMNS} FROM files f WHERE f.id IN ({placeholders}) ORDER BY f.id",
+            rowids
+        ).fetchall()
+        results.extend(row for row in rows if needle in row[1].lower())
+    return results, ('names', position)
+
+
+def _key_source(conn, needle):
+    """匹配搜索键的 (表, 编号列, 条件, 参数)"""
+    if len(needle) >= FTS_MIN_LENGTH and has_name_keys_fts(conn):
+        return ("name_keys_fts CROSS JOIN files f ON f.id = name_keys_fts.rowid", "name_keys_fts.rowid",
+                "name_keys_fts MATCH ?", (fts_phrase(needle),))
+    return ("name_keys k CROSS JOIN files f ON f.id = k.file_id", "k.file_id",
+            "(instr(k.folded, ?) OR instr(k.pinyin, ?) OR instr(k.initials, ?))", (needle,) * 3)
+
+
+def _iter_key_matches(conn, keyword, first_kind, name_index, after_id=0):
+    """按 rowid 顺序逐个返回 (id, row)：搜索键匹配、但第一阶段没有返回过的文件
+
+    第一阶段的查询方式决定排除条件，保证同一个文件不会出现两次。
+    """
+    needle = keyword.casefold()
+    if not needle:
+        return
+    source, key, condition, params = _key_source(conn, needle)
+    known_ids = 0
+    if first_kind == 'fts':
+        exclude = "NOT EXISTS (SELECT 1 FROM files_fts WHERE files_fts MATCH ? AND files_fts.rowid = f.id)"
+        exclude_params = (f"filename : {fts_phrase(keyword)}",)
+    elif first_kind == 'names':
+        # 索引之后新增的行由补查阶段的 LIKE 返回，索引中的行由下面按文件名核对
+        known_ids = name_index.max_rowid
+        exclude = "NOT (f.id > ? AND f.filename LIKE ?)"
+        exclude_params = (known_ids, f"%{keyword}%")
+    else:
+        exclude = "NOT f.filename LIKE ?"
+        exclude_params = (f"%{keyword}%",)
+
+    lowered = keyword.lower()
+    while True:
+        rows = conn.execute(
+            f"SELECT {key}, {RESULT_COLUMNS} FROM {source} "
+            f"WHERE {condition} AND {key} > ? AND {exclude} ORDER BY {key} LIMIT ?",
+            params + (after_id,) + exclude_params + (PAGE_SIZE,)
+        ).fetchall()
+        for row in rows:
+            if row[0] <= known_ids and lowered in row[2].lower():
+                continue
+            yield row[0], row[1:]
+        if len(rows) < PAGE_SIZE:
+            return
+        after_id = rows[-1][0]
+
+
+def _keys_page(conn, keyword, after_id, limit, first_kind, name_index):
+    rows = []
+    for file_id, row in _iter_key_matches(conn, keyword, first_kind, name_index, after_id):
+        rows.append(row)
+        if len(rows) >= limit:
+            return rows, ('keys', file_id)
+    return rows, None
+
+
+def _first_kind(conn, keyword, name_index):
+    """第一页使用的查询方式"""
+    if not is_plain_query(keyword):
+        return 'query'
+    if can_use_fts(conn, keyword):
+        return 'fts'
+    if name_index is not None and '%' not in keyword:
+        return 'names'
+    return 'like'
+
+
+def search_page(conn, keyword, after=None, limit=PAGE_SIZE, name_index=None, trace=None):
+    """按文件名子串搜索一页，返回 (rows, next_after)
+
+    rows 是 (path, filename, size, mtime) 列表，mtime 是整数时间戳。next_after 是下一页的起点，
+    为 None 表示没有更多结果。分页使用 rowid（或文件名索引的位置）作为键，不用 OFFSET，
+    也不需要一直持有打开的游标，翻到很深的位置也一样快。
+    trace 是一个字典时，把这一页使用的查询方式写入 trace['plan']。
+    """
+    if after is None:
+        after = (_first_kind(conn, keyword, name_index), 0)
+
+    kind, value = after
+    if trace is not None:
+        trace['plan'] = kind
+    if kind == 'query':
+        return _query_page(conn, keyword, value, limit, trace)
+    if kind == 'keys':
+        return _keys_page(conn, keyword, value, limit, _first_kind(conn, keyword, name_index), name_index)
+    if kind == 'fts':
+        rows, after = _fts_page(conn, keyword, value, limit)
+    elif kind == 'names':
+        if name_index is None:
+            return [], None
+        rows, after = _name_index_page(conn, name_index, keyword, value, limit)
+    elif kind == 'tail':
+        rows, after = _like_page(conn, keyword, value, limit, 'tail')
+    else:
+        rows, after = _like_page(conn, keyword, value, limit)
+
+    # 文件名子串的结果取完之后，同一页接着取只有搜索键匹配的文件
+    if after is not None or not has_name_keys(conn):
+        return rows, after
+    if len(rows) >= limit:
+        return rows, ('keys', 0)
+    first_kind = 'names' if kind == 'tail' else kind
+    more, after = _keys_page(conn, keyword, 0, limit - len(rows), first_kind, name_index)
+    return rows + more, after
+
+
+def search_files(conn, keyword, limit=100, name_index=None):
+    """按文件名子串或搜索语法搜索，返回 (path, filename, size, mtime) 列表"""
+    return search_page(conn, keyword, None, limit, name_index)[0]
+
+
+def count_matches(conn, keyword, name_index=None):
+    """统计匹配的总数"""
+    if not is_plain_query(keyword):
+        plan = plan_query(conn, keyword, has_fts_index(conn))
+        return conn.execute(f"SELECT count(*) FROM {plan.source} WHERE {plan.where}", plan.params).fetchone()[0]
+
+    total = _count_plain(conn, keyword, name_index)
+    if has_name_keys(conn):
+        first_kind = _first_kind(conn, keyword, name_index)
+        total += sum(1 for _ in _iter_key_matches(conn, keyword, first_kind, name_index))
+    return total
+
+
+def _count_plain(conn, keyword, name_index):
+    if can_use_fts(conn, keyword):
+        return conn.execute(
+            "SELECT count(*) FROM files_fts WHERE files_fts MATCH ?",
+            (f"filename : {fts_phrase(keyword)}",)
+        ).fetchone()[0]
+
+    if name_index is not None and '%' not in keyword:
+        total = sum(1 for _ in name_index.iter_matches(keyword))
+        total += conn.execute(
+            "SELECT count(*) FROM files WHERE id > ? AND filename LIKE ?",
+            (name_index.max_rowid, f"%{keyword}%")
+        ).fetchone()[0]
+        return total
+
+    return conn.execute(
+        "SELECT count(*) FROM files WHERE filename LIKE ?",
+        (f"%{keyword}%",)
+    ).fetchone()[0]
+
+
+def fuzzy_search(conn, name_index, keyword, limit=FUZZY_LIMIT, should_stop=None):
+    """近似匹配文件名，返回按相似度从高到低排列的 (path, filename, size, mtime) 列表
+
+    只搜索文件名索引中的行；没有文件名索引或关键词使用了搜索语法时返回空列表。
+    """
+    if name_index is None or not is_plain_query(keyword):
+        return []
+    matches = fuzzy_matches(name_index, keyword, limit, should_stop)
+    if not matches:
+        return []
+    rowids = [name_index.rowids[i] for _, i in matches]
+    placeholders = ','.join('?' * len(rowids))
+    rows = conn.execute(
+        f"SELECT f.id, {RESULT_COLUMNS} FROM files f WHERE f.id IN ({placeholders})",
+        rowids
+    ).fetchall()
+    # 回表后恢复按得分排列的顺序，索引生成后被删除的行自然查不到
+    by_id = {row[0]: row[1:] for row in rows}
+    return [by_id[rowid] for rowid in rowids if rowid in by_id]
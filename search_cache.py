@@ -0,0 +1,167 @@
+"""搜索结果缓存
+
+按 (数据库路径, 关键词) 缓存完整的匹配结果，LRU 淘汰，总内存不超过 max_bytes。
+用户输入通常是逐步加长的（rep -> repo -> report），新关键词包含已缓存的关键词时，
+新结果一定是旧结果的子集，直接在内存里过滤旧结果即可，不需要再查数据库。
+数据库有 name_keys 搜索键时，文件也可能只靠搜索键匹配（bg 找到 报告.docx），
+过滤时同时检查文件名的搜索键：关键词包含旧关键词，能匹配某个键也就能用旧关键词匹配到它。
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from query import is_plain_query
+from name_keys import make_keys
+
+
+def estimate_row_bytes(row):
+    """粗略估计一行结果占用的内存"""
+    path, filename = row[0], row[1]
+    return 200 + 2 * (len(path) + len(filename))
+
+
+def can_refine(keyword):
+    # % 在 LIKE 中是通配符，这类关键词不能按子串关系推导；
+    # 使用搜索语法的关键词也不缓存，dm:today 这样的条件结果会随时间变化
+    return bool(keyword) and '%' not in keyword and is_plain_query(keyword)
+
+
+@lru_cache(maxsize=65536)
+def row_keys(filename):
+    """文件名的搜索键，和建立索引时写入 name_keys 的相同；纯 ASCII 文件名没有键，返回 ()"""
+    keys = make_keys(filename)
+    return tuple(key for key in keys if key) if keys else ()
+
+
+def row_matches(row, lowered, folded, keys):
+    """缓存的一行是否匹配关键词：文件名包含它，或者 keys 为 True 时它的某个搜索键包含它"""
+    filename = row[1]
+    if lowered in filename.lower():
+        return True
+    return keys and any(folded in key for key in row_keys(filename))
+
+
+class CacheStats:
+    def __init__(self):
+        self.exact_hits = 0
+        self.refined_hits = 0
+        self.misses = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+
+    @property
+    def lookups(self):
+        return self.exact_hits + self.refined_hits + self.misses
+
+    @property
+    def hit_rate(self):
+        return (self.exact_hits + self.refined_hits) / self.lookups if self.lookups else 0.0
+
+    @property
+    def avg_hit_ms(self):
+        hits = self.exact_hits + self.refined_hits
+        return self.hit_seconds * 1000 / hits if hits else 0.0
+
+    @property
+    def avg_miss_ms(self):
+        return self.miss_seconds * 1000 / self.misses if self.misses else 0.0
+
+    def __str__(self):
+        return (f"命中率 {self.hit_rate:.0%} (精确 {self.exact_hits}, 过滤 {self.refined_hits}, 未命中 {self.misses}), "
+                f"命中平均 {self.avg_hit_ms:.2f}ms, 未命中平均 {self.avg_miss_ms:.2f}ms")
+
+
+class SearchCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_rows=200000):
+        self.max_bytes = max_bytes
+        # 结果超过这个行数就不缓存，避免一个很短的关键词占满缓存
+        self.max_entry_rows = max_entry_rows
+        self.stats = CacheStats()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def clear(self, db_path=None):
+        """清空缓存，指定 db_path 时只清除该数据库的结果"""
+        with self._lock:
+            for key in list(self._entries):
+                if db_path is None or key[0] == db_path:
+                    self._remove_locked(key)
+
+    def _remove_locked(self, key):
+        _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def lookup(self, db_path, keyword):
+        """返回 (结果行, 是否需要过滤)，没有可用的缓存时返回 None"""
+        if not can_refine(keyword):
+            return None
+        with self._lock:
+            key = (db_path, keyword)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0], False
+
+            # 找包含在新关键词中、结果最少的缓存项作为候选集
+            best = None
+            needle = keyword.lower()
+            for (cached_db, cached_keyword), (rows, _) in self._entries.items():
+                if cached_db != db_path or cached_keyword.lower() not in needle:
+                    continue
+                if best is None or len(rows) < len(best[1]):
+                    best = ((cached_db, cached_keyword), rows)
+            if best is None:
+                return None
+            self._entries.move_to_end(best[0])
+            return best[1], True
+
+    def search(self, db_path, keyword, keys=False):
+        """从缓存中得到完整结果，必要时过滤更短关键词的结果；无法命中时返回 None
+
+        keys 为 True 表示数据库有搜索键，过滤时文件名或搜索键包含关键词的行都保留。
+        """
+        begin = time.perf_counter()
+        found = self.lookup(db_path, keyword)
+        if found is None:
+            return None
+
+        rows, refine = found
+        if refine:
+            lowered, folded = keyword.lower(), keyword.casefold()
+            rows = [row for row in rows if row_matches(row, lowered, folded, keys)]
+            self.put(db_path, keyword, rows)
+        elapsed = time.perf_counter() - begin
+        with self._lock:
+            if refine:
+                self.stats.refined_hits += 1
+            else:
+                self.stats.exact_hits += 1
+            self.stats.hit_seconds += elapsed
+        return rows
+
+    def record_miss(self, seconds):
+        with self._lock:
+            self.stats.misses += 1
+            self.stats.miss_seconds += seconds
+
+    def put(self, db_path, keyword, rows):
+        """缓存一个关键词的完整结果"""
+        if not can_refine(keyword) or len(rows) > self.max_entry_rows:
+            return
+        size = sum(estimate_row_bytes(row) for row in rows) + 100
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            key = (db_path, keyword)
+            if key in self._entries:
+                self._remove_locked(key)
+            self._entries[key] = (rows, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove_locked(next(iter(self._entries)))
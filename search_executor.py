@@ -0,0 +1,422 @@
+"""后台搜索执行器
+
+搜索在独立线程中使用自己的只读连接执行，不阻塞界面：
+- 按键先防抖，停止输入 debounce 秒后才真正查询
+- 新的按键会通过 sqlite3 的 interrupt() 中断正在执行的旧查询
+- 每次提交都有递增的代号，过期代号的结果直接丢弃，不会送到界面
+
+一次搜索先返回第一页，随后在空闲时统计总匹配数；界面滚动到底部时再通过
+fetch_more() 请求后续页面，所有数据库和文件名索引的访问都在搜索线程中进行。
+有文件名索引时，第一页之后还会在空闲时做近似匹配（见 fuzzy.py），通过 on_fuzzy 单独送出。
+
+结果不太多时，空闲时会把完整结果读入 SearchCache，之后加长关键词的搜索
+直接在内存中过滤，分页也从内存中取。
+
+索引进行中可以把搜索指向正在写入的临时数据库（live=True），这时结果随时在变化，
+不使用缓存。set_snapshots() 切换到联合搜索，同时查询多个快照（见 federated.py）。
+
+每项任务的耗时记入 metrics（见 metrics.py），最近的查询连同使用的查询方式保存在
+recent_queries 中；指定 metrics_log 时，stop() 把它们作为一行追加到该文件。
+"""
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from federated import FederatedSearch
+from index_db import open_readonly, remove_database
+from metrics import Metrics
+from name_index import NameIndex
+from name_keys import has_name_keys
+from search import search_page, count_matches, fuzzy_search, PAGE_SIZE
+from search_cache import SearchCache
+
+SEARCH = 'search'
+PAGE = 'page'
+FUZZY = 'fuzzy'
+COUNT = 'count'
+FILL = 'fill'
+MEMORY = 'memory'
+
+# recent_queries 保存的查询数
+QUERY_LOG_SIZE = 200
+
+
+class SearchExecutor:
+    def __init__(self, on_results, on_count=None, debounce=0.15, page_size=PAGE_SIZE, cache=None,
+                 on_fuzzy=None, metrics_log=None):
+        # 以下回调都在搜索线程中调用：
+        # on_results(generation, keyword, rows, next_after, append)
+        # on_count(generation, total)
+        # on_fuzzy(generation, rows)  rows 按相似度排列
+        self.on_results = on_results
+        self.on_count = on_count
+        self.on_fuzzy = on_fuzzy
+        self.debounce = debounce
+        self.page_size = page_size
+        self.cache = cache if cache is not None else SearchCache()
+        self.metrics = Metrics('search')
+        self.metrics_log = metrics_log
+        # 最近的查询 {keyword, task, plan, ms, rows}，最新的在最后
+        self.recent_queries = deque(maxlen=QUERY_LOG_SIZE)
+        self._trace = {}
+
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._keyword = ''
+        self._pending = None
+        self._due = 0.0
+        self._page_after = None
+        self._count_pending = False
+        self._fuzzy_pending = False
+        self._fill_pending = False
+        self._running = None
+        self._stop = False
+
+        self._db_path = None
+        self._use_name_index = True
+        self._db_live = False
+        self._discard = None
+        self._snapshots = None
+        self._db_version = 0
+        self._opened_version = 0
+        # invalidate_cache 每次加一，填充缓存期间发生变化时丢弃读到的旧结果
+        self._cache_version = 0
+
+        self._conn = None
+        self._name_index = None
+        self._opened_path = None
+        # 数据库有拼音搜索键时，缓存过滤也要匹配文件名的搜索键
+        self._name_keys = False
+        self._federated = None
+        # 打开的数据库是否仍在写入
+        self._live = False
+        # 当前搜索的完整结果（来自缓存或联合搜索）：(代号, 结果行)
+        self._memory = None
+        self._thread = threading.Thread(target=self._run, name='SearchExecutor', daemon=True)
+        self._thread.start()
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def set_database(self, db_path, use_name_index=True, live=False, discard=None):
+        """切换搜索使用的数据库，搜索线程会尽快重新打开连接和文件名索引
+
+        live 表示数据库仍在写入（例如索引用的临时数据库），不缓存结果。
+        discard 是切换后不再需要的数据库，搜索线程关闭旧连接后把它删除。
+        """
+        with self._cond:
+            self._db_path = db_path
+            self._use_name_index = use_name_index
+            self._db_live = live
+            self._snapshots = None
+            if discard:
+                self._discard = discard
+            self._db_version += 1
+            self._interrupt_locked()
+            self._cond.notify()
+
+    def set_snapshots(self, db_paths):
+        """联合搜索多个快照数据库，结果按路径去重，较新的快照优先"""
+        with self._cond:
+            self._db_path = None
+            self._db_live = False
+            self._snapshots = list(db_paths)
+            self._db_version += 1
+            self._interrupt_locked()
+            self._cond.notify()
+
+    def submit(self, keyword):
+        """提交一次搜索，返回本次搜索的代号"""
+        with self._cond:
+            self._generation += 1
+            self._keyword = keyword
+            self._pending = self._generation
+            self._due = time.monotonic() + self.debounce
+            self._page_after = None
+            self._count_pending = False
+            self._fuzzy_pending = False
+            self._fill_pending = False
+            self._interrupt_locked()
+            self._cond.notify()
+            return self._generation
+
+    def fetch_more(self, generation, after):
+        """请求当前搜索的下一页"""
+        with self._cond:
+            if generation != self._generation or after is None:
+                return
+            self._page_after = after
+            # 近似匹配、统计总数和填充缓存可能很慢，先让路给翻页，之后会重新执行
+            if self._running in (FUZZY, COUNT, FILL):
+                self._interrupt_locked()
+            self._cond.notify()
+
+    def invalidate_cache(self):
+        """数据库内容变化后（例如实时监控应用了变化）清除缓存的结果"""
+        with self._cond:
+            self._cache_version += 1
+            self.cache.clear()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._interrupt_locked()
+            self._cond.notify()
+        self._thread.join()
+        if self.metrics_log and self.metrics.counters:
+            self.metrics.dump(self.metrics_log, queries=list(self.recent_queries))
+
+    def _interrupt_locked(self):
+        # interrupt() 可以在其他线程调用，没有正在执行的语句时不会产生任何影响
+        if self._running is None:
+            return
+        if self._conn is not None:
+            self._conn.interrupt()
+        if self._federated is not None:
+            self._federated.interrupt()
+
+    def _close_database(self):
+        if self._name_index is not None:
+            self._name_index.close()
+            self._name_index = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._federated is not None:
+            self._federated.close()
+            self._federated = None
+        self._opened_path = None
+        self._memory = None
+
+    def _open_database(self, db_path, use_name_index, live, snapshots, discard):
+        self._close_database()
+        if discard and discard != db_path:
+            try:
+                remove_database(discard)
+            except OSError as e:
+                print(f"无法删除数据库 {discard}: {e}")
+        self._live = live
+        if snapshots:
+            self._federated = FederatedSearch(snapshots)
+            return
+        if not db_path:
+            return
+        self._name_keys = False
+        try:
+            self._conn = open_readonly(db_path, check_same_thread=False)
+            # 连接时并不读取文件，不是数据库或已损坏的文件在第一次查询时才报错
+            self._name_keys = has_name_keys(self._conn)
+        except sqlite3.Error as e:
+            print(f"搜索线程无法打开数据库 {db_path}: {e}")
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            return
+        self._opened_path = db_path
+        # 重新打开通常意味着数据库刚被更新过（例如增量索引完成）
+        self.cache.clear(db_path)
+        if use_name_index:
+            self._name_index = NameIndex.open(db_path)
+
+    def _next_task(self, opened_version):
+        """等待下一项工作，按 重新打开数据库 > 新搜索 > 翻页 > 近似匹配 > 统计总数 > 填充缓存 的优先级返回"""
+        with self._cond:
+            while True:
+                if self._stop:
+                    return None
+                if self._db_version != opened_version:
+                    discard, self._discard = self._discard, None
+                    return ('reopen', self._db_version,
+                            (self._db_path, self._use_name_index, self._db_live, self._snapshots), discard)
+
+                timeout = None
+                if self._pending is not None:
+                    now = time.monotonic()
+                    if now >= self._due:
+                        self._pending = None
+                        self._count_pending = True
+                        self._fuzzy_pending = self.on_fuzzy is not None
+                        self._running = SEARCH
+                        return SEARCH, self._generation, self._keyword, None
+                    timeout = self._due - now
+                elif self._page_after is not None:
+                    after, self._page_after = self._page_after, None
+                    self._running = PAGE
+                    return PAGE, self._generation, self._keyword, after
+                elif self._fuzzy_pending:
+                    self._fuzzy_pending = False
+                    self._running = FUZZY
+                    return FUZZY, self._generation, self._keyword, None
+                elif self._count_pending:
+                    self._count_pending = False
+                    self._running = COUNT
+                    return COUNT, self._generation, self._keyword, None
+                elif self._fill_pending:
+                    self._fill_pending = False
+                    self._running = FILL
+                    return FILL, self._generation, self._keyword, None
+                self._cond.wait(timeout)
+
+    def _memory_page(self, generation, start):
+        rows = self._memory[1] if self._memory and self._memory[0] == generation else []
+        end = start + self.page_size
+        return rows[start:end], (MEMORY, end) if end < len(rows) else None
+
+    def _search(self, generation, keyword):
+        """第一页：优先从缓存得到完整结果，否则查询数据库"""
+        begin = time.perf_counter()
+        if self._federated is not None:
+            rows = self._federated.search(keyword)
+        elif self._live:
+            rows = None
+        else:
+            rows = self.cache.search(self._opened_path, keyword, keys=self._name_keys)
+        if rows is not None:
+            self._trace['plan'] = 'federated' if self._federated is not None else 'cache'
+            # 完整结果已知，不需要再统计总数
+            self._memory = (generation, rows)
+            with self._cond:
+                self._count_pending = False
+            return self._memory_page(generation, 0)
+
+        self._memory = None
+        result = search_page(self._conn, keyword, None, self.page_size, self._name_index, self._trace)
+        if not self._live:
+            self.cache.record_miss(time.perf_counter() - begin)
+        return result
+
+    def _fill_cache(self, keyword):
+        """读出完整结果放入缓存，供后续加长的关键词过滤"""
+        with self._cond:
+            version = self._cache_version
+        rows = []
+        after = None
+        while True:
+            page, after = search_page(self._conn, keyword, after, 4096, self._name_index)
+            rows.extend(page)
+            if after is None or len(rows) > self.cache.max_entry_rows:
+                break
+        if after is None:
+            with self._cond:
+                # 读取期间缓存被清除过，读到的可能是变化前的结果
+                if version == self._cache_version:
+                    self.cache.put(self._opened_path, keyword, rows)
+
+    def _fuzzy_stopped(self, generation):
+        # 近似匹配在 Python 中分批扫描，interrupt() 打断不了，由扫描在批次之间检查
+        return (self._stop or generation != self._generation
+                or self._page_after is not None or self._db_version != self._opened_version)
+
+    def _execute(self, kind, generation, keyword, after):
+        if kind == SEARCH:
+            return self._search(generation, keyword)
+        if kind == FUZZY:
+            return fuzzy_search(self._conn, self._name_index, keyword,
+                                should_stop=lambda: self._fuzzy_stopped(generation))
+        if kind == COUNT:
+            return count_matches(self._conn, keyword, self._name_index)
+        if kind == FILL:
+            return self._fill_cache(keyword)
+        if after[0] == MEMORY:
+            self._trace['plan'] = MEMORY
+            return self._memory_page(generation, after[1])
+        return search_page(self._conn, keyword, after, self.page_size, self._name_index, self._trace)
+
+    def _record(self, kind, keyword, elapsed, result, interrupted):
+        """记录一项任务的耗时和查询方式"""
+        if interrupted:
+            self.metrics.count('interrupted')
+            return
+        self.metrics.observe(f"query.{kind}", elapsed)
+        self.metrics.count('queries' if kind == SEARCH else kind)
+        if kind == FILL or result is None:
+            return
+        if kind == COUNT:
+            rows = result
+        elif kind == FUZZY:
+            rows = len(result)
+        else:
+            rows = len(result[0])
+        self.recent_queries.append({
+            'keyword': keyword,
+            'task': kind,
+            'plan': self._trace.get('plan', kind),
+            'ms': round(elapsed * 1000, 3),
+            'rows': rows,
+        })
+
+    def _run(self):
+        opened_version = 0
+        try:
+            while True:
+                task = self._next_task(opened_version)
+                if task is None:
+                    return
+                if task[0] == 'reopen':
+                    _, opened_version, (db_path, use_name_index, live, snapshots), discard = task
+                    self._opened_version = opened_version
+                    try:
+                        self._open_database(db_path, use_name_index, live, snapshots, discard)
+                    except (sqlite3.Error, OSError, ValueError) as e:
+                        # 快照或名称索引损坏时放弃这个数据库，搜索线程继续等待下一次切换
+                        print(f"搜索线程无法打开数据库 {db_path}: {e}")
+                        self._close_database()
+                    continue
+
+                kind, generation, keyword, after = task
+                result = None
+                interrupted = False
+                self._trace = {}
+                begin = time.perf_counter()
+                try:
+                    if not keyword:
+                        result = 0 if kind == COUNT else [] if kind == FUZZY else ([], None)
+                    elif self._conn is not None or self._federated is not None:
+                        result = self._execute(kind, generation, keyword, after)
+                except InterruptedError:
+                    interrupted = True
+                    # 被翻页打断的近似匹配稍后重新执行
+                    with self._cond:
+                        if generation == self._generation and not self._stop:
+                            self._fuzzy_pending = True
+                except sqlite3.OperationalError as e:
+                    interrupted = 'interrupted' in str(e)
+                    if not interrupted:
+                        print(f"搜索出错: {e}")
+                    elif kind in (COUNT, FILL):
+                        # 被翻页打断的统计或填充稍后重新执行
+                        with self._cond:
+                            if generation == self._generation:
+                                if kind == COUNT:
+                                    self._count_pending = True
+                                else:
+                                    self._fill_pending = True
+                except (sqlite3.Error, OSError, ValueError) as e:
+                    # 数据库被替换或损坏、名称索引读取失败：报告后继续处理后面的搜索
+                    print(f"搜索出错: {e}")
+                finally:
+                    with self._cond:
+                        self._running = None
+                if keyword:
+                    self._record(kind, keyword, time.perf_counter() - begin, result, interrupted)
+
+                # 已经有更新的搜索提交时丢弃过期结果
+                if result is None or generation != self._generation or kind == FILL:
+                    continue
+                if kind == FUZZY:
+                    self.on_fuzzy(generation, result)
+                elif kind == COUNT:
+                    if self.on_count:
+                        self.on_count(generation, result)
+                    if result <= self.cache.max_entry_rows and not self._live:
+                        with self._cond:
+                            self._fill_pending = generation == self._generation
+                else:
+                    rows, next_after = result
+                    self.on_results(generation, keyword, rows, next_after, kind == PAGE)
+                    if kind == SEARCH and self.on_count and self._memory and self._memory[0] == generation:
+                        self.on_count(generation, len(self._memory[1]))
+        finally:
+            self._close_database()
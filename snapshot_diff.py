@@ -0,0 +1,253 @@
+"""比较两个快照数据库
+
+两个数据库通过 ATTACH 挂到同一个临时连接上，全部比较都在 SQLite 里完成，
+Python 这边只逐行取出有变化的记录，不会把任何一边读进内存：
+
+1. 分别用递归查询算出两边每个目录的完整路径，写入临时表并按路径建索引，
+   得到旧目录编号到新目录编号的对应表 dir_map
+2. 按目录汇总两边的文件数、大小之和以及修改时间之和、最小值和最大值。目录自身的
+   修改时间和这些汇总值都相同的目录视为没有变化，不再逐个文件比较
+   （在目录中增删或改名文件会改变目录的修改时间，修改文件内容会改变文件的修改时间）
+3. 其余目录中的旧文件通过 dir_map 和新快照的 (dir_id, filename) 唯一索引找到对应的
+   新记录：找不到是删除，大小不同是大小变化，修改时间不同是修改
+4. 其余目录中找不到旧记录的新文件是新增
+
+第 2 步只是根据元数据做出的判断，exact=True 时跳过它，逐个比较所有文件。
+临时表写在临时数据库文件中而不是内存里，几百万行的快照也不会占用大量内存。
+只比较文件；整个目录被删除或新增时，其中的每个文件都会作为删除或新增出现。
+
+运行 `python snapshot_diff.py [--exact] 旧.db 新.db [输出.csv]` 可以直接比较并导出。
+"""
+import csv
+import os
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from index_db import format_mtime, SCHEMA_VERSION
+
+ADDED = 'added'
+REMOVED = 'removed'
+RESIZED = 'resized'
+MODIFIED = 'modified'
+
+KIND_LABELS = {
+    ADDED: '新增',
+    REMOVED: '删除',
+    RESIZED: '大小变化',
+    MODIFIED: '已修改',
+}
+
+DiffEntry = namedtuple('DiffEntry', ['kind', 'path', 'old_size', 'new_size', 'old_mtime', 'new_mtime'])
+
+DIR_PATHS_SQL = """
+    CREATE TEMP TABLE {side}_paths AS
+    WITH RECURSIVE tree(id, path) AS (
+        SELECT id, name FROM {side}.dirs WHERE parent_id IS NULL
+        UNION ALL
+        -- 与 os.path.join 一致：根目录本身以分隔符结尾（例如 C:\\）时不再添加分隔符
+        SELECT d.id, CASE WHEN substr(tree.path, -1) = :sep THEN tree.path ELSE tree.path || :sep END || d.name
+        FROM {side}.dirs d JOIN tree ON d.parent_id = tree.id
+    )
+    SELECT id, path FROM tree
+"""
+
+# 每个目录的文件汇总，用来跳过没有变化的目录
+DIR_SUMMARY_SQL = """
+    CREATE TEMP TABLE {side}_summary AS
+    SELECT dir_id, count(*) AS files, sum(size) AS total_size,
+           sum(mtime) AS mtime_sum, min(mtime) AS min_mtime, max(mtime) AS max_mtime
+    FROM {side}.files GROUP BY dir_id
+"""
+
+UNCHANGED_DIRS_SQL = """
+    CREATE TEMP TABLE unchanged_dirs AS
+    SELECT m.old_id, m.new_id
+    FROM temp.dir_map m
+    JOIN old.dirs od ON od.id = m.old_id
+    JOIN new.dirs nd ON nd.id = m.new_id
+    JOIN temp.old_summary os ON os.dir_id = m.old_id
+    JOIN temp.new_summary ns ON ns.dir_id = m.new_id
+    WHERE od.mtime_ns = nd.mtime_ns
+      AND os.files = ns.files AND os.total_size IS ns.total_size
+      AND os.mtime_sum IS ns.mtime_sum AND os.min_mtime IS ns.min_mtime AND os.max_mtime IS ns.max_mtime
+"""
+
+# 需要逐个文件比较的目录，对应目录不存在时另一边的编号为 NULL
+CHANGED_DIRS_SQL = """
+    CREATE TEMP TABLE {side}_changed AS
+    SELECT p.id AS dir_id, m.{other}_id AS other_id, p.path
+    FROM temp.{side}_paths p
+    LEFT JOIN temp.dir_map m ON m.{side}_id = p.id
+    WHERE p.id NOT IN (SELECT {side}_id FROM temp.unchanged_dirs)
+"""
+
+# 旧快照中的每个文件找新快照中的对应记录，只返回删除和有变化的。
+# CROSS JOIN 固定从待比较的目录出发，按目录编号在 files 的索引上取文件
+OLD_SIDE_SQL = """
+    SELECT c.path, fo.filename, fo.size, fo.mtime, fn.id, fn.size, fn.mtime
+    FROM temp.old_changed c
+    CROSS JOIN old.files fo ON fo.dir_id = c.dir_id
+    LEFT JOIN new.files fn ON fn.dir_id = c.other_id AND fn.filename = fo.filename
+    WHERE fn.id IS NULL OR fn.size IS NOT fo.size OR fn.mtime IS NOT fo.mtime
+"""
+
+# 新快照中找不到旧记录的文件
+NEW_SIDE_SQL = """
+    SELECT c.path, fn.filename, fn.size, fn.mtime
+    FROM temp.new_changed c
+    CROSS JOIN new.files fn ON fn.dir_id = c.dir_id
+    WHERE NOT EXISTS (
+        SELECT 1 FROM old.files fo WHERE fo.dir_id = c.other_id AND fo.filename = fn.filename
+    )
+"""
+
+
+class DiffStats:
+    """一次比较的统计"""
+
+    def __init__(self):
+        self.counts = {kind: 0 for kind in KIND_LABELS}
+        # 需要逐个文件比较的旧目录数
+        self.checked_dirs = 0
+        self.elapsed = 0.0
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def __str__(self):
+        parts = ', '.join(f"{KIND_LABELS[kind]} {count}" for kind, count in self.counts.items())
+        return f"{parts}, 逐个比较了 {self.checked_dirs} 个目录, 耗时 {self.elapsed:.2f} 秒"
+
+
+def _attach(conn, db_path, alias):
+    uri = Path(os.path.abspath(db_path)).as_uri() + '?mode=ro'
+    conn.execute(f"ATTACH DATABASE ? AS {alias}", (uri,))
+    version = conn.execute(f"PRAGMA {alias}.user_version").fetchone()[0]
+    if version != SCHEMA_VERSION:
+        raise ValueError(f"数据库是旧格式，请先升级数据库格式: {db_path}")
+
+
+def _build_dir_map(conn):
+    for side in ('old', 'new'):
+        conn.execute(DIR_PATHS_SQL.format(side=side), {'sep': os.sep})
+        conn.execute(f"CREATE INDEX temp.idx_{side}_paths_path ON {side}_paths(path)")
+    conn.execute("""
+        CREATE TEMP TABLE dir_map AS
+        SELECT o.id AS old_id, n.id AS new_id
+        FROM temp.old_paths o JOIN temp.new_paths n ON n.path = o.path
+    """)
+    conn.execute("CREATE UNIQUE INDEX temp.idx_dir_map_old ON dir_map(old_id)")
+    conn.execute("CREATE UNIQUE INDEX temp.idx_dir_map_new ON dir_map(new_id)")
+
+
+def _find_changed_dirs(conn, exact):
+    """生成 old_changed 和 new_changed 两张待比较目录表"""
+    if exact:
+        conn.execute("CREATE TEMP TABLE unchanged_dirs (old_id INTEGER, new_id INTEGER)")
+    else:
+        for side in ('old', 'new'):
+            conn.execute(DIR_SUMMARY_SQL.format(side=side))
+            conn.execute(f"CREATE UNIQUE INDEX temp.idx_{side}_summary ON {side}_summary(dir_id)")
+        conn.execute(UNCHANGED_DIRS_SQL)
+    conn.execute(CHANGED_DIRS_SQL.format(side='old', other='new'))
+    conn.execute(CHANGED_DIRS_SQL.format(side='new', other='old'))
+
+
+def diff_snapshots(old_db, new_db, stats=None, should_stop=None, chunk_size=5000, exact=False):
+    """逐个返回两个快照之间有变化的文件 DiffEntry
+
+    先返回删除和变化的记录，再返回新增的记录。stats 不为 None 时累计各类变化的数量，
+    exact 为 True 时不跳过汇总值相同的目录。
+    """
+    stats = stats if stats is not None else DiffStats()
+    begin = time.perf_counter()
+    # 空文件名表示临时数据库，临时表超过缓存后写到磁盘而不是占用内存
+    conn = sqlite3.connect('')
+    try:
+        _attach(conn, old_db, 'old')
+        _attach(conn, new_db, 'new')
+        _build_dir_map(conn)
+        _find_changed_dirs(conn, exact)
+        stats.checked_dirs = conn.execute("SELECT count(*) FROM temp.old_changed").fetchone()[0]
+
+        cursor = conn.execute(OLD_SIDE_SQL)
+        while True:
+            if should_stop and should_stop():
+                raise InterruptedError("比较已被用户终止")
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for dir_path, filename, old_size, old_mtime, new_id, new_size, new_mtime in rows:
+                if new_id is None:
+                    kind = REMOVED
+                elif new_size != old_size:
+                    kind = RESIZED
+                else:
+                    kind = MODIFIED
+                stats.counts[kind] += 1
+                yield DiffEntry(kind, os.path.join(dir_path, filename), old_size, new_size, old_mtime, new_mtime)
+
+        cursor = conn.execute(NEW_SIDE_SQL)
+        while True:
+            if should_stop and should_stop():
+                raise InterruptedError("比较已被用户终止")
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for dir_path, filename, size, mtime in rows:
+                stats.counts[ADDED] += 1
+                yield DiffEntry(ADDED, os.path.join(dir_path, filename), None, size, None, mtime)
+    finally:
+        conn.close()
+        stats.elapsed = time.perf_counter() - begin
+
+
+CSV_HEADERS = ['变化', '路径', '旧大小', '新大小', '旧修改时间', '新修改时间']
+
+
+def diff_row(entry):
+    """把 DiffEntry 转换为显示和导出用的一行文字"""
+    return [
+        KIND_LABELS[entry.kind],
+        entry.path,
+        '' if entry.old_size is None else entry.old_size,
+        '' if entry.new_size is None else entry.new_size,
+        '' if entry.old_mtime is None else format_mtime(entry.old_mtime),
+        '' if entry.new_mtime is None else format_mtime(entry.new_mtime),
+    ]
+
+
+def export_diff(entries, out_path):
+    """把比较结果逐行写入 CSV（带 BOM，Excel 可以直接打开），返回写入的行数"""
+    count = 0
+    with open(out_path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADERS)
+        for entry in entries:
+            writer.writerow(diff_row(entry))
+            count += 1
+    return count
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    exact = '--exact' in args
+    if exact:
+        args.remove('--exact')
+    if len(args) < 2:
+        print("用法: python snapshot_diff.py [--exact] 旧.db 新.db [输出.csv]")
+        sys.exit(1)
+
+    result = DiffStats()
+    changes = diff_snapshots(args[0], args[1], result, exact=exact)
+    if len(args) > 2:
+        written = export_diff(changes, args[2])
+        print(f"已导出 {written} 条变化到 {args[2]}")
+    else:
+        for change in changes:
+            print(f"{KIND_LABELS[change.kind]}\t{change.path}")
+    print(result)
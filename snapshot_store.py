@@ -0,0 +1,423 @@
+"""快照库：一个完整的基准数据库加上每次索引的差异
+
+定期索引时数据库目录下会积累大量几乎相同的 {时间}_*.db。快照库把它们收进数据库目录下的
+snapshot_store 子目录：
+- base_{快照名}  最新一个快照的完整数据库（基准）
+- catalog.sqlite 快照目录和每个较早快照的差异
+
+差异是反向的：加入新快照时，用 snapshot_diff 的目录对应和逐目录比较算出"从新快照回到
+上一个基准"需要的改动（新快照中新增的文件和目录要删除，删除和变化的要恢复成原来的大小、
+修改时间），记在上一个基准名下，然后新快照成为基准。最新的快照不需要任何还原，较早的
+快照从基准开始依次套用差异得到。差异中的目录路径只保存一次（delta_paths）。
+
+checkout() 在数据库目录下按原来的文件名还原出一个普通的快照数据库（带全文索引、目录大小
+汇总、搜索键和 .names 文件名索引），选择数据库、联合搜索和命令行都可以直接打开。
+
+compact() 按保留策略删除较早的快照：被删除快照的差异合并到比它更早的快照上，同一个路径
+以更早快照的记录为准，合并后仍然能还原出每一个保留的快照。
+"""
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+from dir_sizes import refresh_rollups
+from engine import build_sidecar
+from federated import list_snapshots, snapshot_time
+from index_db import DirPaths, delete_subtree, publish_database, remove_database, UPSERT_FILE_SQL
+from name_index import sidecar_path
+from name_keys import update_name_keys
+from snapshot_diff import _attach, _build_dir_map, _find_changed_dirs
+
+STORE_DIR = 'snapshot_store'
+CATALOG_NAME = 'catalog.sqlite'
+BASE_PREFIX = 'base_'
+# 默认保留最近几个快照，以及最近多少天里每天的最后一个快照
+KEEP_LAST = 7
+KEEP_DAILY = 30
+# 还原快照时每次从差异中取出的行数
+APPLY_CHUNK = 10000
+
+CATALOG_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS snapshots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        created REAL NOT NULL,
+        files INTEGER NOT NULL,
+        total_size INTEGER NOT NULL
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS delta_paths (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE)",
+    # removed 为 1 表示在这个快照中不存在，否则恢复成记录的值
+    """
+    CREATE TABLE IF NOT EXISTS delta_dirs (
+        snapshot_id INTEGER NOT NULL,
+        path_id INTEGER NOT NULL,
+        mtime_ns INTEGER,
+        removed INTEGER NOT NULL,
+        PRIMARY KEY (snapshot_id, path_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS delta_files (
+        snapshot_id INTEGER NOT NULL,
+        path_id INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        size INTEGER,
+        mtime INTEGER,
+        removed INTEGER NOT NULL,
+        PRIMARY KEY (snapshot_id, path_id, filename)
+    ) WITHOUT ROWID
+    """,
+]
+
+# 从新快照回到旧快照的目录改动：旧快照独有的目录和修改时间不同的目录恢复旧值，新快照独有的删除
+DIR_DELTA_SQL = """
+    CREATE TEMP TABLE dir_delta AS
+    SELECT o.path, od.mtime_ns, 0 AS removed
+    FROM temp.old_paths o
+    JOIN old.dirs od ON od.id = o.id
+    LEFT JOIN temp.dir_map m ON m.old_id = o.id
+    LEFT JOIN new.dirs nd ON nd.id = m.new_id
+    WHERE m.new_id IS NULL OR nd.mtime_ns IS NOT od.mtime_ns
+    UNION ALL
+    SELECT n.path, NULL, 1
+    FROM temp.new_paths n
+    WHERE n.id NOT IN (SELECT new_id FROM temp.dir_map)
+"""
+
+# 文件改动，条件与 snapshot_diff 的 OLD_SIDE_SQL、NEW_SIDE_SQL 相同
+FILE_DELTA_SQL = """
+    CREATE TEMP TABLE file_delta AS
+    SELECT c.path, fo.filename, fo.size, fo.mtime, 0 AS removed
+    FROM temp.old_changed c
+    CROSS JOIN old.files fo ON fo.dir_id = c.dir_id
+    LEFT JOIN new.files fn ON fn.dir_id = c.other_id AND fn.filename = fo.filename
+    WHERE fn.id IS NULL OR fn.size IS NOT fo.size OR fn.mtime IS NOT fo.mtime
+    UNION ALL
+    SELECT c.path, fn.filename, NULL, NULL, 1
+    FROM temp.new_changed c
+    CROSS JOIN new.files fn ON fn.dir_id = c.dir_id
+    WHERE NOT EXISTS (
+        SELECT 1 FROM old.files fo WHERE fo.dir_id = c.other_id AND fo.filename = fn.filename
+    )
+"""
+
+SAVE_DELTA_SQL = [
+    "INSERT OR IGNORE INTO store.delta_paths (path) SELECT path FROM temp.dir_delta",
+    "INSERT OR IGNORE INTO store.delta_paths (path) SELECT path FROM temp.file_delta",
+    """
+    INSERT INTO store.delta_dirs (snapshot_id, path_id, mtime_ns, removed)
+    SELECT :id, p.id, d.mtime_ns, d.removed FROM temp.dir_delta d JOIN store.delta_paths p ON p.path = d.path
+    """,
+    """
+    INSERT INTO store.delta_files (snapshot_id, path_id, filename, size, mtime, removed)
+    SELECT :id, p.id, d.filename, d.size, d.mtime, d.removed
+    FROM temp.file_delta d JOIN store.delta_paths p ON p.path = d.path
+    """,
+]
+
+# 删除快照时把它的差异合并到更早的快照，两边都有的路径保留更早快照的记录
+MERGE_DELTA_SQL = [
+    """
+    INSERT INTO delta_dirs (snapshot_id, path_id, mtime_ns, removed)
+    SELECT :older, path_id, mtime_ns, removed FROM delta_dirs d
+    WHERE d.snapshot_id = :dropped AND NOT EXISTS (
+        SELECT 1 FROM delta_dirs x WHERE x.snapshot_id = :older AND x.path_id = d.path_id
+    )
+    """,
+    """
+    INSERT INTO delta_files (snapshot_id, path_id, filename, size, mtime, removed)
+    SELECT :older, path_id, filename, size, mtime, removed FROM delta_files d
+    WHERE d.snapshot_id = :dropped AND NOT EXISTS (
+        SELECT 1 FROM delta_files x WHERE x.snapshot_id = :older AND x.path_id = d.path_id AND x.filename = d.filename
+    )
+    """,
+]
+
+StoredSnapshot = namedtuple('StoredSnapshot', ['id', 'name', 'created', 'files', 'total_size', 'delta_rows'])
+
+
+class SnapshotStore:
+    """数据库目录下的快照库，每个操作使用自己的连接"""
+
+    def __init__(self, db_folder):
+        self.db_folder = db_folder
+        self.store_dir = os.path.join(db_folder, STORE_DIR)
+        self.catalog_path = os.path.join(self.store_dir, CATALOG_NAME)
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._connect().close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.catalog_path, timeout=30)
+        for sql in CATALOG_SQL:
+            conn.execute(sql)
+        conn.commit()
+        return conn
+
+    def base_path(self, name):
+        """快照作为基准时的数据库文件"""
+        return os.path.join(self.store_dir, BASE_PREFIX + name)
+
+    def snapshots(self):
+        """库中的所有快照，最新的（基准）在前"""
+        conn = self._connect()
+        try:
+            rows = conn.execute("""
+                SELECT s.id, s.name, s.created, s.files, s.total_size,
+                       (SELECT count(*) FROM delta_files f WHERE f.snapshot_id = s.id)
+                       + (SELECT count(*) FROM delta_dirs d WHERE d.snapshot_id = s.id)
+                FROM snapshots s ORDER BY s.created DESC, s.id DESC
+            """).fetchall()
+        finally:
+            conn.close()
+        return [StoredSnapshot(*row) for row in rows]
+
+    def find(self, key):
+        """按编号或名称找快照，找不到时返回 None"""
+        key = str(key)
+        for snapshot in self.snapshots():
+            if str(snapshot.id) == key or snapshot.name == key or snapshot.name == key + '.db':
+                return snapshot
+        return None
+
+    def _remove_stale_bases(self, keep_name):
+        # 中途失败或已经被新快照替换的基准文件
+        for entry in os.scandir(self.store_dir):
+            if entry.name.startswith(BASE_PREFIX) and entry.name != BASE_PREFIX + keep_name:
+                remove_database(entry.path)
+
+    def add(self, db_path, keep_source=False, exact=False):
+        """把一个快照数据库加入快照库，返回 StoredSnapshot
+
+        快照必须比库中最新的快照更新。keep_source 为 False 时加入后删除原来的数据库和 .names 文件；
+        exact 的含义与 snapshot_diff.diff_snapshots 相同。
+        """
+        if not os.path.isfile(db_path):
+            raise ValueError(f"数据库不存在: {db_path}")
+        name = os.path.basename(db_path)
+        created = snapshot_time(db_path)
+        snapshots = self.snapshots()
+        base = snapshots[0] if snapshots else None
+        if any(snapshot.name == name for snapshot in snapshots):
+            raise ValueError(f"快照库中已经有 {name}")
+        if base is not None and created <= base.created:
+            raise ValueError(f"{name} 不比快照库中最新的快照 {base.name} 新，快照只能按时间顺序加入")
+
+        # 空文件名表示临时数据库，差异先算进临时表，之后一次写入快照库
+        conn = sqlite3.connect('')
+        target = self.base_path(name)
+        try:
+            _attach(conn, db_path, 'new')
+            files, total_size = conn.execute("SELECT count(*), coalesce(sum(size), 0) FROM new.files").fetchone()
+            if base is not None:
+                _attach(conn, self.base_path(base.name), 'old')
+                _build_dir_map(conn)
+                _find_changed_dirs(conn, exact)
+                conn.execute(DIR_DELTA_SQL)
+                conn.execute(FILE_DELTA_SQL)
+                conn.execute("DETACH DATABASE old")
+            conn.execute("DETACH DATABASE new")
+
+            # 先写好新的基准，再在一个事务中记下差异和快照
+            publish_database(db_path, target)
+            conn.execute("ATTACH DATABASE ? AS store", (self.catalog_path,))
+            try:
+                if base is not None:
+                    for sql in SAVE_DELTA_SQL:
+                        conn.execute(sql, {'id': base.id})
+                cursor = conn.execute(
+                    "INSERT INTO store.snapshots (name, created, files, total_size) VALUES (?, ?, ?, ?)",
+                    (name, created, files, total_size)
+                )
+                snapshot_id = cursor.lastrowid
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                remove_database(target)
+                raise
+        finally:
+            conn.close()
+
+        self._remove_stale_bases(name)
+        if not keep_source:
+            remove_database(db_path)
+            try:
+                os.remove(sidecar_path(db_path))
+            except FileNotFoundError:
+                pass
+        return StoredSnapshot(snapshot_id, name, created, files, total_size, 0)
+
+    def import_folder(self, keep=(), on_progress=None):
+        """按时间顺序把数据库目录下的快照加入快照库，返回加入的快照数
+
+        keep 中的数据库（例如正在使用的数据库）加入后保留原文件。已经在库中或者比库中最新的
+        快照更早的数据库跳过。
+        """
+        keep = {os.path.abspath(path) for path in keep}
+        stored = {snapshot.name for snapshot in self.snapshots()}
+        added = 0
+        for db_path in reversed(list_snapshots(self.db_folder)):
+            name = os.path.basename(db_path)
+            if name in stored:
+                continue
+            try:
+                self.add(db_path, keep_source=os.path.abspath(db_path) in keep)
+            except (ValueError, sqlite3.Error) as e:
+                print(f"跳过 {name}: {e}")
+                continue
+            added += 1
+            if on_progress:
+                on_progress(f"已加入快照库: {name}")
+        return added
+
+    def checkout(self, key, out_path=None, on_progress=None):
+        """还原快照，返回数据库路径
+
+        out_path 默认为数据库目录下快照原来的文件名，文件已经存在时直接返回。
+        """
+        snapshot = self.find(key)
+        if snapshot is None:
+            raise ValueError(f"快照库中没有 {key}")
+        out_path = out_path or os.path.join(self.db_folder, snapshot.name)
+        if os.path.exists(out_path):
+            return out_path
+
+        snapshots = self.snapshots()
+        base = snapshots[0]
+        # 从基准往回依次套用的差异：比目标新、又不是基准的快照，再加上目标本身
+        steps = [s for s in snapshots if s.created >= snapshot.created and s.id != base.id]
+        begin = time.perf_counter()
+        work_path = out_path + '.partial'
+        remove_database(work_path)
+        publish_database(self.base_path(base.name), work_path)
+        conn = sqlite3.connect(work_path)
+        try:
+            uri = Path(os.path.abspath(self.catalog_path)).as_uri() + '?mode=ro'
+            conn.execute("ATTACH DATABASE ? AS store", (uri,))
+            paths = DirPaths(conn)
+            for step in steps:
+                if on_progress:
+                    on_progress(f"正在还原快照 {step.name}...")
+                _apply_delta(conn, paths, step.id)
+            refresh_rollups(conn)
+            update_name_keys(conn)
+            conn.commit()
+            conn.execute("DETACH DATABASE store")
+        finally:
+            conn.close()
+        os.replace(work_path, out_path)
+        build_sidecar(out_path)
+        print(f"已还原快照 {snapshot.name}，套用了 {len(steps)} 个差异，耗时 {time.perf_counter() - begin:.2f} 秒")
+        return out_path
+
+    def compact(self, keep_last=KEEP_LAST, keep_daily=KEEP_DAILY):
+        """按保留策略删除较早的快照并整理快照库，返回删除的快照数
+
+        保留最新的 keep_last 个快照，以及最近 keep_daily 个有快照的日期中每天的最后一个快照。
+        """
+        snapshots = self.snapshots()
+        keep = {snapshot.id for snapshot in snapshots[:max(keep_last, 1)]}
+        days = []
+        for snapshot in snapshots:
+            day = datetime.fromtimestamp(snapshot.created).date()
+            if day not in days and len(days) < keep_daily:
+                days.append(day)
+                keep.add(snapshot.id)
+
+        conn = self._connect()
+        try:
+            dropped = 0
+            # 从新到旧依次删除，差异合并到删除时紧挨着的更早快照
+            remaining = list(snapshots)
+            for snapshot in snapshots:
+                if snapshot.id in keep:
+                    continue
+                position = remaining.index(snapshot)
+                older = remaining[position + 1] if position + 1 < len(remaining) else None
+                if older is not None:
+                    for sql in MERGE_DELTA_SQL:
+                        conn.execute(sql, {'older': older.id, 'dropped': snapshot.id})
+                conn.execute("DELETE FROM delta_dirs WHERE snapshot_id = ?", (snapshot.id,))
+                conn.execute("DELETE FROM delta_files WHERE snapshot_id = ?", (snapshot.id,))
+                conn.execute("DELETE FROM snapshots WHERE id = ?", (snapshot.id,))
+                remaining.remove(snapshot)
+                dropped += 1
+            conn.execute("""
+                DELETE FROM delta_paths WHERE id NOT IN (SELECT path_id FROM delta_dirs)
+                AND id NOT IN (SELECT path_id FROM delta_files)
+            """)
+            conn.commit()
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        if snapshots:
+            self._remove_stale_bases(snapshots[0].name)
+        return dropped
+
+    def store_bytes(self):
+        """快照库占用的磁盘空间"""
+        return sum(entry.stat().st_size for entry in os.scandir(self.store_dir) if entry.is_file())
+
+
+def _ensure_dir(conn, paths, path, mtime_ns=None):
+    """目录编号，数据库中没有时插入；父目录不在数据库中的目录作为扫描的根目录"""
+    dir_id = paths.lookup(path)
+    if dir_id is not None:
+        return dir_id
+    parent, name = os.path.split(path)
+    parent_id = paths.lookup(parent) if name and parent != path else None
+    if parent_id is None:
+        cursor = conn.execute("INSERT INTO dirs (parent_id, name, mtime_ns) VALUES (NULL, ?, ?)", (path, mtime_ns))
+    else:
+        cursor = conn.execute("INSERT INTO dirs (parent_id, name, mtime_ns) VALUES (?, ?, ?)",
+                              (parent_id, name, mtime_ns))
+    paths.remember(path, cursor.lastrowid)
+    return cursor.lastrowid
+
+
+def _apply_delta(conn, paths, snapshot_id):
+    """在数据库上套用一个快照的差异：先恢复目录，再改文件，最后删除目录"""
+    # 父目录的路径总是排在子目录前面
+    rows = conn.execute(
+        "SELECT p.path, d.mtime_ns FROM store.delta_dirs d JOIN store.delta_paths p ON p.id = d.path_id "
+        "WHERE d.snapshot_id = ? AND d.removed = 0 ORDER BY p.path", (snapshot_id,)
+    ).fetchall()
+    for path, mtime_ns in rows:
+        dir_id = _ensure_dir(conn, paths, path, mtime_ns)
+        conn.execute("UPDATE dirs SET mtime_ns = ? WHERE id = ?", (mtime_ns, dir_id))
+
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT p.path, f.filename, f.size, f.mtime, f.removed "
+        "FROM store.delta_files f JOIN store.delta_paths p ON p.id = f.path_id "
+        "WHERE f.snapshot_id = ? ORDER BY f.path_id", (snapshot_id,)
+    )
+    while True:
+        rows = cursor.fetchmany(APPLY_CHUNK)
+        if not rows:
+            break
+        upserts = []
+        deletes = []
+        for path, filename, size, mtime, removed in rows:
+            if removed:
+                dir_id = paths.lookup(path)
+                if dir_id is not None:
+                    deletes.append((dir_id, filename))
+            else:
+                upserts.append((_ensure_dir(conn, paths, path), filename, size, mtime))
+        conn.executemany("DELETE FROM files WHERE dir_id = ? AND filename = ?", deletes)
+        conn.executemany(UPSERT_FILE_SQL, upserts)
+
+    rows = conn.execute(
+        "SELECT p.path FROM store.delta_dirs d JOIN store.delta_paths p ON p.id = d.path_id "
+        "WHERE d.snapshot_id = ? AND d.removed = 1 ORDER BY p.path", (snapshot_id,)
+    ).fetchall()
+    for (path,) in rows:
+        dir_id = paths.lookup(path)
+        if dir_id is not None:
+            delete_subtree(conn, dir_id)
+            paths.forget(path)
@@ -0,0 +1,52 @@
+"""命令行冷启动：--help 要足够快，不能加载图形界面、pywin32 和引擎模块"""
+import json
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(ROOT, 'cli.py')
+
+# python cli.py --help 的耗时上限（秒），包括解释器本身的启动时间
+STARTUP_BUDGET = 1.0
+RUNS = 3
+
+FORBIDDEN_MODULES = ('PyQt6', 'win32file', 'win32con', 'winerror', 'win32api', 'pywintypes',
+                     'main', 'engine', 'search', 'scanner', 'index_db')
+
+# 在子进程中执行 cli.main(['--help'])，输出之后 sys.modules 中出现的禁止模块
+PROBE = f"""
+import json, sys
+sys.path.insert(0, {ROOT!r})
+import cli
+try:
+    cli.main(['--help'])
+except SystemExit:
+    pass
+loaded = [name for name in {FORBIDDEN_MODULES!r} if name in sys.modules]
+sys.stdout.write('\\n' + json.dumps(loaded))
+"""
+
+
+class CliStartupTest(unittest.TestCase):
+    def test_help_within_budget(self):
+        elapsed = []
+        for _ in range(RUNS):
+            begin = time.perf_counter()
+            result = subprocess.run([sys.executable, CLI, '--help'], capture_output=True, cwd=ROOT)
+            elapsed.append(time.perf_counter() - begin)
+            self.assertEqual(result.returncode, 0, result.stderr.decode('utf-8', 'replace'))
+        # 取最快的一次，避免机器偶尔繁忙造成误报
+        self.assertLess(min(elapsed), STARTUP_BUDGET, f"--help 耗时 {min(elapsed):.3f} 秒")
+
+    def test_help_does_not_import_gui_or_platform_modules(self):
+        result = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, cwd=ROOT)
+        self.assertEqual(result.returncode, 0, result.stderr.decode('utf-8', 'replace'))
+        loaded = json.loads(result.stdout.decode('utf-8').rsplit('\n', 1)[-1])
+        self.assertEqual(loaded, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
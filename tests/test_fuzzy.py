@@ -0,0 +1,86 @@
+"""近似匹配：子序列和容错匹配，容错的合并正则与逐个写法匹配的结果一致"""
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fuzzy import TYPO_MAX_GAP, fuzzy_matches, subsequence_pattern, typo_patterns, _units
+from index_db import create_tables, INSERT_FILE_SQL
+from name_index import build_name_index, NameIndex
+
+NAMES = ['report.docx', 'quarterly_report.pdf', 'reprot_final.txt', 'rport.md', 'readme.txt',
+         'budget_2024.xlsx', 'photo.jpg', '项目报告.docx']
+
+
+def compact_match(pattern, length, line):
+    match = pattern.search(line)
+    return match is not None and match.end() - match.start() <= length + TYPO_MAX_GAP
+
+
+class TypoPatternsTest(unittest.TestCase):
+    def test_matches_every_compact_variant(self):
+        # 某个去掉一个字符的写法在一行中有足够紧凑的命中时，合并的正则一定能挑出这一行
+        rng = random.Random(3)
+        for _ in range(300):
+            keyword = ''.join(rng.choice('abcé报') for _ in range(rng.randint(4, 7)))
+            units = _units(keyword)
+            variants = []
+            for i in range(len(units)):
+                variant = units[:i] + units[i + 1:]
+                variants.append((subsequence_pattern(variant, TYPO_MAX_GAP), len(b''.join(variant))))
+            patterns = typo_patterns(units, TYPO_MAX_GAP)
+            for _ in range(30):
+                line = ''.join(rng.choice('abcé报x') for _ in range(rng.randint(0, 12))).encode()
+                if any(compact_match(pattern, length, line) for pattern, length in variants):
+                    self.assertTrue(any(pattern.search(line) for pattern in patterns), (keyword, line))
+
+
+class FuzzyMatchesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temp = tempfile.mkdtemp()
+        db_path = os.path.join(cls.temp, 'fuzzy.db')
+        conn = sqlite3.connect(db_path)
+        create_tables(conn)
+        conn.executemany(INSERT_FILE_SQL, [(1, name, 0, 0) for name in NAMES])
+        conn.commit()
+        build_name_index(conn, db_path)
+        conn.close()
+        cls.index = NameIndex.open(db_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.index.close()
+        shutil.rmtree(cls.temp, ignore_errors=True)
+
+    def names(self, keyword, **kwargs):
+        return [NAMES[line] for _, line in fuzzy_matches(self.index, keyword, **kwargs)]
+
+    def test_subsequence(self):
+        self.assertIn('report.docx', self.names('rprt'))
+
+    def test_exact_matches_are_excluded(self):
+        self.assertNotIn('report.docx', self.names('report'))
+
+    def test_typo(self):
+        found = self.names('repotr')
+        self.assertIn('report.docx', found)
+        self.assertIn('quarterly_report.pdf', found)
+        self.assertNotIn('report.docx', self.names('repotr', typos=False))
+
+    def test_short_keyword(self):
+        self.assertEqual(self.names('rp'), [])
+
+    def test_cancel(self):
+        with self.assertRaises(InterruptedError):
+            fuzzy_matches(self.index, 'repotr', should_stop=lambda: True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""增量索引：在临时目录树上修改后同步，数据库与磁盘一致"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import scanner
+from engine import full_index
+from incremental import IncrementalIndexer
+
+
+def touch(path, content=''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def bump_mtime(path):
+    """目录修改时间加一秒，避免同一时间粒度内的修改被当作没有变化"""
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+
+
+class IncrementalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp = tempfile.mkdtemp()
+        self.tree = os.path.join(self.temp, 'tree')
+        touch(os.path.join(self.tree, 'a.txt'))
+        touch(os.path.join(self.tree, 'sub', 'b.txt'))
+        touch(os.path.join(self.tree, 'sub', 'deep', 'c.txt'))
+        db_folder = os.path.join(self.temp, 'db')
+        os.makedirs(db_folder)
+        self.db_path, _ = full_index([self.tree], db_folder, 'inc')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp, ignore_errors=True)
+
+    def names(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return sorted(row[0] for row in conn.execute("SELECT filename FROM files"))
+        finally:
+            conn.close()
+
+    def update(self):
+        return IncrementalIndexer(self.db_path).run()
+
+
+class SyncTest(IncrementalTestCase):
+    def test_unchanged_tree_is_skipped(self):
+        stats = self.update()
+        self.assertEqual((stats.upserted, stats.deleted, stats.dirs_listed), (0, 0, 0))
+        self.assertEqual(self.names(), ['a.txt', 'b.txt', 'c.txt'])
+
+    def test_added_file(self):
+        touch(os.path.join(self.tree, 'sub', 'new.txt'))
+        bump_mtime(os.path.join(self.tree, 'sub'))
+        stats = self.update()
+        self.assertEqual((stats.upserted, stats.deleted), (1, 0))
+        self.assertEqual(self.names(), ['a.txt', 'b.txt', 'c.txt', 'new.txt'])
+
+    def test_deleted_file(self):
+        os.remove(os.path.join(self.tree, 'sub', 'b.txt'))
+        bump_mtime(os.path.join(self.tree, 'sub'))
+        stats = self.update()
+        self.assertEqual((stats.upserted, stats.deleted), (0, 1))
+        self.assertEqual(self.names(), ['a.txt', 'c.txt'])
+
+    def test_added_directory(self):
+        touch(os.path.join(self.tree, 'sub', 'more', 'd.txt'))
+        touch(os.path.join(self.tree, 'sub', 'more', 'inner', 'e.txt'))
+        bump_mtime(os.path.join(self.tree, 'sub'))
+        stats = self.update()
+        self.assertEqual(stats.upserted, 2)
+        self.assertEqual(self.names(), ['a.txt', 'b.txt', 'c.txt', 'd.txt', 'e.txt'])
+
+    def test_deleted_directory(self):
+        shutil.rmtree(os.path.join(self.tree, 'sub', 'deep'))
+        bump_mtime(os.path.join(self.tree, 'sub'))
+        stats = self.update()
+        self.assertEqual(stats.deleted, 1)
+        self.assertEqual(self.names(), ['a.txt', 'b.txt'])
+        conn = sqlite3.connect(self.db_path)
+        try:
+            self.assertIsNone(conn.execute("SELECT 1 FROM dirs WHERE name = 'deep'").fetchone())
+        finally:
+            conn.close()
+
+    def test_renamed_file(self):
+        os.rename(os.path.join(self.tree, 'a.txt'), os.path.join(self.tree, 'z.txt'))
+        bump_mtime(self.tree)
+        stats = self.update()
+        self.assertEqual((stats.upserted, stats.deleted), (1, 1))
+        self.assertEqual(self.names(), ['b.txt', 'c.txt', 'z.txt'])
+
+    def test_changed_file_in_changed_dir_is_updated(self):
+        touch(os.path.join(self.tree, 'sub', 'b.txt'), 'longer content')
+        touch(os.path.join(self.tree, 'sub', 'new.txt'))
+        bump_mtime(os.path.join(self.tree, 'sub'))
+        stats = self.update()
+        self.assertEqual(stats.upserted, 2)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            size = conn.execute("SELECT size FROM files WHERE filename = 'b.txt'").fetchone()[0]
+        finally:
+            conn.close()
+        self.assertEqual(size, len('longer content'))
+
+
+class UnreadableDirTest(IncrementalTestCase):
+    def test_unlisted_dir_keeps_rows_and_is_retried(self):
+        sub = os.path.join(self.tree, 'sub')
+        touch(os.path.join(sub, 'new.txt'))
+        bump_mtime(sub)
+        real_scandir = os.scandir
+
+        def failing_scandir(path):
+            if path == sub:
+                raise PermissionError(13, 'Permission denied', path)
+            return real_scandir(path)
+
+        with mock.patch.object(scanner.os, 'scandir', failing_scandir):
+            stats = self.update()
+        self.assertEqual(stats.dirs_failed, 1)
+        self.assertEqual(stats.deleted, 0)
+        self.assertEqual(self.names(), ['a.txt', 'b.txt', 'c.txt'])
+
+        # 修改时间没有记下，恢复之后重新列出这个目录
+        stats = self.update()
+        self.assertEqual(stats.dirs_failed, 0)
+        self.assertEqual(self.names(), ['a.txt', 'b.txt', 'c.txt', 'new.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+"""搜索语法：解析、大小和日期单位，以及查询计划选择驱动条件"""
+import os
+import sqlite3
+import sys
+import unittest
+from datetime import datetime
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import query
+from index_db import create_tables, create_indexes, register_functions, regexp, INSERT_FILE_SQL
+from query import And, Or, Not, Term, QueryError, KB, MB, GB, parse_query, parse_date_range, is_plain_query, plan_query
+from search import build_fts_index, search_page
+
+# 2024-03-15 是星期五
+NOW = datetime(2024, 3, 15, 12, 30)
+
+
+def ts(*args):
+    return int(datetime(*args).timestamp())
+
+
+def name(text):
+    return Term('name', text)
+
+
+class ParserTest(unittest.TestCase):
+    def test_bar_binds_tighter_than_space(self):
+        self.assertEqual(parse_query('ext:log error | warn !debug'),
+                         And((Term('ext', ('log',)), Or((name('error'), name('warn'))), Not(name('debug')))))
+
+    def test_word_operators(self):
+        self.assertEqual(parse_query('a OR b AND NOT c'), And((Or((name('a'), name('b'))), Not(name('c')))))
+
+    def test_parentheses_group(self):
+        self.assertEqual(parse_query('(a b) | c'), Or((And((name('a'), name('b'))), name('c'))))
+        self.assertEqual(parse_query('!(a | b)'), Not(Or((name('a'), name('b')))))
+
+    def test_not_binds_to_one_term(self):
+        self.assertEqual(parse_query('!a b'), And((Not(name('a')), name('b'))))
+
+    def test_unbalanced_parentheses(self):
+        for text in ('(a', 'a)', '()', 'a |', '!'):
+            with self.subTest(text=text):
+                self.assertRaises(QueryError, parse_query, text)
+
+    def test_quotes_keep_spaces_and_symbols(self):
+        self.assertEqual(parse_query('"my file"'), name('my file'))
+        self.assertEqual(parse_query('"a|b" c'), And((name('a|b'), name('c'))))
+        self.assertEqual(parse_query('path:"C:\\Program Files"'), Term('path', 'C:\\Program Files'))
+
+    def test_quoted_operator_word_is_text(self):
+        self.assertEqual(parse_query('"AND"'), name('AND'))
+        self.assertEqual(parse_query('"OR" | x'), Or((name('OR'), name('x'))))
+
+    def test_unclosed_quote(self):
+        self.assertRaises(QueryError, parse_query, '"my file')
+
+    def test_wildcards(self):
+        self.assertEqual(parse_query('*.txt'), Term('wildcard', '*.txt'))
+        self.assertEqual(parse_query('log_??.txt'), Term('wildcard', 'log_??.txt'))
+
+    def test_regex_reads_to_whitespace(self):
+        self.assertEqual(parse_query('regex:^(a|b)\\d+$ x'), And((Term('regex', '^(a|b)\\d+$'), name('x'))))
+        self.assertRaises(QueryError, parse_query, 'regex:(')
+
+    def test_ext_list(self):
+        self.assertEqual(parse_query('ext:.TXT;log,md'), Term('ext', ('txt', 'log', 'md')))
+        self.assertRaises(QueryError, parse_query, 'ext:;')
+
+    def test_unknown_field_is_name(self):
+        self.assertEqual(parse_query('foo:bar'), name('foo:bar'))
+
+    def test_missing_value(self):
+        for text in ('ext:', 'size:', 'dm:', 'path:', 'regex:'):
+            with self.subTest(text=text):
+                self.assertRaises(QueryError, parse_query, text)
+
+    def test_is_plain_query(self):
+        self.assertTrue(is_plain_query('report'))
+        # 输入到一半的条件按普通子串处理
+        self.assertTrue(is_plain_query('size:>'))
+        self.assertTrue(is_plain_query('"half'))
+        self.assertFalse(is_plain_query('a b'))
+        self.assertFalse(is_plain_query('ext:txt'))
+        self.assertFalse(is_plain_query('*.txt'))
+
+
+class SizeTest(unittest.TestCase):
+    def size(self, text):
+        return parse_query(f'size:{text}').value
+
+    def test_units(self):
+        self.assertEqual(self.size('100'), (100, 101))
+        self.assertEqual(self.size('2k'), (2 * KB, 2 * KB + 1))
+        self.assertEqual(self.size('1.5KB'), (1536, 1537))
+        self.assertEqual(self.size('3mb'), (3 * MB, 3 * MB + 1))
+        self.assertEqual(self.size('2g'), (2 * GB, 2 * GB + 1))
+        self.assertEqual(self.size('1tb'), (1024 * GB, 1024 * GB + 1))
+
+    def test_comparisons(self):
+        self.assertEqual(self.size('>1mb'), (MB + 1, None))
+        self.assertEqual(self.size('>=1mb'), (MB, None))
+        self.assertEqual(self.size('<1mb'), (None, MB))
+        self.assertEqual(self.size('<=1mb'), (None, MB + 1))
+        self.assertEqual(self.size('=1mb'), (MB, MB + 1))
+
+    def test_ranges(self):
+        self.assertEqual(self.size('1mb..10mb'), (MB, 10 * MB + 1))
+        self.assertEqual(self.size('..1kb'), (None, KB + 1))
+        self.assertEqual(self.size('1kb..'), (KB, None))
+
+    def test_named_sizes(self):
+        self.assertEqual(self.size('empty'), (0, 1))
+        self.assertEqual(self.size('Large'), (MB, 16 * MB))
+        self.assertEqual(self.size('gigantic'), (128 * MB, None))
+
+    def test_invalid(self):
+        self.assertRaises(QueryError, parse_query, 'size:>abc')
+        self.assertRaises(QueryError, parse_query, 'size:10xb')
+
+
+class DateTest(unittest.TestCase):
+    def dm(self, text):
+        return parse_date_range(text, NOW)
+
+    def test_relative(self):
+        self.assertEqual(self.dm('today'), (ts(2024, 3, 15), ts(2024, 3, 16)))
+        self.assertEqual(self.dm('yesterday'), (ts(2024, 3, 14), ts(2024, 3, 15)))
+        self.assertEqual(self.dm('thisweek'), (ts(2024, 3, 11), ts(2024, 3, 18)))
+        self.assertEqual(self.dm('lastweek'), (ts(2024, 3, 4), ts(2024, 3, 11)))
+        self.assertEqual(self.dm('thismonth'), (ts(2024, 3, 1), ts(2024, 4, 1)))
+        self.assertEqual(self.dm('lastmonth'), (ts(2024, 2, 1), ts(2024, 3, 1)))
+        self.assertEqual(self.dm('thisyear'), (ts(2024, 1, 1), ts(2025, 1, 1)))
+        self.assertEqual(self.dm('lastyear'), (ts(2023, 1, 1), ts(2024, 1, 1)))
+
+    def test_month_boundaries_wrap_years(self):
+        january = datetime(2024, 1, 20)
+        self.assertEqual(parse_date_range('lastmonth', january), (ts(2023, 12, 1), ts(2024, 1, 1)))
+        december = datetime(2023, 12, 5)
+        self.assertEqual(parse_date_range('thismonth', december), (ts(2023, 12, 1), ts(2024, 1, 1)))
+
+    def test_absolute_periods(self):
+        self.assertEqual(self.dm('2024-03-01'), (ts(2024, 3, 1), ts(2024, 3, 2)))
+        self.assertEqual(self.dm('2024/03/01'), (ts(2024, 3, 1), ts(2024, 3, 2)))
+        self.assertEqual(self.dm('2024-02'), (ts(2024, 2, 1), ts(2024, 3, 1)))
+        self.assertEqual(self.dm('2023'), (ts(2023, 1, 1), ts(2024, 1, 1)))
+
+    def test_comparisons_and_ranges(self):
+        self.assertEqual(self.dm('>2024-03'), (ts(2024, 4, 1), None))
+        self.assertEqual(self.dm('>=2024-03'), (ts(2024, 3, 1), None))
+        self.assertEqual(self.dm('<2024'), (None, ts(2024, 1, 1)))
+        self.assertEqual(self.dm('2023-12..2024-01'), (ts(2023, 12, 1), ts(2024, 2, 1)))
+        self.assertEqual(self.dm('..yesterday'), (None, ts(2024, 3, 15)))
+
+    def test_invalid(self):
+        self.assertRaises(QueryError, self.dm, 'someday')
+        self.assertRaises(QueryError, self.dm, '2024-13')
+
+
+class PlannerTest(unittest.TestCase):
+    """在内存数据库上检查查询计划和结果"""
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        create_tables(self.conn)
+        register_functions(self.conn)
+        root = os.path.join(os.sep, 'data')
+        self.conn.execute("INSERT INTO dirs (id, parent_id, name) VALUES (1, NULL, ?)", (root,))
+        self.conn.execute("INSERT INTO dirs (id, parent_id, name) VALUES (2, 1, 'docs')")
+        self.conn.execute("INSERT INTO dirs (id, parent_id, name) VALUES (3, 1, 'logs')")
+        rows = [(2, f'note_{i}.txt', i * KB, ts(2024, 1, 1)) for i in range(300)]
+        rows += [(3, f'app_{i}.log', 10, ts(2024, 3, 15, 9)) for i in range(5)]
+        rows += [(3, 'error.log', 10, ts(2024, 3, 1)), (3, 'warn.log', 10, ts(2024, 3, 1)),
+                 (3, 'debug_error.log', 10, ts(2024, 3, 1))]
+        self.conn.executemany(INSERT_FILE_SQL, rows)
+        create_indexes(self.conn)
+        self.assertTrue(build_fts_index(self.conn))
+        self.regex_calls = 0
+
+        def counting_regexp(pattern, value):
+            self.regex_calls += 1
+            return regexp(pattern, value)
+
+        self.conn.create_function('regexp', 2, counting_regexp, deterministic=True)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def names(self, keyword):
+        rows, after = [], None
+        while True:
+            page, after = search_page(self.conn, keyword, after, 100)
+            rows.extend(page)
+            if after is None:
+                return sorted(row[1] for row in rows)
+
+    def test_precedence_results(self):
+        self.assertEqual(self.names('ext:log error | warn !debug'), ['error.log', 'warn.log'])
+
+    def test_wildcard_results(self):
+        self.assertEqual(self.names('app_?.log'), [f'app_{i}.log' for i in range(5)])
+
+    def test_path_results(self):
+        self.assertEqual(len(self.names('path:logs')), 8)
+        self.assertEqual(self.names(f"path:{os.path.join(os.sep, 'data', 'lo')} debug"), ['debug_error.log'])
+
+    def test_size_and_date_results(self):
+        self.assertEqual(self.names('size:>=298kb ext:txt'), ['note_298.txt', 'note_299.txt'])
+        with mock.patch.object(query, 'datetime') as fake:
+            fake.now.return_value = NOW
+            fake.strptime = datetime.strptime
+            self.assertEqual(self.names('dm:today'), [f'app_{i}.log' for i in range(5)])
+
+    def test_smallest_candidate_set_drives(self):
+        plan = plan_query(self.conn, 'ext:log note', use_fts=True)
+        self.assertEqual(plan.strategy, 'candidates')
+        # ext:log 只有 8 行，比 note 的 300 行少，由它驱动，note 只做过滤
+        self.assertTrue(plan.where.startswith("f.id IN (SELECT f.id FROM files f WHERE"))
+        self.assertIn('idx', ''.join(str(row) for row in self.conn.execute(
+            f"EXPLAIN QUERY PLAN SELECT f.id FROM {plan.source} WHERE {plan.where}", plan.params)))
+
+    def test_regex_runs_only_on_candidates(self):
+        plan = plan_query(self.conn, 'ext:log regex:^app_[0-2]', use_fts=True)
+        self.assertEqual(plan.strategy, 'candidates')
+        self.assertLess(plan.where.index('IN'), plan.where.index('REGEXP'))
+        self.assertEqual(self.names('ext:log regex:^app_[0-2]'), ['app_0.log', 'app_1.log', 'app_2.log'])
+        # 正则只在 ext:log 选出的 8 个候选上执行，而不是全部 308 行
+        self.assertGreater(self.regex_calls, 0)
+        self.assertLessEqual(self.regex_calls, 8)
+
+    def test_regex_after_fts_scan(self):
+        # 候选都很多时沿全文索引扫描，正则仍然只作用在全文索引命中的行上
+        with mock.patch.object(query, 'MATERIALIZE_LIMIT', 10):
+            plan = plan_query(self.conn, 'note regex:_1\\d$', use_fts=True)
+            self.assertEqual(plan.strategy, 'fts')
+            self.assertTrue(plan.where.startswith('files_fts MATCH ?'))
+            self.assertEqual(self.names('note regex:_1\\d\\.txt$'), [f'note_1{i}.txt' for i in range(10)])
+        self.assertLessEqual(self.regex_calls, 300)
+
+    def test_regex_alone_is_left_to_sqlite(self):
+        plan = plan_query(self.conn, 'regex:^warn', use_fts=True)
+        self.assertEqual(plan.strategy, 'sqlite')
+        self.assertEqual(self.names('regex:^warn'), ['warn.log'])
+
+
+if __name__ == '__main__':
+    unittest.main()
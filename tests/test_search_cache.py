@@ -0,0 +1,152 @@
+"""搜索结果缓存：逐步加长的关键词在内存中过滤已缓存的结果"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from engine import full_index
+from index_db import open_readonly
+from name_keys import has_name_keys
+from search import search_page
+from search_cache import SearchCache
+
+FILES = ['report.txt', 'Reports.md', 'repo.zip', 'prepare.py', 'readme.txt', 'Straße.txt', 'Stradivari.txt']
+
+
+def all_rows(conn, keyword):
+    rows, after = [], None
+    while True:
+        page, after = search_page(conn, keyword, after, 4096)
+        rows.extend(page)
+        if after is None:
+            return sorted(rows)
+
+
+class RefineWithNameKeysTest(unittest.TestCase):
+    """数据库有 name_keys 搜索键时，缓存仍然能过滤出更长关键词的结果"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp = tempfile.mkdtemp()
+        tree = os.path.join(cls.temp, 'tree')
+        os.makedirs(tree)
+        for name in FILES:
+            open(os.path.join(tree, name), 'w').close()
+        db_folder = os.path.join(cls.temp, 'db')
+        os.makedirs(db_folder)
+        cls.db_path, _ = full_index([tree], db_folder, 'cache')
+        cls.conn = open_readonly(cls.db_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+        shutil.rmtree(cls.temp, ignore_errors=True)
+
+    def test_database_has_name_keys(self):
+        self.assertTrue(has_name_keys(self.conn))
+
+    def test_rep_to_repo_is_refined_hit(self):
+        cache = SearchCache()
+        cache.put(self.db_path, 'rep', all_rows(self.conn, 'rep'))
+        rows = cache.search(self.db_path, 'repo', keys=True)
+        self.assertIsNotNone(rows)
+        self.assertEqual(cache.stats.refined_hits, 1)
+        self.assertEqual(sorted(rows), all_rows(self.conn, 'repo'))
+
+    def test_refine_keeps_rows_matched_by_folded_key(self):
+        # strasse 只能靠大小写折叠后的搜索键 strasse.txt 匹配到 Straße.txt
+        cache = SearchCache()
+        cache.put(self.db_path, 'stra', all_rows(self.conn, 'stra'))
+        rows = cache.search(self.db_path, 'strasse', keys=True)
+        self.assertEqual(cache.stats.refined_hits, 1)
+        self.assertEqual([row[1] for row in rows], ['Straße.txt'])
+        self.assertEqual(sorted(rows), all_rows(self.conn, 'strasse'))
+
+
+def row(filename):
+    return (f'/data/{filename}', filename, 0, 0)
+
+
+ENTRY_BYTES = 200 + 2 * len(row('a')[0] + 'a') + 100
+
+
+class SearchCacheTest(unittest.TestCase):
+    def test_exact_hit(self):
+        cache = SearchCache()
+        rows = [row('report.txt')]
+        cache.put('a.db', 'rep', rows)
+        self.assertEqual(cache.search('a.db', 'rep'), rows)
+        self.assertEqual((cache.stats.exact_hits, cache.stats.refined_hits), (1, 0))
+
+    def test_refine_filters_case_insensitively_and_caches_result(self):
+        cache = SearchCache()
+        cache.put('a.db', 'rep', [row('Report.txt'), row('prepare.py'), row('REPO.zip')])
+        self.assertEqual(cache.search('a.db', 'repo'), [row('Report.txt'), row('REPO.zip')])
+        self.assertEqual(cache.stats.refined_hits, 1)
+        # 过滤的结果也放进缓存，再输入同一个关键词时精确命中
+        self.assertEqual(cache.search('a.db', 'repo'), [row('Report.txt'), row('REPO.zip')])
+        self.assertEqual(cache.stats.exact_hits, 1)
+
+    def test_refine_uses_smallest_containing_entry(self):
+        cache = SearchCache()
+        small = [row('report.txt')]
+        cache.put('a.db', 'r', [row('report.txt'), row('readme.md'), row('rust.rs')])
+        cache.put('a.db', 'port', small)
+        self.assertIs(cache.lookup('a.db', 'report')[0], small)
+
+    def test_miss_on_other_database_or_unrelated_keyword(self):
+        cache = SearchCache()
+        cache.put('a.db', 'rep', [row('report.txt')])
+        self.assertIsNone(cache.search('b.db', 'repo'))
+        self.assertIsNone(cache.search('a.db', 'doc'))
+        self.assertIsNone(cache.search('a.db', 're'))
+
+    def test_syntax_and_like_wildcards_are_not_cached(self):
+        cache = SearchCache()
+        for keyword in ('ext:txt', 'a b', '*.txt', '50%'):
+            with self.subTest(keyword=keyword):
+                cache.put('a.db', keyword, [row('x.txt')])
+                self.assertIsNone(cache.search('a.db', keyword))
+        self.assertEqual(cache.size_bytes, 0)
+
+    def test_oversized_results_are_not_cached(self):
+        cache = SearchCache(max_entry_rows=2)
+        cache.put('a.db', 'a', [row('a1'), row('a2'), row('a3')])
+        self.assertIsNone(cache.search('a.db', 'a'))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = SearchCache(max_bytes=2 * ENTRY_BYTES)
+        cache.put('a.db', 'x', [row('a')])
+        cache.put('a.db', 'y', [row('b')])
+        self.assertEqual(cache.size_bytes, 2 * ENTRY_BYTES)
+        # 访问 x 之后 y 最久没有使用，放入 z 时淘汰 y
+        self.assertIsNotNone(cache.search('a.db', 'x'))
+        cache.put('a.db', 'z', [row('c')])
+        self.assertIsNone(cache.search('a.db', 'y'))
+        self.assertIsNotNone(cache.search('a.db', 'x'))
+        self.assertIsNotNone(cache.search('a.db', 'z'))
+        self.assertEqual(cache.size_bytes, 2 * ENTRY_BYTES)
+
+    def test_replacing_entry_keeps_size_accounting(self):
+        cache = SearchCache()
+        cache.put('a.db', 'x', [row('a')])
+        cache.put('a.db', 'x', [row('a')])
+        self.assertEqual(cache.size_bytes, ENTRY_BYTES)
+
+    def test_clear_one_database(self):
+        cache = SearchCache()
+        cache.put('a.db', 'x', [row('a')])
+        cache.put('b.db', 'x', [row('a')])
+        cache.clear('a.db')
+        self.assertIsNone(cache.search('a.db', 'x'))
+        self.assertIsNotNone(cache.search('b.db', 'x'))
+        cache.clear()
+        self.assertEqual(cache.size_bytes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+"""后台索引的限速
+
+在繁忙的工作站或文件服务器上全速索引会占满磁盘，拖慢机器上的其他程序。后台模式下
+扫描线程每列完一个目录调用一次 Throttle.pace()：
+- 按文件/秒的上限排队等待，所有扫描线程共用一个节拍，总速率不超过上限
+- 记录每个目录的列目录耗时（按目录项数折算），与扫描以来的最低水平比较，明显变慢
+  说明磁盘正被其他程序使用，速率减半；恢复后逐步加速回到上限
+- 机器空闲（Windows 上一段时间没有键盘鼠标输入，其他平台看系统负载）而且磁盘没有
+  争用时不再等待，全速扫描
+- Windows 上把扫描线程切换到后台模式（THREAD_MODE_BACKGROUND_BEGIN），系统会降低
+  它们的 I/O 和内存优先级
+
+写入线程在后台模式下拉长两次提交之间的最短间隔，减少提交和落盘的次数。
+
+PROFILES 中是几组预设，from_profile() 按名称创建，也可以单独覆盖其中的参数。
+"""
+import os
+import threading
+import time
+
+# 每个预设：文件/秒上限、扫描线程数、两次提交之间的最短秒数、机器空闲多少秒后全速
+PROFILES = {
+    'full': None,
+    'balanced': {'max_files_per_sec': 20000, 'workers': 2, 'min_commit_interval': 5.0, 'idle_after': 120},
+    'gentle': {'max_files_per_sec': 2000, 'workers': 1, 'min_commit_interval': 15.0, 'idle_after': 300},
+}
+DEFAULT_PROFILE = 'full'
+PROFILE_NAMES = {'full': '全速', 'balanced': '后台（均衡）', 'gentle': '后台（低影响）'}
+
+# 每隔多少秒根据列目录耗时调整一次速率
+ADJUST_INTERVAL = 1.0
+# 列目录耗时按每多少个目录项折算成一个目录，大目录不会被误判为磁盘变慢
+ENTRIES_PER_DIR = 100
+# 非 Windows 平台上每个 CPU 的 1 分钟负载低于这个值视为空闲
+IDLE_LOAD_PER_CPU = 0.3
+
+THREAD_MODE_BACKGROUND_BEGIN = 0x00010000
+
+
+def enter_background_mode():
+    """把当前线程切换到后台模式（只在 Windows 上有效），返回是否成功"""
+    if os.name != 'nt':
+        return False
+    try:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        return bool(kernel32.SetThreadPriority(kernel32.GetCurrentThread(), THREAD_MODE_BACKGROUND_BEGIN))
+    except (OSError, AttributeError):
+        return False
+
+
+def user_idle_seconds():
+    """距离最后一次键盘鼠标输入的秒数，不支持的平台返回 None"""
+    if os.name != 'nt':
+        return None
+    try:
+        import ctypes
+
+        class LASTINPUTINFO(ctypes.Structure):
+            _fields_ = [('cbSize', ctypes.c_uint), ('dwTime', ctypes.c_uint)]
+
+        info = LASTINPUTINFO()
+        info.cbSize = ctypes.sizeof(info)
+        if not ctypes.windll.user32.GetLastInputInfo(ctypes.byref(info)):
+            return None
+        # 两个值都是 32 位毫秒计数，回绕时按无符号相减
+        return ((ctypes.windll.kernel32.GetTickCount() - info.dwTime) & 0xFFFFFFFF) / 1000.0
+    except (OSError, AttributeError):
+        return None
+
+
+def low_load():
+    """系统负载是否很低，不支持 getloadavg 的平台返回 False"""
+    try:
+        load = os.getloadavg()[0]
+    except (OSError, AttributeError):
+        return False
+    return load < (os.cpu_count() or 1) * IDLE_LOAD_PER_CPU
+
+
+class Throttle:
+    def __init__(self, max_files_per_sec, min_files_per_sec=None, contention_ratio=3.0, latency_floor=0.002,
+                 idle_after=None, workers=None, min_commit_interval=0.0, background_priority=True,
+                 metrics=None):
+        self.max_rate = float(max_files_per_sec)
+        self.min_rate = float(min_files_per_sec or max(50.0, self.max_rate / 20))
+        self.rate = self.max_rate
+        # 列目录耗时超过最低水平的多少倍视为磁盘争用；低于 latency_floor 秒的耗时不算争用
+        self.contention_ratio = contention_ratio
+        self.latency_floor = latency_floor
+        # 机器空闲多少秒后全速扫描，None 表示始终限速
+        self.idle_after = idle_after
+        # 扫描线程数和写入线程两次提交之间的最短间隔，由调用方交给扫描器和写入线程
+        self.workers = workers
+        self.min_commit_interval = min_commit_interval
+        self.background_priority = background_priority
+        self.metrics = metrics
+
+        self.idle = False
+        self._quiet_since = None
+        self.contended = False
+        self.backoffs = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # 下一个目录最早可以开始的时间
+        self._next_time = 0.0
+        self._latency = None
+        self._baseline = None
+        self._adjusted_at = time.monotonic()
+
+    @classmethod
+    def from_profile(cls, name, metrics=None, **overrides):
+        """按预设名称创建，'full' 返回 None（不限速）"""
+        if name not in PROFILES:
+            raise ValueError(f"未知的索引速度: {name}，可选: {', '.join(PROFILES)}")
+        settings = dict(PROFILES[name] or {})
+        settings.update({key: value for key, value in overrides.items() if value is not None})
+        if 'max_files_per_sec' not in settings:
+            return None
+        return cls(metrics=metrics, **settings)
+
+    def pace(self, latency, entries):
+        """列完一个目录后调用：latency 是列目录的秒数，entries 是目录项数，必要时在这里等待"""
+        if self.background_priority and not getattr(self._local, 'background', False):
+            self._local.background = True
+            enter_background_mode()
+
+        now = time.monotonic()
+        with self._lock:
+            self._observe(latency / (1 + entries / ENTRIES_PER_DIR), now)
+            if self.idle:
+                self._next_time = now
+                return
+            start = max(now, self._next_time)
+            self._next_time = start + (entries + 1) / self.rate
+        delay = start - now
+        if delay > 0:
+            if self.metrics is not None:
+                self.metrics.add_time('scan.throttle', delay)
+            time.sleep(delay)
+
+    def _observe(self, latency, now):
+        # 指数滑动平均平滑单个目录的抖动
+        self._latency = latency if self._latency is None else self._latency + 0.1 * (latency - self._latency)
+        if self._baseline is None or self._latency < self._baseline:
+            self._baseline = self._latency
+        if now - self._adjusted_at < ADJUST_INTERVAL:
+            return
+        self._adjusted_at = now
+        # 最低水平每次调整上浮 1%，磁盘状态长期改变（例如从缓存转到冷数据）后可以重新适应，
+        # 持续几十秒的争用不会被当成新的常态
+        self._baseline *= 1.01
+
+        self.contended = self._latency > max(self.latency_floor, self._baseline * self.contention_ratio)
+        if self.contended:
+            # 加性增、乘性减：争用时立即让出磁盘，恢复后逐步加速
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.backoffs += 1
+            if self.metrics is not None:
+                self.metrics.count('throttle.backoffs')
+        else:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+        self.idle = self._idle_for() >= self.idle_after if self.idle_after is not None else False
+
+    def _idle_for(self):
+        """机器已经空闲了多少秒：Windows 上是用户多久没有输入，其他平台是系统负载持续很低的时间"""
+        if self.contended:
+            self._quiet_since = None
+            return 0.0
+        seconds = user_idle_seconds()
+        if seconds is not None:
+            return seconds
+        now = time.monotonic()
+        if not low_load():
+            self._quiet_since = None
+            return 0.0
+        if self._quiet_since is None:
+            self._quiet_since = now
+        return now - self._quiet_since
+
+    def describe(self):
+        """状态栏上显示的当前限速状态"""
+        if self.idle:
+            return "机器空闲，全速扫描"
+        state = "磁盘繁忙，已降速" if self.contended else "后台模式"
+        return f"{state}：{self.rate:,.0f} 文件/秒"
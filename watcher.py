@@ -0,0 +1,488 @@
+"""实时文件变化监控
+
+ChangeTracker 在后台线程中接收事件源上报的路径变化，合并去重并防抖后，
+在一个事务中批量应用到 files 表，使打开的索引保持最新。
+
+事件源是可插拔的：
+- InotifyEventSource: Linux inotify（通过 ctypes 调用 libc，无额外依赖）
+- WindowsEventSource: Windows ReadDirectoryChangesW（需要 pywin32）
+- PollingEventSource: 定期让增量索引检查目录修改时间，任何平台都可用
+
+事件源只需要调用 emit(kind, path)：
+- 'changed': path 可能被创建、修改或删除，应用时重新 stat 判断
+- 'rescan': path 目录下的变化无法逐个确定（例如事件队列溢出），对该子树做增量同步
+"""
+import os
+import sqlite3
+import stat
+import struct
+import sys
+import threading
+import time
+
+from index_db import create_tables, file_row, delete_subtree, iter_dir_paths, UPSERT_FILE_SQL
+from dir_sizes import refresh_rollups
+from name_keys import update_name_keys
+from incremental import IncrementalIndexer, IncrementalStats
+from scanner import FileEntry, is_hidden_or_system, should_skip_dir
+
+CHANGED = 'changed'
+RESCAN = 'rescan'
+
+
+class PollingEventSource:
+    """轮询事件源：每隔一段时间对所有根目录发出 rescan 事件"""
+    name = 'polling'
+
+    def __init__(self, roots, interval=300):
+        self.roots = list(roots)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, emit):
+        def loop():
+            while not self._stop.wait(self.interval):
+                for root in self.roots:
+                    emit(RESCAN, root)
+
+        self._thread = threading.Thread(target=loop, name='PollingEventSource', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class InotifyEventSource:
+    """Linux inotify 事件源
+
+    inotify 不支持递归监控，需要为每个目录单独添加 watch。known_dirs 可以提供数据库中
+    已记录的目录列表，避免启动时再遍历一次文件系统。
+    """
+    name = 'inotify'
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+    _EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, roots, known_dirs=None):
+        import ctypes
+        import ctypes.util
+
+        self.roots = list(roots)
+        self.known_dirs = known_dirs
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._ctypes = ctypes
+        self._fd = None
+        self._wd_paths = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self.WATCH_MASK)
+        if wd < 0:
+            errno = self._ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch 失败: {os.strerror(errno)}", path)
+        self._wd_paths[wd] = path
+
+    def _watch_tree(self, path):
+        for top, dirs, _ in os.walk(path):
+            dirs[:] = [d for d in dirs if not should_skip_dir(d)]
+            try:
+                self._add_watch(top)
+            except OSError as e:
+                if e.errno == 28:  # ENOSPC：超过 max_user_watches
+                    raise
+                continue
+
+    def start(self, emit):
+        fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(self._ctypes.get_errno(), "inotify_init1 失败")
+        self._fd = fd
+
+        if self.known_dirs is not None:
+            for path in self.known_dirs():
+                try:
+                    self._add_watch(path)
+                except OSError as e:
+                    if e.errno == 28:
+                        raise
+        else:
+            for root in self.roots:
+                self._watch_tree(root)
+
+        self._thread = threading.Thread(target=self._loop, args=(emit,), name='InotifyEventSource', daemon=True)
+        self._thread.start()
+
+    def _loop(self, emit):
+        import select
+
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._fd], [], [], 0.5)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self._EVENT_HEADER.unpack_from(data, offset)
+                offset += self._EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+
+                if mask & self.IN_Q_OVERFLOW:
+                    for root in self.roots:
+                        emit(RESCAN, root)
+                    continue
+                if mask & self.IN_IGNORED:
+                    self._wd_paths.pop(wd, None)
+                    continue
+
+                parent = self._wd_paths.get(wd)
+                if parent is None:
+                    continue
+                if not name:
+                    # 被监控的目录自身被删除或移动
+                    emit(CHANGED, parent)
+                    continue
+
+                path = os.path.join(parent, name)
+                if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    # 新目录需要补上 watch，并同步其中已经存在的内容
+                    try:
+                        self._watch_tree(path)
+                    except OSError:
+                        pass
+                    emit(RESCAN, path)
+                else:
+                    emit(CHANGED, path)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class WindowsEventSource:
+    """Windows ReadDirectoryChangesW 事件源，每个根目录一个递归监控线程"""
+    name = 'windows'
+
+    FILE_LIST_DIRECTORY = 0x0001
+
+    def __init__(self, roots, known_dirs=None):
+        import win32file
+        import win32con
+
+        self.roots = list(roots)
+        self._win32file = win32file
+        self._win32con = win32con
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self, emit):
+        for root in self.roots:
+            thread = threading.Thread(target=self._watch_root, args=(root, emit),
+                                      name=f'WindowsEventSource({root})', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _watch_root(self, root, emit):
+        import pywintypes
+        import win32event
+
+        win32file = self._win32file
+        win32con = self._win32con
+        handle = win32file.CreateFile(
+            root,
+            self.FILE_LIST_DIRECTORY,
+            win32con.FILE_SHARE_READ | win32con.FILE_SHARE_WRITE | win32con.FILE_SHARE_DELETE,
+            None,
+            win32con.OPEN_EXISTING,
+            win32con.FILE_FLAG_BACKUP_SEMANTICS | win32con.FILE_FLAG_OVERLAPPED,
+            None
+        )
+        flags = (win32con.FILE_NOTIFY_CHANGE_FILE_NAME |
+                 win32con.FILE_NOTIFY_CHANGE_DIR_NAME |
+                 win32con.FILE_NOTIFY_CHANGE_SIZE |
+                 win32con.FILE_NOTIFY_CHANGE_LAST_WRITE)
+        overlapped = pywintypes.OVERLAPPED()
+        overlapped.hEvent = win32event.CreateEvent(None, True, False, None)
+        buffer = win32file.AllocateReadBuffer(64 * 1024)
+
+        try:
+            while not self._stop.is_set():
+                win32file.ReadDirectoryChangesW(handle, buffer, True, flags, overlapped)
+                while not self._stop.is_set():
+                    if win32event.WaitForSingleObject(overlapped.hEvent, 500) == win32event.WAIT_OBJECT_0:
+                        break
+                else:
+                    win32file.CancelIo(handle)
+                    break
+
+                size = win32file.GetOverlappedResult(handle, overlapped, True)
+                if size == 0:
+                    # 缓冲区溢出，变化已经丢失，只能重新同步整个根目录
+                    emit(RESCAN, root)
+                    continue
+                # 重命名的旧路径、被删除的目录等在应用时 stat 失败，会连同子树一起删除
+                for _, name in win32file.FILE_NOTIFY_INFORMATION(buffer, size):
+                    emit(CHANGED, os.path.join(root, name))
+        finally:
+            win32file.CloseHandle(handle)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+
+EVENT_SOURCES = {
+    PollingEventSource.name: PollingEventSource,
+    InotifyEventSource.name: InotifyEventSource,
+    WindowsEventSource.name: WindowsEventSource,
+}
+
+
+def default_event_source_name():
+    """当前平台首选的事件源"""
+    if os.name == 'nt':
+        return WindowsEventSource.name
+    if sys.platform.startswith('linux'):
+        return InotifyEventSource.name
+    return PollingEventSource.name
+
+
+class ChangeTracker:
+    """后台变化跟踪服务
+
+    启动后先在后台对数据库中的根目录同步一次，再应用实时事件。
+    事件在 pending 中按路径合并，距离最后一个事件超过 debounce 秒（或者距离第一个未应用
+    事件超过 max_delay 秒）后，在一个事务里批量应用。
+    """
+
+    def __init__(self, db_path, source_name=None, debounce=1.0, max_delay=10.0,
+                 poll_interval=300, on_applied=None):
+        self.db_path = db_path
+        self.source_name = source_name or default_event_source_name()
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.on_applied = on_applied
+        self.source = None
+        self.roots = []
+
+        self._changed = set()
+        self._rescan = set()
+        self._first_event = None
+        self._last_event = None
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    def _known_dirs(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return [path for _, path in iter_dir_paths(conn)]
+        finally:
+            conn.close()
+
+    def _create_source(self):
+        if self.source_name == PollingEventSource.name:
+            return PollingEventSource(self.roots, interval=self.poll_interval)
+        return EVENT_SOURCES[self.source_name](self.roots, known_dirs=self._known_dirs)
+
+    def start(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            create_tables(conn)
+            self.roots = IncrementalIndexer(self.db_path).stored_roots(conn)
+        finally:
+            conn.close()
+        if not self.roots:
+            raise ValueError("数据库中没有目录信息，请先完整索引一次")
+
+        try:
+            self.source = self._create_source()
+            self.source.start(self.emit)
+        except (OSError, ImportError) as e:
+            # 原生事件源不可用（例如 watch 数量超限或缺少 pywin32），退回轮询
+            print(f"事件源 {self.source_name} 不可用，改用轮询: {e}")
+            if self.source is not None:
+                self.source.stop()
+            self.source_name = PollingEventSource.name
+            self.source = self._create_source()
+            self.source.start(self.emit)
+
+        self._thread = threading.Thread(target=self._loop, name='ChangeTracker', daemon=True)
+        self._thread.start()
+        print(f"实时监控已启动: {self.source_name}, 根目录: {self.roots}")
+
+    def stop(self):
+        if self.source is not None:
+            self.source.stop()
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def emit(self, kind, path):
+        """事件源回调，可以在任意线程中调用"""
+        now = time.monotonic()
+        with self._cond:
+            if kind == RESCAN:
+                self._rescan.add(path)
+            else:
+                self._changed.add(path)
+            if self._first_event is None:
+                self._first_event = now
+            self._last_event = now
+            self._cond.notify()
+
+    def _take_pending(self):
+        """等待防抖时间到期，取出待应用的事件；停止时返回 None"""
+        with self._cond:
+            while True:
+                if self._stop:
+                    return None
+                if self._first_event is None:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                quiet_until = self._last_event + self.debounce
+                deadline = self._first_event + self.max_delay
+                if now >= quiet_until or now >= deadline:
+                    changed, rescan = self._changed, self._rescan
+                    self._changed, self._rescan = set(), set()
+                    self._first_event = self._last_event = None
+                    return changed, rescan
+                self._cond.wait(min(quiet_until, deadline) - now)
+
+    def _catch_up(self):
+        """启动时对所有根目录同步一次，补上监控启动之前（程序未运行期间）发生的变化"""
+        try:
+            stats = self.apply(set(), set(self.roots))
+            if self.on_applied:
+                self.on_applied(stats)
+        except Exception as e:
+            print(f"启动同步时出错: {e}")
+
+    def _loop(self):
+        # 同步期间到达的事件留在 pending 中，同步完成后再应用
+        self._catch_up()
+        while True:
+            pending = self._take_pending()
+            if pending is None:
+                return
+            try:
+                stats = self.apply(*pending)
+                if self.on_applied:
+                    self.on_applied(stats)
+            except Exception as e:
+                print(f"应用文件变化时出错: {e}")
+
+    def _in_roots(self, path):
+        for root in self.roots:
+            if path == root or path.startswith(root if root.endswith(os.sep) else root + os.sep):
+                return True
+        return False
+
+    def _in_skipped_dir(self, path):
+        """path 是否位于扫描时会跳过的目录之下"""
+        for root in self.roots:
+            if path.startswith(root):
+                rel = path[len(root):].strip(os.sep)
+                return any(should_skip_dir(part) for part in rel.split(os.sep)[:-1] if part)
+        return False
+
+    def apply(self, changed, rescan):
+        """在一个事务中应用一批合并后的变化"""
+        stats = IncrementalStats()
+        begin = time.perf_counter()
+
+        rescan = {p for p in rescan if self._in_roots(p)}
+        # 已经被 rescan 覆盖的路径不需要单独处理
+        rescan_prefixes = tuple(p if p.endswith(os.sep) else p + os.sep for p in rescan)
+        changed = {p for p in changed
+                   if self._in_roots(p) and p not in rescan and not p.startswith(rescan_prefixes)}
+
+        indexer = IncrementalIndexer(self.db_path)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            paths = indexer.dir_paths(conn)
+            upserts = []
+            for path in sorted(changed):
+                if self._in_skipped_dir(path):
+                    continue
+                parent, name = os.path.split(path)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # 已被删除或移走：删除文件记录以及可能存在的目录子树
+                    parent_id = paths.lookup(parent)
+                    if parent_id is not None:
+                        cur = conn.execute("DELETE FROM files WHERE dir_id = ? AND filename = ?", (parent_id, name))
+                        stats.deleted += cur.rowcount
+                    dir_id = paths.lookup(path)
+                    if dir_id is not None:
+                        stats.deleted += delete_subtree(conn, dir_id)
+                        paths.forget(path)
+                    continue
+
+                if stat.S_ISDIR(st.st_mode):
+                    if not should_skip_dir(name):
+                        indexer.sync_subtree(conn, path, stats, default_parent=parent)
+                    continue
+
+                if is_hidden_or_system(name, st):
+                    continue
+                parent_id = paths.lookup(parent)
+                if parent_id is None:
+                    # 所在目录还没有记录，同步整个目录
+                    indexer.sync_subtree(conn, parent, stats, default_parent=os.path.dirname(parent))
+                    continue
+                upserts.append(file_row(parent_id, FileEntry(path, name, st.st_size, st.st_mtime)))
+
+            if upserts:
+                conn.executemany(UPSERT_FILE_SQL, upserts)
+                stats.upserted += len(upserts)
+
+            for path in sorted(rescan):
+                if self._in_skipped_dir(path) or should_skip_dir(os.path.basename(path)):
+                    continue
+                indexer.sync_subtree(conn, path, stats, default_parent=os.path.dirname(path))
+
+            refresh_rollups(conn)
+            update_name_keys(conn)
+            conn.commit()
+        finally:
+            conn.close()
+
+        stats.elapsed = time.perf_counter() - begin
+        print(f"实时监控已应用变化: {stats}")
+        return stats